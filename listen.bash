@@ -1,7 +1,8 @@
 #!/bin/bash
 
 run (){
-    venv/bin/voca manage /tmp/voca/sock & sleep 1 && fg
+    venv/bin/voca manage --socket /tmp/voca/sock &
+    sleep 1
     venv/bin/voca mic | nc -U /tmp/voca/sock
 }
 
@@ -1,20 +1,31 @@
 import os
 import sys
 
+from typing import Optional
+
 import eliot
 
+import voca.context
 import voca.log
+import voca.parsing
 
 
-def main(should_log: bool) -> None:
+def main(
+    should_log: bool, production: bool = False, context_ttl: Optional[float] = None
+) -> None:
     """
     Set up the app execution environment.
 
     Args:
         should_log: Enable or disable logging.
+        production: Build parsers without lark's debugging checks.
+        context_ttl: Seconds to reuse the current window's title between messages.
 
     """
 
+    voca.parsing.PARSER_OPTIONS["debug"] = not production
+    voca.context.TITLE_TTL = context_ttl
+
     if not should_log:
         return
 
@@ -152,6 +152,8 @@ class RepeatedAction:
         # arg should be a mapping of values said
         times = int(arg[self.extra])
         for _ in range(times):
+            # Let a cancelled command stop between repetitions.
+            await trio.sleep(0)
             await self.action.execute(arg)
 
 
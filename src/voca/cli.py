@@ -14,6 +14,7 @@ Why does this file exist, and why not put this in __main__?
 
   Also see (1) from http://click.pocoo.org/5/setuptools/#setuptools-integration
 """
+import json
 import sys
 import types
 import os
@@ -24,10 +25,12 @@ import eliot
 
 from voca import app
 from voca import listen
+from voca import forkserver
 from voca import manager
 from voca import worker
 from voca import log
 from voca import config
+from voca import streaming
 
 
 CONTEXT_SETTINGS = {"auto_envvar_prefix": "VOCA"}
@@ -43,8 +46,59 @@ def log_cli_call(f):
     return wrap
 
 
+def recycle_options(f):
+    """Add the options controlling when persistent workers are replaced."""
+    options = [
+        click.option(
+            "--max-commands",
+            type=int,
+            default=None,
+            help="Replace a worker after it handles this many commands.",
+        ),
+        click.option(
+            "--max-seconds",
+            type=float,
+            default=None,
+            help="Replace a worker once it has been running this long.",
+        ),
+        click.option(
+            "--exit-on-error/--keep-on-error",
+            "exit_on_error",
+            is_flag=True,
+            default=True,
+            help="Replace a worker when a command raises an exception.",
+        ),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def framing_option(default: str):
+    """Add the option choosing how the manager and its workers frame their messages."""
+    return click.option(
+        "--framing",
+        type=click.Choice(sorted(streaming.FRAMINGS)),
+        default=default,
+        help="Frame messages between the manager and its workers as json lines or length-prefixed binary. "
+        "The manager starts its workers with json lines and switches the ones that support its framing.",
+    )
+
+
 @click.group(context_settings=CONTEXT_SETTINGS)
 @click.option("--log/--no-log", "should_log", is_flag=True, default=True)
+@click.option(
+    "--production/--development",
+    is_flag=True,
+    default=False,
+    help="Build parsers without lark's debugging checks.",
+)
+@click.option(
+    "--context-ttl",
+    type=float,
+    default=None,
+    help="Seconds to reuse the current window's title between commands.",
+)
 @click.pass_context
 def cli(ctx, **kwargs):
     ctx.obj = types.SimpleNamespace()
@@ -96,17 +150,104 @@ def _listen(**kwargs):
 )
 @click.option("--import-path", "-i", "module_names", multiple=True, default=None)
 @click.option("--num-workers", type=int, default=5)
+@click.option(
+    "--min-workers",
+    type=int,
+    default=None,
+    help="Shrink the pool to this many workers when idle. Defaults to --num-workers.",
+)
+@click.option(
+    "--max-workers",
+    type=int,
+    default=None,
+    help="Grow the pool to this many workers under load. Defaults to --num-workers.",
+)
+@click.option(
+    "--max-worker-memory",
+    type=float,
+    default=None,
+    help="Replace a worker from a warm spare once it uses this many MiB of memory.",
+)
+@click.option(
+    "--recycle-after",
+    type=int,
+    default=None,
+    help="Replace a worker from a warm spare once it has run this many commands.",
+)
+@click.option(
+    "--max-in-flight",
+    type=int,
+    default=None,
+    help="Parse up to this many commands at once. Defaults to the number of workers.",
+)
+@click.option(
+    "--command-timeout",
+    type=float,
+    default=None,
+    help="Kill and replace a worker whose command runs longer than this many seconds.",
+)
+@click.option(
+    "--eager-settle",
+    type=float,
+    default=manager.EAGER_SETTLE,
+    help="In eager mode, run a partial transcript's commands once it is unchanged for this many seconds.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    default=None,
+    help="Accept clients on this Unix socket instead of reading stdin.",
+)
+@click.option(
+    "--tcp-port",
+    type=int,
+    default=None,
+    help="Accept clients on this port of localhost instead of reading stdin.",
+)
+@click.option(
+    "--remote-port",
+    type=int,
+    default=None,
+    help="Accept workers started with `voca worker --connect` on this port.",
+)
+@click.option(
+    "--remote-host",
+    default="127.0.0.1",
+    help="Accept remote workers on this address. Use 0.0.0.0 for other machines.",
+)
+@click.option(
+    "--remote-token",
+    default=None,
+    envvar="VOCA_REMOTE_TOKEN",
+    help="Accept only remote workers that send this secret. Needed off localhost.",
+)
+@click.option(
+    "--fork-server/--no-fork-server",
+    "use_fork_server",
+    is_flag=True,
+    default=False,
+    help="Fork workers from a process that has already imported the plugins. Linux only.",
+)
+@framing_option("lines")
+@recycle_options
 @click.pass_obj
 @log_cli_call
 def _manage(obj, **kwargs):
+    if (
+        kwargs["remote_port"] is not None
+        and not kwargs["remote_token"]
+        and not manager.is_loopback(kwargs["remote_host"])
+    ):
+        raise click.UsageError("--remote-host off localhost needs a --remote-token.")
     log_filename = log.get_log_filename()
     with open(log_filename, "w") as log_file:
         eliot.add_destinations(log.json_to_file(log_file))
+        log.add_raw_destination(log_file)
 
         manager.main(**obj.kwargs, **kwargs)
 
 
-@cli.command("worker", help="Start a worker executing commands from stdin.")
+@cli.command("worker", help="Start a persistent worker executing commands from stdin.")
 @click.option("import_paths", "-i", multiple=True)
 @click.option("--patch-caster", is_flag=True, default=False, envvar="VOCA_PATCH_CASTER")
 @click.option(
@@ -115,14 +256,89 @@ def _manage(obj, **kwargs):
     is_flag=True,
     default=True,
 )
+@click.option(
+    "--connect",
+    default=None,
+    metavar="HOST:PORT",
+    help="Serve a manager's --remote-port over TCP instead of stdin and stdout, in json lines.",
+)
+@click.option(
+    "--token",
+    default=None,
+    envvar="VOCA_REMOTE_TOKEN",
+    help="The manager's --remote-token, to send when connecting.",
+)
+@click.option(
+    "--prefer-backup-modules",
+    is_flag=True,
+    default=False,
+    help="Import the backups of the modules that last started a worker, instead of the modules.",
+)
+@framing_option("lines")
+@recycle_options
 @click.pass_obj
 @log_cli_call
-def _worker(obj, patch_caster, **kwargs):
+def _worker(obj, patch_caster, framing, connect, token, **kwargs):
 
-    eliot.add_destinations(log.json_to_file(sys.stdout))
+    file = None
+    if connect is not None:
+        file = worker.connect(connect, token)
+        framing = "lines"
+    worker.open_output(streaming.FRAMINGS[framing], file)
+    eliot.add_destinations(log.json_to_frames(worker.output))
 
     if patch_caster:
         from voca import caster_adapter
 
         caster_adapter.patch_all()
     worker.main(**kwargs)
+
+
+@cli.command(
+    "parsers",
+    help="Show which parser each grammar uses, and why faster parsers were rejected.",
+)
+@click.option("import_paths", "-i", multiple=True)
+@click.option("--patch-caster", is_flag=True, default=False, envvar="VOCA_PATCH_CASTER")
+@click.option(
+    "--backup-modules/--no-backup-modules",
+    "use_backup_modules",
+    is_flag=True,
+    default=True,
+)
+def _parsers(patch_caster, **kwargs):
+    if patch_caster:
+        from voca import caster_adapter
+
+        caster_adapter.patch_all()
+    for row in worker.parser_report(**kwargs):
+        click.echo(json.dumps(row))
+
+
+@cli.command(
+    "forkserver",
+    help="Import the plugins once and fork workers for the manager on request.",
+)
+@click.option("import_paths", "-i", multiple=True)
+@click.option("--patch-caster", is_flag=True, default=False, envvar="VOCA_PATCH_CASTER")
+@click.option(
+    "--backup-modules/--no-backup-modules",
+    "use_backup_modules",
+    is_flag=True,
+    default=True,
+)
+@click.option("--control-fd", type=int, required=True)
+@framing_option("lines")
+@recycle_options
+@click.pass_obj
+@log_cli_call
+def _forkserver(obj, patch_caster, framing, **kwargs):
+
+    worker.open_output(streaming.FRAMINGS[framing])
+    eliot.add_destinations(log.json_to_frames(worker.output))
+
+    if patch_caster:
+        from voca import caster_adapter
+
+        caster_adapter.patch_all()
+    forkserver.main(framing=framing, **kwargs)
@@ -7,6 +7,10 @@ pulled from https://pypi.org/project/appdirs/.
 
 import os
 import pathlib
+import tempfile
+
+from typing import BinaryIO
+from typing import Callable
 
 import appdirs
 
@@ -19,3 +23,17 @@ def get_config_dir() -> pathlib.Path:
     return pathlib.Path(
         os.environ.get("VOCA_CONFIG_DIR") or appdirs.user_config_dir("voca")
     )
+
+
+@utils.public
+def write_atomically(path: pathlib.Path, write: Callable[[BinaryIO], None]) -> None:
+    """Write a file under a temporary name and rename it, so readers never see half of it."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with open(fd, "wb") as f:
+            write(f)
+        os.replace(temporary, path)
+    except Exception:
+        os.unlink(temporary)
+        raise
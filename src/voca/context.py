@@ -5,12 +5,18 @@ from __future__ import annotations
 
 import subprocess
 
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
 from typing_extensions import Protocol
 
 import attr
 import trio
 
 
+from voca import focus
 from voca import platforms
 from voca import log
 from voca import utils
@@ -30,12 +36,79 @@ async def get_current_window_title() -> str:
 @platforms.implementation(platforms.System.LINUX)
 async def get_current_window_title():
     """Get the title of the current window."""
+    tracker = focus.get_tracker()
+    if tracker is not None:
+        return tracker.current.title
     proc = await utils.run_subprocess(
         ["/usr/bin/xdotool", "getwindowfocus", "getwindowname"], stdout=subprocess.PIPE
     )
     return proc.stdout.decode()[:-1]
 
 
+# Seconds to reuse a window title across messages. ``app.main`` sets it from ``--context-ttl``.
+TITLE_TTL: Optional[float] = None
+
+
+@attr.s
+class _TitleCache:
+    title: Optional[str] = attr.ib(default=None)
+    fetched_at: Optional[float] = attr.ib(default=None)
+
+
+_title_cache = _TitleCache()
+
+
+@utils.public
+async def get_cached_window_title() -> str:
+    """Get the title of the current window, reusing it for ``TITLE_TTL`` seconds."""
+    now = trio.current_time()
+    if (
+        TITLE_TTL is not None
+        and _title_cache.fetched_at is not None
+        and now - _title_cache.fetched_at < TITLE_TTL
+    ):
+        return _title_cache.title
+    title = await get_current_window_title()
+    _title_cache.title, _title_cache.fetched_at = title, now
+    return title
+
+
+@utils.public
+@attr.s
+class WindowSnapshot:
+    """The current window for one message, fetched once however many contexts check it."""
+
+    _title: Optional[str] = attr.ib(default=None)
+    _lock: trio.Lock = attr.ib(factory=trio.Lock)
+
+    @classmethod
+    def from_data(cls, data: dict) -> WindowSnapshot:
+        """Use the window the manager resolved for this message, if it sent one."""
+        resolved = data.get("context") or {}
+        return cls(resolved.get("title"))
+
+    async def title(self) -> str:
+        """Get the title of the window that was current when first asked."""
+        async with self._lock:
+            if self._title is None:
+                self._title = await get_cached_window_title()
+        return self._title
+
+
+@log.to_serializable.register(WindowSnapshot)
+def _(snapshot):
+    return {"type": "WindowSnapshot", "title": snapshot._title}
+
+
+@utils.public
+async def current_context() -> Dict[str, Any]:
+    """Describe the current window, for the manager to send along with a command."""
+    tracker = focus.get_tracker()
+    if tracker is not None:
+        return attr.asdict(tracker.current)
+    return {"title": await get_cached_window_title()}
+
+
 @utils.public
 @attr.dataclass
 class WindowContext:
@@ -45,21 +118,48 @@ class WindowContext:
 
     async def check(self, data=None) -> bool:
         """Check whether the required name occurs within the current window title."""
-        current_title = await get_current_window_title()
+        snapshot = data.get("window") if data else None
+        if snapshot is None:
+            current_title = await get_cached_window_title()
+        else:
+            current_title = await snapshot.title()
         return self.title in current_title
 
 
+@utils.public
+@attr.dataclass
+class StateContext:
+    """Match when a key of the shared state has a value, such as a plugin's mode."""
+
+    key: str
+    value: Any = True
+
+    async def check(self, data=None) -> bool:
+        """Check the state that came with the command."""
+        values = data.get("state") if data else None
+        return values is not None and values.get(self.key) == self.value
+
+
 @utils.public
 @log.log_async_call
 async def filter_wrappers(
     wrapper_group: utils.WrapperGroup, data: dict
 ) -> utils.WrapperGroup:
-    """Exclude wrappers that fail to match the current context."""
-    allowed = []
-    for wrapper in wrapper_group.wrappers:
+    """Exclude wrappers that fail to match the current context, checking them concurrently."""
+    data = dict(data or {})
+    data.setdefault("window", WindowSnapshot.from_data(data))
+    results: List[bool] = [False] * len(wrapper_group.wrappers)
+
+    async def check(i, wrapper):
+        results[i] = await wrapper.context.check(data)
+
+    async with trio.open_nursery() as nursery:
+        for i, wrapper in enumerate(wrapper_group.wrappers):
+            nursery.start_soon(check, i, wrapper)
 
-        if await wrapper.context.check(data):
-            allowed.append(wrapper)
+    allowed = [
+        wrapper for wrapper, result in zip(wrapper_group.wrappers, results) if result
+    ]
     return utils.WrapperGroup(allowed)
 
 
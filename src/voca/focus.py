@@ -0,0 +1,192 @@
+"""Track the focused window by following X events.
+
+Asking ``xdotool`` for the window title spawns a process for every check. The
+focus tracker instead keeps one X connection open in a background thread,
+watches the root window's ``_NET_ACTIVE_WINDOW`` property and the active
+window's title, and keeps the current title, class, and pid in memory.
+
+Only the manager runs a tracker. It sends the window it found along with each
+command, so workers never connect to X themselves.
+"""
+
+from __future__ import annotations
+
+import os
+import platform
+import select
+import threading
+
+from typing import Dict
+from typing import Optional
+
+import attr
+import eliot
+
+from voca import utils
+
+
+try:
+    import Xlib.X
+    import Xlib.Xatom
+    import Xlib.display
+    import Xlib.error
+except ImportError as e:
+    Xlib = utils.ModuleLazyRaise("Xlib", e)
+
+
+_ATOM_NAMES = ["_NET_ACTIVE_WINDOW", "_NET_WM_NAME", "_NET_WM_PID", "UTF8_STRING"]
+
+
+@utils.public
+@attr.dataclass(frozen=True)
+class FocusedWindow:
+    """The window that has the focus."""
+
+    title: str = ""
+    wm_class: str = ""
+    pid: Optional[int] = None
+
+
+@utils.public
+@attr.s
+class FocusTracker:
+    """Follow the active window over a single X connection."""
+
+    display: Xlib.display.Display = attr.ib()
+    current: FocusedWindow = attr.ib(factory=FocusedWindow)
+    atoms: Dict[str, int] = attr.ib(factory=dict)
+    _window = attr.ib(default=None)
+    _thread: Optional[threading.Thread] = attr.ib(default=None)
+    _wakeup_read: int = attr.ib(default=-1)
+    _wakeup_write: int = attr.ib(default=-1)
+
+    @classmethod
+    def start(cls, display_name: Optional[str] = None) -> FocusTracker:
+        """Connect to the X server and follow the focus in a daemon thread."""
+        tracker = cls(Xlib.display.Display(display_name))
+        tracker._wakeup_read, tracker._wakeup_write = os.pipe()
+        for name in _ATOM_NAMES:
+            tracker.atoms[name] = tracker.display.intern_atom(name)
+        root = tracker.display.screen().root
+        root.change_attributes(event_mask=Xlib.X.PropertyChangeMask)
+        tracker.refresh()
+        tracker._thread = threading.Thread(
+            target=tracker.run, name="focus-tracker", daemon=True
+        )
+        tracker._thread.start()
+        return tracker
+
+    def _active_window(self):
+        root = self.display.screen().root
+        prop = root.get_full_property(
+            self.atoms["_NET_ACTIVE_WINDOW"], Xlib.X.AnyPropertyType
+        )
+        if prop is None or not prop.value or not prop.value[0]:
+            return None
+        return self.display.create_resource_object("window", prop.value[0])
+
+    def _describe(self, window) -> FocusedWindow:
+        name = window.get_full_property(
+            self.atoms["_NET_WM_NAME"], self.atoms["UTF8_STRING"]
+        )
+        if name is not None:
+            title = name.value.decode("utf-8", "replace")
+        else:
+            title = window.get_wm_name() or ""
+            if isinstance(title, bytes):
+                title = title.decode("latin-1")
+        wm_class = window.get_wm_class()
+        pid = window.get_full_property(
+            self.atoms["_NET_WM_PID"], Xlib.X.AnyPropertyType
+        )
+        return FocusedWindow(
+            title=title,
+            wm_class=wm_class[-1] if wm_class else "",
+            pid=int(pid.value[0]) if pid is not None and pid.value else None,
+        )
+
+    def refresh(self) -> None:
+        """Read the active window and its properties from the X server."""
+        try:
+            window = self._active_window()
+            if window is not None and (
+                self._window is None or window.id != self._window.id
+            ):
+                window.change_attributes(event_mask=Xlib.X.PropertyChangeMask)
+            current = FocusedWindow() if window is None else self._describe(window)
+        except Xlib.error.XError as e:
+            # The window went away between the event and the query.
+            eliot.Message.log(message_type="focus_tracker_error", exception=str(e))
+            window, current = None, FocusedWindow()
+        self._window = window
+        self.current = current
+
+    def _is_relevant(self, event) -> bool:
+        if event.type != Xlib.X.PropertyNotify:
+            return False
+        if event.atom == self.atoms["_NET_ACTIVE_WINDOW"]:
+            return True
+        return (
+            self._window is not None
+            and event.window.id == self._window.id
+            and event.atom in {self.atoms["_NET_WM_NAME"], Xlib.Xatom.WM_NAME}
+        )
+
+    def run(self) -> None:
+        """Update ``current`` whenever the focus or the focused window's title changes."""
+        connection = self.display.fileno()
+        while True:
+            changed = False
+            try:
+                # The round trips in ``refresh`` can queue events that the
+                # socket won't announce again, so handle those before waiting.
+                while self.display.pending_events():
+                    changed |= self._is_relevant(self.display.next_event())
+            except Xlib.error.ConnectionClosedError as e:
+                eliot.Message.log(message_type="focus_tracker_closed", exception=str(e))
+                break
+            if changed:
+                self.refresh()
+                continue
+            readable, _, _ = select.select([connection, self._wakeup_read], [], [])
+            if self._wakeup_read in readable:
+                break
+        self.display.close()
+        os.close(self._wakeup_read)
+
+    def is_alive(self) -> bool:
+        """Check whether the tracker is still following the focus."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self) -> None:
+        """Stop following the focus and close the X connection."""
+        os.write(self._wakeup_write, b"\0")
+        self._thread.join()
+        os.close(self._wakeup_write)
+
+
+_tracker: Optional[FocusTracker] = None
+
+
+@utils.public
+def get_tracker() -> Optional[FocusTracker]:
+    """Get the running focus tracker, if there is one."""
+    if _tracker is not None and _tracker.is_alive():
+        return _tracker
+    return None
+
+
+@utils.public
+def start_tracker() -> Optional[FocusTracker]:
+    """Start the focus tracker for this process, or return None if X isn't available."""
+    global _tracker
+    if _tracker is not None:
+        return _tracker
+    if platform.system() != "Linux" or not os.environ.get("DISPLAY"):
+        return None
+    try:
+        _tracker = FocusTracker.start()
+    except Exception as e:
+        eliot.Message.log(message_type="focus_tracker_unavailable", exception=str(e))
+        return None
+    return _tracker
@@ -0,0 +1,379 @@
+"""Start workers by forking a process that has already imported the plugins.
+
+Starting a worker with ``python -m voca worker`` pays for the interpreter
+startup, every import, and building the wrapper group. The fork server does that
+work once, compiles the handlers for recently used contexts, freezes the garbage
+collector so the loaded objects stay shared copy-on-write between children, and
+then forks a ready-to-go worker whenever the manager asks for one.
+
+The manager creates the pipes for each worker and passes their file descriptors
+to the fork server over a ``SOCK_SEQPACKET`` socket, so a forked worker looks to the
+manager just like a worker subprocess. The fork server reports the pid of each
+new worker and the exit code of each worker that exits on the same socket. Its
+own log frames go to its stdout, which the manager copies into its log.
+"""
+
+from __future__ import annotations
+
+import array
+import functools
+import gc
+import json
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import traceback
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import attr
+import trio
+
+from voca import config
+from voca import log
+from voca import parsing
+from voca import streaming
+from voca import utils
+from voca import worker
+
+
+_MAX_PACKET = 4096
+_FDS_PER_WORKER = 2
+
+
+def _exit_code(wait_status: int) -> int:
+    """Convert a status from ``os.waitpid`` into a ``Popen.returncode``-style code."""
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def _send(control: socket.socket, **message) -> None:
+    """Send a json packet to the manager."""
+    control.send(json.dumps(message).encode())
+
+
+def _receive_request(control: socket.socket) -> Tuple[bytes, List[int]]:
+    """Receive a request and any file descriptors attached to it."""
+    fds = array.array("i")
+    message, ancdata, _flags, _address = control.recvmsg(
+        _MAX_PACKET, socket.CMSG_LEN(_FDS_PER_WORKER * fds.itemsize)
+    )
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+    return message, list(fds)
+
+
+def _run_child(
+    wrapper_group: utils.WrapperGroup,
+    policy: utils.RecyclePolicy,
+    grammar_hash: str,
+    handler_cache: worker.HandlerCache,
+    framing: streaming.Framing,
+    fds: List[int],
+) -> int:
+    """Run the worker event loop on the pipes the manager sent."""
+    stdin_fd, stdout_fd = fds
+    os.dup2(stdin_fd, 0)
+    os.dup2(stdout_fd, 1)
+    os.close(stdin_fd)
+    os.close(stdout_fd)
+    worker.open_output(framing)
+
+    try:
+        trio.run(
+            functools.partial(
+                worker.async_main,
+                wrapper_group=wrapper_group,
+                policy=policy,
+                grammar_hash=grammar_hash,
+                handler_cache=handler_cache,
+            )
+        )
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def fork_worker(
+    wrapper_group: utils.WrapperGroup,
+    policy: utils.RecyclePolicy,
+    grammar_hash: str,
+    handler_cache: worker.HandlerCache,
+    framing: streaming.Framing,
+    fds: List[int],
+    close_in_child: List[int],
+) -> int:
+    """Fork a worker reading from and writing to ``fds``, returning its pid."""
+    worker.output.flush()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    gc.freeze()
+
+    pid = os.fork()
+    if pid:
+        for fd in fds:
+            os.close(fd)
+        return pid
+
+    code = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for fd in close_in_child:
+            os.close(fd)
+        code = _run_child(
+            wrapper_group, policy, grammar_hash, handler_cache, framing, fds
+        )
+    finally:
+        try:
+            worker.output.flush()
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def reap_children(control: socket.socket) -> None:
+    """Collect exited workers and report their exit codes."""
+    while True:
+        try:
+            pid, wait_status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        _send(control, status="exited", pid=pid, returncode=_exit_code(wait_status))
+
+
+@log.log_call
+def serve(
+    wrapper_group: utils.WrapperGroup,
+    policy: utils.RecyclePolicy,
+    grammar_hash: str,
+    handler_cache: worker.HandlerCache,
+    framing: streaming.Framing,
+    control: socket.socket,
+) -> None:
+    """Fork a worker for each request on ``control`` until the manager goes away."""
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.signal(signal.SIGCHLD, lambda _signum, _frame: None)
+    signal.set_wakeup_fd(wakeup_write)
+
+    selector = selectors.DefaultSelector()
+    selector.register(control, selectors.EVENT_READ)
+    selector.register(wakeup_read, selectors.EVENT_READ)
+    close_in_child = [control.fileno(), wakeup_read, wakeup_write]
+
+    gc.freeze()
+    while True:
+        for key, _events in selector.select():
+            if key.fileobj == wakeup_read:
+                while True:
+                    try:
+                        if not os.read(wakeup_read, _MAX_PACKET):
+                            break
+                    except BlockingIOError:
+                        break
+                reap_children(control)
+                continue
+
+            message, fds = _receive_request(control)
+            if not message:
+                return
+            if message != b"fork" or len(fds) != _FDS_PER_WORKER:
+                for fd in fds:
+                    os.close(fd)
+                _send(control, status="error", request=message.decode())
+                continue
+            pid = fork_worker(
+                wrapper_group,
+                policy,
+                grammar_hash,
+                handler_cache,
+                framing,
+                fds,
+                close_in_child,
+            )
+            _send(control, status="forked", pid=pid)
+
+
+@utils.public
+@log.log_call
+def main(
+    import_paths: Tuple[str],
+    use_backup_modules: bool,
+    control_fd: int,
+    max_commands: Optional[int] = None,
+    max_seconds: Optional[float] = None,
+    exit_on_error: bool = True,
+    framing: str = "lines",
+):
+    """Load the plugins once and fork workers on request."""
+
+    sys.path.insert(0, str(config.get_config_dir()))
+    imported = worker.collect_modules(import_paths, use_backup_modules)
+    modules = [utils.transform_module(module) for module in imported]
+
+    wrapper_group = parsing.combine_modules(modules)
+    worker.save_backup_modules(imported)
+    policy = utils.RecyclePolicy(
+        max_commands=max_commands, max_seconds=max_seconds, exit_on_error=exit_on_error
+    )
+
+    grammar_hash = parsing.grammar_hash(wrapper_group)
+    # Forked workers share these handlers instead of each compiling them.
+    handler_cache = worker.HandlerCache()
+    worker.precompile_handlers(
+        wrapper_group, handler_cache, worker.HandlerKeyHistory().recent(grammar_hash)
+    )
+
+    control = socket.socket(fileno=control_fd)
+    with control:
+        serve(
+            wrapper_group,
+            policy,
+            grammar_hash,
+            handler_cache,
+            streaming.FRAMINGS[framing],
+            control,
+        )
+
+
+@attr.s
+class ForkedProcess:
+    """A worker forked by the fork server, usable like a ``trio.Process``."""
+
+    pid: int = attr.ib()
+    stdin: trio.abc.SendStream = attr.ib()
+    stdout: trio.abc.ReceiveStream = attr.ib()
+    returncode: Optional[int] = attr.ib(default=None)
+    _exited: trio.Event = attr.ib(factory=trio.Event)
+
+    async def wait(self) -> int:
+        """Wait for the fork server to report that the worker exited."""
+        await self._exited.wait()
+        return self.returncode
+
+    def kill(self) -> None:
+        """Kill the worker."""
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def set_returncode(self, returncode: int) -> None:
+        """Record the exit code reported by the fork server."""
+        self.returncode = returncode
+        self._exited.set()
+
+
+@utils.public
+@attr.s
+class ForkServer:
+    """Manager-side handle on a fork server process."""
+
+    process: trio.Process = attr.ib()
+    control: trio.socket.SocketType = attr.ib()
+    children: Dict[int, ForkedProcess] = attr.ib(factory=dict)
+    _early_exits: Dict[int, int] = attr.ib(factory=dict)
+    _lock: trio.Lock = attr.ib(factory=trio.Lock)
+    _forked_send: trio.abc.SendChannel = attr.ib(default=None)
+    _forked_receive: trio.abc.ReceiveChannel = attr.ib(default=None)
+
+    @classmethod
+    def start(cls, command: List[str]) -> ForkServer:
+        """Start the fork server process, passing it one end of a socket pair."""
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        with theirs:
+            process = trio.Process(
+                command + ["--control-fd", str(theirs.fileno())],
+                pass_fds=[theirs.fileno()],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+            )
+        forked_send, forked_receive = trio.open_memory_channel(1)
+        return cls(
+            process,
+            trio.socket.from_stdlib_socket(ours),
+            forked_send=forked_send,
+            forked_receive=forked_receive,
+        )
+
+    async def serve(self) -> None:
+        """Dispatch the fork server's replies until it exits."""
+        while True:
+            try:
+                packet = await self.control.recv(_MAX_PACKET)
+            except ConnectionResetError:
+                packet = b""
+            if not packet:
+                await self._forked_send.aclose()
+                return
+            message = json.loads(packet.decode())
+            if message["status"] == "forked":
+                await self._forked_send.send(message["pid"])
+            elif message["status"] == "exited":
+                child = self.children.pop(message["pid"], None)
+                if child is None:
+                    # The worker exited before fork() registered it.
+                    self._early_exits[message["pid"]] = message["returncode"]
+                else:
+                    child.set_returncode(message["returncode"])
+            else:
+                await self._forked_send.send(None)
+
+    async def fork(self) -> ForkedProcess:
+        """Ask the fork server for a new worker connected to fresh pipes."""
+        child_stdin, stdin = os.pipe()
+        stdout, child_stdout = os.pipe()
+        fds = array.array("i", [child_stdin, child_stdout])
+        try:
+            async with self._lock:
+                await self.control.sendmsg(
+                    [b"fork"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)]
+                )
+                try:
+                    pid = await self._forked_receive.receive()
+                except trio.EndOfChannel:
+                    pid = None
+        finally:
+            os.close(child_stdin)
+            os.close(child_stdout)
+
+        if pid is None:
+            os.close(stdin)
+            os.close(stdout)
+            raise RuntimeError("The fork server did not start a worker.")
+
+        child = ForkedProcess(
+            pid,
+            trio._unix_pipes.PipeSendStream(stdin),
+            trio._unix_pipes.PipeReceiveStream(stdout),
+        )
+        if pid in self._early_exits:
+            child.set_returncode(self._early_exits.pop(pid))
+        else:
+            self.children[pid] = child
+        return child
+
+    def close(self) -> None:
+        """Close the control socket, which makes the fork server exit."""
+        self.control.close()
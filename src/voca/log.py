@@ -32,6 +32,7 @@ import eliot
 import six
 
 from voca import config
+from voca import streaming
 from voca import utils
 
 
@@ -64,6 +65,45 @@ def json_to_file(file: Optional[io.TextIOWrapper] = None) -> Callable:
     return _json_to_file
 
 
+@utils.public
+def json_to_frames(writer: streaming.FrameWriter) -> Callable:
+    """Serialize to json and write log frames for the manager."""
+
+    def _json_to_frames(x):
+
+        writer.write_log(json.dumps(x, default=to_serializable).encode())
+
+    return _json_to_frames
+
+
+# Files that worker log lines are copied into as they are, next to the eliot
+# destinations that write to them.
+_raw_destinations: List[io.TextIOBase] = []
+
+
+@utils.public
+def add_raw_destination(file: io.TextIOBase) -> None:
+    """Write log lines relayed from other processes to ``file`` too."""
+    _raw_destinations.append(file)
+
+
+@utils.public
+def is_json_line(line: bytes) -> bool:
+    """Check cheaply that ``line`` looks like one serialized json object."""
+    return line[:1] == b"{" and line[-1:] == b"}" and b"\n" not in line
+
+
+@utils.public
+def write_raw(lines: List[bytes]) -> None:
+    """Write json log lines that another process serialized, in one write per destination.
+
+    Without a raw destination, print them to stdout.
+    """
+    text = b"\n".join(lines).decode("utf-8", "replace") + "\n"
+    for file in _raw_destinations or [sys.stdout]:
+        file.write(text)
+
+
 def _exception_lines(exc: BaseException) -> List[str]:
     """Get a list of traceback string lines from an exception."""
     return traceback.format_exception(type(exc), exc, exc.__traceback__)
@@ -7,7 +7,9 @@ reloading and error handling.
 
 from __future__ import annotations
 
+import collections
 import functools
+import math
 import os
 import itertools
 import sys
@@ -16,19 +18,31 @@ import subprocess
 import json
 import contextlib
 import copy
+import hmac
+import ipaddress
 
 from typing import List
 from typing import Optional
 from typing import Dict
+from typing import Sequence
 from typing import Set
+from typing import Tuple
 
 import attr
 import trio
 import eliot
 
 
+from voca import config
+from voca import context
+from voca import focus
+from voca import platforms
 from voca import plugins
+from voca import forkserver
+from voca import modes
 from voca import utils
+from voca import state as state_module
+from voca import worker as worker_module
 from voca import streaming
 from voca import log
 
@@ -37,158 +51,1831 @@ def handle_unexpected_worker_bytes(message: bytes):
     eliot.Message.log(message_type="unexpected_worker_output", message=message)
 
 
-def worker_cli(should_log, module_names: Optional[List[str]] = None) -> List[str]:
-    """Build the list of strings for invoking a worker subprocess."""
+def worker_cli(
+    should_log,
+    module_names: Optional[List[str]] = None,
+    policy: Optional[utils.RecyclePolicy] = None,
+    subcommand: str = "worker",
+    production: bool = False,
+    context_ttl: Optional[float] = None,
+    framing: str = "lines",
+    prefer_backup_modules: bool = False,
+) -> List[str]:
+    """Build the list of strings for invoking a worker or fork server subprocess."""
     if module_names is None:
         # TODO This case should be handled in the worker, not the manager.
         module_names = utils.get_module_names()
 
     log_arg = "--log" if should_log else "--no-log"
-    prefix = [sys.executable, "-m", "voca", log_arg, "worker"]
+    mode_arg = "--production" if production else "--development"
+    prefix = [sys.executable, "-m", "voca", log_arg, mode_arg]
+    if context_ttl is not None:
+        prefix += ["--context-ttl", str(context_ttl)]
+    prefix.append(subcommand)
     command = prefix.copy()
     for module_name in module_names:
         command += ["-i", module_name]
+    if policy is not None:
+        command += policy.to_cli_args()
+    command += ["--framing", framing]
+    if prefer_backup_modules:
+        command.append("--prefer-backup-modules")
     return command
 
 
-@log.log_async_call
-async def replay_child_messages(child: trio.Process) -> None:
-    """Log the child's messages to the parent's stdout."""
-    async for message_from_child in streaming.TerminatedFrameReceiver(
-        child.stdout, b"\n"
-    ):
-        message_str = message_from_child.decode()
-        try:
-            message_dict = json.loads(message_str)
-        except json.decoder.JSONDecodeError:
-            handle_unexpected_worker_bytes(message_from_child)
-        else:
-            print(message_dict)
+# The wrappers a worker allowed for a command, as reported in its ``done`` status.
+HandlerKey = Tuple[int, ...]
 
+# How many window titles to remember the handler keys of.
+CONTEXT_AFFINITY_SIZE = 256
 
-@log.log_call
-def set_state(data: Dict[str, dict], state: Dict[str, dict]):
-    """Handle switching between ``eager`` and ``strict`` mode."""
-    # XXX maybe this should be in the worker.
-    state = copy.deepcopy(state)
-    body = data["result"]["hypotheses"][0]["transcript"]
-    command, _space, _args = body.partition(" ")
-    if command == "mode":
-        state["modes"]["strict"] = not state["modes"]["strict"]
-        return state
 
+@attr.dataclass
+class Worker:
+    """A worker process and the receiver for the frames on its stdout."""
+
+    process: trio.Process
+    receiver: streaming.Receiver
+    framing: streaming.Framing = attr.ib(factory=streaming.LineFraming)
+    grammar_hash: Optional[str] = None
+    warm_keys: Set[HandlerKey] = attr.ib(factory=set)
+    # The version of the manager's state the worker has, and the client's store it came from.
+    state_version: int = -1
+    state_owner: Optional[state_module.StateStore] = None
+    commands: int = 0
+    # The worker's resident memory in bytes, as of its last command.
+    rss: Optional[int] = None
+    retired: bool = False
+    # Whether the manager killed the worker for running a command too long.
+    timed_out: bool = False
+    # Whether the worker tries the plugins again after the pool fell back to the backups.
+    retrying: bool = False
+    started_at: Optional[float] = None
+    # Whether the worker connected over TCP, maybe from another machine.
+    remote: bool = False
+    # The recycled worker this one is a spare for, until it is ready.
+    replaces: Optional[Worker] = None
+
+    @classmethod
+    def from_process(
+        cls, process: trio.Process, framing: Optional[streaming.Framing] = None
+    ) -> Worker:
+        """Wrap a process, reading frames from its stdout."""
+        if framing is None:
+            framing = streaming.LineFraming()
+        return cls(process, framing.receiver(process.stdout), framing)
+
+    async def send(self, message: dict) -> None:
+        """Send a message to the worker's stdin."""
+        await self.process.stdin.send_all(self.framing.encode(message))
+
+    def describe(self) -> dict:
+        return {
+            "pid": self.process.pid,
+            "rss": self.rss,
+            "commands": self.commands,
+            "remote": self.remote,
+        }
+
+
+@attr.s
+class RemoteProcess:
+    """A worker connected over TCP, usable like a ``trio.Process``."""
+
+    stream: trio.SocketStream = attr.ib()
+    pid: Optional[int] = attr.ib(default=None)
+    returncode: Optional[int] = attr.ib(default=None)
+    closed: trio.Event = attr.ib(factory=trio.Event)
+
+    @property
+    def stdin(self) -> trio.SocketStream:
+        return self.stream
+
+    @property
+    def stdout(self) -> trio.SocketStream:
+        return self.stream
+
+    def kill(self) -> None:
+        """Disconnect the worker, which makes it exit."""
+        with contextlib.suppress(OSError):
+            self.stream.socket.shutdown(trio.socket.SHUT_RDWR)
+
+    async def wait(self) -> Optional[int]:
+        """Close the connection."""
+        await self.stream.aclose()
+        self.closed.set()
+        return self.returncode
+
+
+# How long a remote worker has to send its token after it connects.
+HANDSHAKE_TIMEOUT = 10.0
+
+
+def token_matches(expected: Optional[str], token) -> bool:
+    """Check a remote worker's token, accepting any worker if the manager has none."""
+    if not expected:
+        return True
+    if not isinstance(token, str):
+        return False
+    return hmac.compare_digest(expected.encode(), token.encode())
+
+
+@utils.public
+def is_loopback(host: str) -> bool:
+    """Check whether listening on ``host`` only accepts connections from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+@platforms.implementation(platforms.System.WINDOWS, platforms.System.DARWIN)
+def worker_rss(pid: int) -> Optional[int]:
+    """Get a process's resident memory in bytes, where the platform allows it."""
+    return None
+
+
+@platforms.implementation(platforms.System.LINUX)
+def worker_rss(pid: int) -> Optional[int]:
+    """Get a process's resident memory in bytes, where the platform allows it."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+@log.log_async_call
+async def replay_child_messages(worker: Worker) -> Optional[dict]:
+    """Copy the child's log lines into the manager's log until it finishes a command.
+
+    Log lines are written as they are, without decoding them, a batch at a
+    time: each batch is the log lines that arrived together.
+
+    Return the worker's status message, or None if the worker exited without one.
+    """
+    batch: List[bytes] = []
+    try:
+        async for frame in worker.receiver:
+            try:
+                line = worker.framing.log_line(frame)
+                if line is None:
+                    return worker.framing.decode(frame)
+            except ValueError:
+                handle_unexpected_worker_bytes(frame)
+                continue
+            if not log.is_json_line(line):
+                handle_unexpected_worker_bytes(frame)
+                continue
+            batch.append(line)
+            if not worker.receiver.has_frame():
+                log.write_raw(batch)
+                batch = []
+    finally:
+        if batch:
+            log.write_raw(batch)
     return None
 
 
+@attr.s
+class Epoch:
+    """Count cancellations, so commands from before a cancel know they are stale."""
+
+    number: int = attr.ib(default=0)
+
+    def advance(self) -> None:
+        """Make every command received so far stale."""
+        self.number += 1
+
+
+_command_ids = itertools.count()
+
+
 @log.log_async_call
 async def delegate_task(
-    data: Dict, worker: trio.Process, state: dict, action: eliot.Action
+    data: Dict,
+    worker: Worker,
+    state: state_module.StateStore,
+    action: eliot.Action,
+    hold: bool = False,
+    command_id: Optional[int] = None,
 ):
-    """Send input data to worker process over std streams."""
+    """Send input data to worker process over std streams.
+
+    Only the state that changed since the worker's last command goes with it,
+    unless that command came from another client.
+    """
 
     wrapped_data = dict(
-        **data, state=state, eliot_task_id=action.serialize_task_id().decode()
+        **data,
+        **take_state_delta(worker, state),
+        eliot_task_id=action.serialize_task_id().decode(),
+        hold=hold,
+        command_id=command_id,
     )
-    await worker.stdin.send_all(json.dumps(wrapped_data).encode() + b"\n")
+    await worker.send(wrapped_data)
+
+
+def take_state_delta(worker: Worker, state: state_module.StateStore) -> dict:
+    """Get the state the worker hasn't seen yet, and mark it as seen."""
+    since = worker.state_version if worker.state_owner is state else -1
+    frame = dict(state_version=state.version, state_delta=state.delta(since))
+    worker.state_version = state.version
+    worker.state_owner = state
+    return frame
+
+
+async def send_control(
+    worker: Worker,
+    control: str,
+    command_id: int,
+    state: Optional[state_module.StateStore] = None,
+) -> None:
+    """Send a control frame, such as ``execute`` or ``cancel``, about a worker's command.
+
+    With a ``state``, the frame carries what changed in it since the worker
+    parsed the command, such as a mode the commands before it turned on.
+    """
+    frame = {"control": control, "command_id": command_id}
+    if state is not None:
+        frame.update(take_state_delta(worker, state))
+    await worker.send(frame)
+
+
+@attr.s
+class Turn:
+    """A command's place in utterance order.
+
+    A command's side effects wait until the command before it has finished.
+    """
+
+    previous: trio.Event = attr.ib()
+    epoch: Epoch = attr.ib(factory=Epoch)
+    number: int = attr.ib(default=0)
+    finished: trio.Event = attr.ib(factory=trio.Event)
+
+    @classmethod
+    def start(cls, epoch: Epoch) -> Turn:
+        """Make a finished turn to come before the first command."""
+        turn = cls(trio.Event(), epoch, epoch.number)
+        turn.previous.set()
+        turn.finished.set()
+        return turn
+
+    def next(self, number: int) -> Turn:
+        """Make the turn for the following command, received in epoch ``number``."""
+        return Turn(self.finished, self.epoch, number)
+
+    def cancelled(self) -> bool:
+        """Check whether the command was cancelled after it was received."""
+        return self.number != self.epoch.number
+
+
+def transcript_words(data: dict) -> List[str]:
+    return data["result"]["hypotheses"][0]["transcript"].split()
+
+
+# Seconds a partial transcript must stay unchanged before its commands run in eager mode.
+EAGER_SETTLE = 0.3
+
+
+@attr.s
+class Segment:
+    """The transcripts of one recognizer segment in eager mode.
+
+    Only the newest transcript waits in the queue, and only the words that
+    were not already run are sent to a worker. Of a partial transcript, the
+    worker runs the complete commands but not the last, which may still grow:
+    "scroll down" may become "scroll down three". The last command runs once
+    more words follow it or the final transcript arrives.
+    """
+
+    executed: List[str] = attr.ib(factory=list)
+    pending: Optional[dict] = attr.ib(default=None)
+    changed_at: float = attr.ib(default=0.0)
+    running: List[str] = attr.ib(factory=list)
+    idle: trio.Event = attr.ib(factory=trio.Event)
+    # The newest partial, if it is a phrase the manager handles itself.
+    phrase: Optional[str] = attr.ib(default=None)
+    phrase_at: float = attr.ib(default=0.0)
+    acted_on: Optional[str] = attr.ib(default=None)
+
+    def __attrs_post_init__(self):
+        self.idle.set()
+
+    def offer(self, data: dict) -> bool:
+        """Replace the queued transcript with ``data``. Return True if none was queued."""
+        self.phrase = None
+        queued = self.pending is not None
+        if queued:
+            eliot.Message.log(message_type="partial_superseded", data=self.pending)
+        self.pending = data
+        self.changed_at = trio.current_time()
+        return not queued
+
+    async def take(self, settle: float = 0.0) -> Optional[dict]:
+        """Wait until the newest partial is stable, and build the command for its new words.
+
+        Don't wait for a final transcript. Return None if there is nothing new to run.
+        """
+        await self.idle.wait()
+        while (
+            not self.pending["result"]["final"]
+            and trio.current_time() - self.changed_at < settle
+        ):
+            await trio.sleep(settle - (trio.current_time() - self.changed_at))
+        data, self.pending = self.pending, None
+        final = data["result"]["final"]
+
+        words = transcript_words(data)
+        if words[: len(self.executed)] == self.executed:
+            new_words = words[len(self.executed) :]
+        elif self.executed[: len(words)] == words:
+            # The recognizer dropped a word it had already heard.
+            new_words = []
+        else:
+            # The recognizer revised words that already ran, so this is a new phrase.
+            self.executed = []
+            new_words = words
+        if not new_words or (not final and new_words == self.running):
+            eliot.Message.log(message_type="partial_unchanged", data=data)
+            return None
+
+        self.running = new_words
+        self.idle = trio.Event()
+        data = copy.deepcopy(data)
+        data["result"]["hypotheses"][0]["transcript"] = " ".join(new_words)
+        data["partial"] = not final
+        return data
+
+    def hear_phrase(self, phrase: str) -> None:
+        """Record a partial that is a phrase the manager handles, such as "stop"."""
+        if phrase != self.phrase:
+            self.phrase = phrase
+            self.phrase_at = trio.current_time()
+
+    def act_on(self, phrase: str) -> bool:
+        """Mark ``phrase`` as handled. Return False if it already was."""
+        if self.acted_on == phrase:
+            return False
+        self.acted_on = phrase
+        return True
+
+    async def wait_for_phrase(self, phrase: str, settle: float) -> bool:
+        """Wait until ``phrase`` has been the newest partial for ``settle`` seconds.
+
+        Return False if another partial replaced it first, or it was already handled.
+        """
+        while self.phrase == phrase and trio.current_time() - self.phrase_at < settle:
+            await trio.sleep(settle - (trio.current_time() - self.phrase_at))
+        return self.phrase == phrase and self.act_on(phrase)
+
+    def drop(self) -> None:
+        """Forget the queued partial."""
+        self.pending = None
+
+    def finish(self, status: Optional[dict]) -> None:
+        """Record the words the worker ran as executed, up to the command it held back."""
+        if (
+            status is not None
+            and status["worker_status"] == "done"
+            and not status["failed"]
+            and not status.get("incomplete")
+        ):
+            ran_words = status.get("ran_words")
+            if ran_words is None:
+                ran_words = len(self.running)
+            self.executed = self.executed + self.running[:ran_words]
+            self.running = self.running[ran_words:]
+        self.idle.set()
+
+
+@attr.s
+class CrashTracker:
+    """Notice workers dying on startup, and wait longer each time before replacing them.
+
+    A worker that exits before it is ready, or fails soon after, counts as a
+    crash. After ``degrade_after`` crashes in a row, the pool is degraded.
+    """
+
+    min_lifetime: float = attr.ib(default=10.0)
+    base_delay: float = attr.ib(default=0.5)
+    max_delay: float = attr.ib(default=60.0)
+    degrade_after: int = attr.ib(default=3)
+    crashes: int = attr.ib(default=0)
+
+    def record(
+        self,
+        returncode: Optional[int],
+        lifetime: float,
+        ready: bool,
+        timed_out: bool = False,
+    ) -> float:
+        """Record a worker's exit, and return how long to wait before replacing it.
+
+        A worker killed for running a command too long started fine, so it
+        doesn't count either way.
+        """
+        if timed_out:
+            return 0.0
+        if ready and (returncode == 0 or lifetime >= self.min_lifetime):
+            self.crashes = 0
+            return 0.0
+        self.crashes += 1
+        return min(self.max_delay, self.base_delay * 2 ** (self.crashes - 1))
+
+    def reset(self) -> None:
+        """Forget the crashes once a worker has run a command."""
+        self.crashes = 0
+
+    def should_degrade(self) -> bool:
+        return self.crashes >= self.degrade_after
+
+
+# How long the pool runs degraded before it tries what it fell back from again.
+RECOVERY_DELAY = 60.0
+
+
+def find_module_file(module_name: str) -> Optional[pathlib.Path]:
+    """Find a plugin module's source file the way a worker would, without importing it."""
+    relative = pathlib.Path(*module_name.split("."))
+    for directory in [config.get_config_dir(), *sys.path]:
+        for path in [
+            (pathlib.Path(directory) / relative).with_suffix(".py"),
+            pathlib.Path(directory) / relative / "__init__.py",
+        ]:
+            if path.is_file():
+                return path
+    return None
+
+
+def module_mtimes(module_names: Sequence[str]) -> Dict[str, Optional[float]]:
+    """Get when each plugin module's file last changed."""
+    mtimes: Dict[str, Optional[float]] = {}
+    for name in module_names:
+        path = find_module_file(name)
+        mtimes[name] = None if path is None else path.stat().st_mtime
+    return mtimes
+
+
+@attr.s
+class Fallback:
+    """Something the pool gave up on, such as the plugins or the fork server.
+
+    It is worth trying again once ``delay`` has passed, or as soon as the
+    plugin files change, since that is how a broken plugin gets fixed.
+    """
+
+    module_names: Sequence[str] = attr.ib()
+    delay: float = attr.ib(default=RECOVERY_DELAY)
+    since: float = attr.ib(factory=trio.current_time)
+    mtimes: Optional[Dict[str, Optional[float]]] = attr.ib(default=None)
+
+    def __attrs_post_init__(self):
+        if self.mtimes is None:
+            self.mtimes = module_mtimes(self.module_names)
+
+    def due(self) -> bool:
+        if trio.current_time() - self.since >= self.delay:
+            return True
+        return module_mtimes(self.module_names) != self.mtimes
+
+    def postpone(self) -> None:
+        """Start waiting again, after a retry."""
+        self.since = trio.current_time()
+        self.mtimes = module_mtimes(self.module_names)
 
 
 @attr.s
 class Pool:
+    nursery: trio.Nursery = attr.ib()
     num_workers: int = attr.ib(default=1)
     should_log: bool = attr.ib(default=True)
+    production: bool = attr.ib(default=False)
+    context_ttl: Optional[float] = attr.ib(default=None)
     module_names: List[str] = attr.ib(factory=list)
-    processes: Set[trio.Process] = attr.ib(factory=set)
+    policy: Optional[utils.RecyclePolicy] = attr.ib(default=None)
+    fork_server: Optional[forkserver.ForkServer] = attr.ib(default=None)
+    warming: List[Worker] = attr.ib(factory=list)
+    ready: List[Worker] = attr.ib(factory=list)
+    context_keys: Dict[str, HandlerKey] = attr.ib(factory=collections.OrderedDict)
+    command_timeout: Optional[float] = attr.ib(default=None)
+    framing: streaming.Framing = attr.ib(factory=streaming.LineFraming)
+    state: state_module.StateStore = attr.ib(factory=state_module.StateStore)
+    modes: modes.ModeMachine = attr.ib(factory=modes.ModeMachine.with_defaults)
+    # The worker running each command, and the epoch of the client that sent it.
+    executing: Dict[int, Tuple[Worker, Optional[Epoch]]] = attr.ib(factory=dict)
+    # The state of each client connected to the manager's socket.
+    client_states: List[state_module.StateStore] = attr.ib(factory=list)
+    # How many workers are running or starting, and how many there should be.
+    size: int = attr.ib(default=0)
+    target: int = attr.ib(default=0)
+    waiting: int = attr.ib(default=0)
+    workers: Dict[int, Worker] = attr.ib(factory=dict)
+    # Replace a worker from a warm spare once it uses this much memory or runs this many commands.
+    max_rss: Optional[int] = attr.ib(default=None)
+    recycle_after: Optional[int] = attr.ib(default=None)
+    # Workers still serving commands until their spare is ready.
+    recycling: List[Worker] = attr.ib(factory=list)
+    crashes: CrashTracker = attr.ib(factory=CrashTracker)
+    # Set once workers keep crashing, to start them from the backup modules.
+    prefer_backup_modules: bool = attr.ib(default=False)
+    # When to try the plugins, or the fork server, again after falling back.
+    backup_fallback: Optional[Fallback] = attr.ib(default=None)
+    fork_server_fallback: Optional[Fallback] = attr.ib(default=None)
+    recovery_delay: float = attr.ib(default=RECOVERY_DELAY)
+    # The grammar of the local workers, which remote workers must share.
+    grammar_hash: Optional[str] = attr.ib(default=None)
+    remote_workers: List[Worker] = attr.ib(factory=list)
+    # The secret a remote worker must send before it joins the pool.
+    remote_token: Optional[str] = attr.ib(default=None)
+    # Commands on remote workers that may yet come back to run on this machine.
+    hand_backs: int = attr.ib(default=0)
+    history: Optional[worker_module.HandlerKeyHistory] = attr.ib(
+        factory=worker_module.HandlerKeyHistory
+    )
+    _ready_event: trio.Event = attr.ib(factory=trio.Event)
+
+    @property
+    def active(self) -> int:
+        """Count the workers that are staying, leaving out the ones waiting for a spare."""
+        return self.size - len(self.recycling)
 
-    def start(self) -> None:
+    async def start(self) -> None:
         """Start a new process."""
+        self.target = self.num_workers
         for _ in range(self.num_workers):
-            self.add_new_process()
+            await self.add_new_process()
+
+    def available(self, remote: bool = True) -> List[Worker]:
+        """List the ready workers, leaving out remote ones unless ``remote``.
+
+        While a command on a remote worker may still be handed back, commands
+        that may go to one leave a local worker for it.
+        """
+        local = [worker for worker in self.ready if not worker.remote]
+        if not remote:
+            return local
+        if self.hand_backs and local:
+            reserve = local[-1]
+            return [worker for worker in self.ready if worker is not reserve]
+        return self.ready
+
+    async def get_worker(
+        self, title: Optional[str] = None, remote: bool = True
+    ) -> Worker:
+        """Wait for a worker that has finished loading, and take it out of the pool.
+
+        Prefer a worker that already has a parser for the window ``title``.
+        Only take a remote worker if ``remote``.
+        """
+        started = trio.current_time()
+        self.waiting += 1
+        try:
+            self.retire_expired()
+            while not self.available(remote):
+                if self._ready_event.is_set():
+                    self._ready_event = trio.Event()
+                await self._ready_event.wait()
+                self.retire_expired()
+        finally:
+            self.waiting -= 1
+
+        available = self.available(remote)
+        key = self.context_keys.get(title)
+        warm = [worker for worker in available if key in worker.warm_keys]
+        worker = warm[0] if warm else available[0]
+        self.ready.remove(worker)
+        if worker.remote:
+            # Until the worker parses the command, it may hand it back.
+            self.hand_backs += 1
+        eliot.Message.log(
+            message_type="pool_wait",
+            pid=worker.process.pid,
+            waited=trio.current_time() - started,
+            warming=len(self.warming),
+            warm=bool(warm),
+        )
+        return worker
+
+    def end_hand_back(self, worker: Worker) -> None:
+        """Stop keeping a local worker for ``worker``'s command, once it can't come back."""
+        if worker.remote:
+            self.hand_backs -= 1
+            self._ready_event.set()
+
+    def release(self, worker: Worker) -> None:
+        """Return a worker that is still running to the pool, or retire it if the pool shrank."""
+        if worker.retired:
+            self.nursery.start_soon(self._retire, worker)
+            return
+        # Remote workers don't count towards the pool's size.
+        if not worker.remote and self.active > self.target:
+            self.retire(worker)
+            return
+        if (
+            not worker.remote
+            and worker not in self.recycling
+            and self.should_recycle(worker)
+        ):
+            self.recycle(worker)
+        self.ready.append(worker)
+        self._ready_event.set()
+
+    def expired(self, worker: Worker) -> bool:
+        """Check whether a local worker has outlived the policy's ``max_seconds``."""
+        if self.policy is None or self.policy.max_seconds is None:
+            return False
+        if worker.remote or worker.started_at is None:
+            return False
+        return trio.current_time() - worker.started_at >= self.policy.max_seconds
+
+    def retire_expired(self) -> None:
+        """Retire the idle workers that are too old for another command, and start new ones."""
+        expired = [worker for worker in self.ready if self.expired(worker)]
+        for worker in expired:
+            eliot.Message.log(message_type="worker_expired", worker=worker.describe())
+            self.ready.remove(worker)
+            self.retire(worker)
+        for _ in range(min(len(expired), self.target - self.active)):
+            self.nursery.start_soon(self.add_new_process)
+
+    def should_recycle(self, worker: Worker) -> bool:
+        """Check whether a worker has used too much memory or run too many commands."""
+        if self.max_rss is not None and worker.rss is not None:
+            if worker.rss >= self.max_rss:
+                return True
+        return self.recycle_after is not None and worker.commands >= self.recycle_after
 
-    def get_process(self) -> trio.Process:
-        """Pop an process outof the pool and return it."""
-        return self.processes.pop()
+    def recycle(self, worker: Worker) -> None:
+        """Start a spare for a worker, which keeps serving commands until the spare is ready."""
+        eliot.Message.log(message_type="worker_recycling", worker=worker.describe())
+        self.recycling.append(worker)
+        self.nursery.start_soon(self.add_new_process, worker)
 
-    def add_new_process(self) -> None:
-        """Start a new process and add it to the pool."""
-        self.processes.add(
-            trio.Process(
-                worker_cli(self.should_log, self.module_names),
+    def stats(self) -> dict:
+        """Describe the pool's size and each worker's memory."""
+        return {
+            "size": self.size,
+            "target": self.target,
+            "ready": len(self.ready),
+            "warming": len(self.warming),
+            "recycling": len(self.recycling),
+            "degraded": self.prefer_backup_modules,
+            "workers": [
+                worker.describe()
+                for worker in [*self.workers.values(), *self.remote_workers]
+            ],
+        }
+
+    def resize(self, target: int, **fields) -> None:
+        """Start or retire workers until there are ``target`` of them."""
+        eliot.Message.log(
+            message_type="pool_resize", size=self.size, target=target, **fields
+        )
+        self.target = target
+        for _ in range(target - self.active):
+            self.nursery.start_soon(self.add_new_process)
+        # Retire the workers that have been idle longest; busy ones retire when released.
+        idle = self.available(remote=False)
+        while self.active > self.target and idle:
+            worker = idle.pop(0)
+            self.ready.remove(worker)
+            self.retire(worker)
+
+    def retire(self, worker: Worker) -> None:
+        """Close an idle worker's stdin so it exits after copying its last log lines."""
+        self._leave(worker)
+        self.nursery.start_soon(self._retire, worker)
+
+    def _leave(self, worker: Worker) -> None:
+        """Stop counting a worker that is exiting."""
+        if worker in self.recycling:
+            self.recycling.remove(worker)
+        if not worker.retired:
+            worker.retired = True
+            self.size -= 1
+
+    async def _retire(self, worker: Worker) -> None:
+        try:
+            await worker.process.stdin.aclose()
+        except trio.BrokenResourceError:
+            pass
+        await replay_child_messages(worker)
+        await worker.process.wait()
+        self.workers.pop(worker.process.pid, None)
+
+    def learn(
+        self,
+        worker: Worker,
+        title: Optional[str],
+        status: dict,
+        state: Optional[state_module.StateStore] = None,
+    ) -> None:
+        """Remember which parsers a worker has, and which one the window ``title`` needs.
+
+        Apply the command's state changes to the ``state`` of the client that sent it.
+        """
+        if state is None:
+            state = self.state
+        worker.warm_keys = {tuple(entry["key"]) for entry in status.get("warm", [])}
+        if status.get("worker_status") == "done":
+            self.crashes.reset()
+            worker.commands += 1
+            if not worker.remote:
+                worker.rss = worker_rss(worker.process.pid)
+        state.update(status.get("state_changes", {}))
+        if status.get("handler_key") is None:
+            return
+        if worker.grammar_hash is not None and self.history is not None:
+            self.history.record(worker.grammar_hash, status["handler_key"])
+        if title is None:
+            return
+        self.context_keys.pop(title, None)
+        self.context_keys[title] = tuple(status["handler_key"])
+        while len(self.context_keys) > CONTEXT_AFFINITY_SIZE:
+            self.context_keys.popitem(last=False)
+
+    def start_fork_server(self) -> None:
+        """Start a fork server for the pool's workers, copying its log frames into ours."""
+        self.fork_server = forkserver.ForkServer.start(
+            worker_cli(
+                self.should_log,
+                self.module_names,
+                self.policy,
+                subcommand="forkserver",
+                production=self.production,
+                context_ttl=self.context_ttl,
+            )
+        )
+        self.nursery.start_soon(self.fork_server.serve)
+        self.nursery.start_soon(
+            replay_child_messages, Worker.from_process(self.fork_server.process)
+        )
+
+    async def add_new_process(self, replaces: Optional[Worker] = None) -> None:
+        """Start a new process, or fork one from the fork server, and add it to the pool.
+
+        Once workers have fallen back to the backup modules, or to starting
+        without the fork server, try the plugins or the fork server again every
+        so often, and as soon as a plugin file changes. If the new worker is a
+        spare for the recycled worker ``replaces``, that one retires once the
+        spare is ready.
+        """
+        self.size += 1
+        process = None
+        # Whether this worker tries the plugins the pool fell back from.
+        retrying = False
+        if self.prefer_backup_modules and self.backup_fallback.due():
+            self.backup_fallback.postpone()
+            retrying = True
+        prefer_backup_modules = self.prefer_backup_modules and not retrying
+        if (
+            self.fork_server is None
+            and self.fork_server_fallback is not None
+            and not prefer_backup_modules
+            and self.fork_server_fallback.due()
+        ):
+            self.fork_server_fallback.postpone()
+            self.start_fork_server()
+        if self.fork_server is not None and not prefer_backup_modules:
+            try:
+                process = await self.fork_server.fork()
+            except (RuntimeError, OSError) as e:
+                # The fork server itself failed to start, maybe importing a plugin.
+                eliot.Message.log(
+                    message_type="pool_degraded",
+                    reason="the fork server exited; starting workers without it",
+                    exception=str(e),
+                    module_names=self.module_names,
+                )
+                self.fork_server.close()
+                self.fork_server = None
+                if self.fork_server_fallback is None:
+                    self.fork_server_fallback = Fallback(
+                        self.module_names, self.recovery_delay
+                    )
+            else:
+                if self.fork_server_fallback is not None:
+                    self.fork_server_fallback = None
+                    eliot.Message.log(
+                        message_type="pool_recovered",
+                        reason="the fork server started again",
+                        module_names=self.module_names,
+                    )
+        if process is None:
+            process = trio.Process(
+                worker_cli(
+                    self.should_log,
+                    self.module_names,
+                    self.policy,
+                    production=self.production,
+                    context_ttl=self.context_ttl,
+                    prefer_backup_modules=prefer_backup_modules,
+                ),
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
             )
+        worker = Worker.from_process(process)
+        worker.started_at = trio.current_time()
+        worker.retrying = retrying
+        worker.replaces = replaces
+        self.workers[process.pid] = worker
+        self.warming.append(worker)
+        self.nursery.start_soon(self.wait_until_ready, worker)
+
+    async def wait_for_status(self, worker: Worker) -> Optional[dict]:
+        """Replay a worker's messages until its next status.
+
+        Kill the worker if that takes longer than ``command_timeout``.
+        """
+        timeout = math.inf if self.command_timeout is None else self.command_timeout
+        with trio.move_on_after(timeout):
+            return await replay_child_messages(worker)
+        eliot.Message.log(
+            message_type="command_timed_out", pid=worker.process.pid, timeout=timeout
+        )
+        worker.timed_out = True
+        worker.process.kill()
+        return None
+
+    def new_state(self) -> state_module.StateStore:
+        """Make the state for a new client, starting from the defaults the workers reported."""
+        state = state_module.StateStore(dict(self.state.values))
+        self.client_states.append(state)
+        return state
+
+    def drop_state(self, state: state_module.StateStore) -> None:
+        """Forget the state of a client that disconnected."""
+        self.client_states = [
+            other for other in self.client_states if other is not state
+        ]
+
+    async def cancel_running(self, epoch: Optional[Epoch] = None) -> None:
+        """Ask the workers running commands to stop them, only the ones from ``epoch``'s client if given."""
+        for command_id, (worker, owner) in list(self.executing.items()):
+            if epoch is not None and owner is not epoch:
+                continue
+            try:
+                await send_control(worker, "cancel", command_id)
+            except trio.BrokenResourceError:
+                pass
+
+    async def replace(self, worker: Worker) -> None:
+        """Wait for a worker to exit and start another one in its place, unless the pool shrank.
+
+        Wait longer each time workers crash on startup, and start them from the
+        backup modules once they keep crashing, until the plugins work again.
+        """
+        if worker.remote:
+            await self.disconnect(worker)
+            return
+        returncode = await worker.process.wait()
+        self.workers.pop(worker.process.pid, None)
+        self._leave(worker)
+        lifetime = trio.current_time() - (worker.started_at or trio.current_time())
+        delay = self.crashes.record(
+            returncode,
+            lifetime,
+            ready=worker.grammar_hash is not None,
+            timed_out=worker.timed_out,
+        )
+        if self.crashes.should_degrade() and not self.prefer_backup_modules:
+            self.prefer_backup_modules = True
+            self.backup_fallback = Fallback(self.module_names, self.recovery_delay)
+            eliot.Message.log(
+                message_type="pool_degraded",
+                reason="workers keep crashing on startup; starting them from the backup modules",
+                crashes=self.crashes.crashes,
+                returncode=returncode,
+                module_names=self.module_names,
+            )
+        if delay:
+            eliot.Message.log(
+                message_type="worker_respawn_delayed",
+                pid=worker.process.pid,
+                returncode=returncode,
+                lifetime=lifetime,
+                delay=delay,
+            )
+            await trio.sleep(delay)
+        if self.active < self.target:
+            await self.add_new_process(worker.replaces)
+
+    async def add_remote_worker(self, stream: trio.SocketStream) -> None:
+        """Add a worker that connected over TCP once it is ready, and wait until it disconnects.
+
+        The worker's first frame must carry the pool's ``remote_token``. Remote
+        workers always send json lines, whatever the local workers' framing, so
+        a peer never gets the manager to unmarshal its bytes.
+        """
+        framing = streaming.LineFraming()
+        receiver = framing.receiver(stream)
+        hello = None
+        with trio.move_on_after(HANDSHAKE_TIMEOUT):
+            with contextlib.suppress(
+                ValueError, trio.EndOfChannel, trio.BrokenResourceError
+            ):
+                hello = framing.decode(await receiver.receive())
+        if not isinstance(hello, dict) or not token_matches(
+            self.remote_token, hello.get("token")
+        ):
+            eliot.Message.log(message_type="remote_worker_refused")
+            await stream.aclose()
+            return
+        worker = Worker(RemoteProcess(stream), receiver, framing)
+        worker.remote = True
+        worker.started_at = trio.current_time()
+        self.remote_workers.append(worker)
+        self.warming.append(worker)
+        await self.wait_until_ready(worker)
+        await worker.process.closed.wait()
+
+    async def disconnect(self, worker: Worker) -> None:
+        """Drop a remote worker. It is up to its machine to connect another one."""
+        worker.process.kill()
+        await worker.process.wait()
+        self.remote_workers = [
+            other for other in self.remote_workers if other is not worker
+        ]
+        eliot.Message.log(
+            message_type="remote_worker_disconnected", pid=worker.process.pid
         )
 
+    async def negotiate_framing(self, worker: Worker, status: dict) -> bool:
+        """Switch a ready local worker to the pool's framing, if it supports it.
+
+        Workers start with json lines and list the framings they support in
+        their ready status. Return False if the worker exited instead.
+        """
+        framing = self.framing
+        if worker.remote or framing.name == worker.framing.name:
+            return True
+        if not framing.accepts(status):
+            eliot.Message.log(
+                message_type="framing_kept", framing=worker.framing.name, status=status
+            )
+            return True
+        with contextlib.suppress(trio.BrokenResourceError, trio.ClosedResourceError):
+            await worker.send({"control": "framing", "framing": framing.name})
+        ack = await replay_child_messages(worker)
+        if ack is None or ack["worker_status"] != "framing":
+            return False
+        worker.framing = framing
+        worker.receiver = streaming.switch_framing(worker.receiver, framing)
+        return True
+
+    @log.log_async_call
+    async def wait_until_ready(self, worker: Worker) -> None:
+        """Move a warming worker to the ready queue once it reports that it is ready."""
+        status = await replay_child_messages(worker)
+        self.warming.remove(worker)
+        if status is None or status["worker_status"] != "ready":
+            await self.replace(worker)
+            return
+        if not await self.negotiate_framing(worker, status):
+            await self.replace(worker)
+            return
+        if worker.remote:
+            worker.process.pid = status["pid"]
+            if self.grammar_hash not in {None, status["grammar_hash"]}:
+                eliot.Message.log(
+                    message_type="remote_worker_rejected",
+                    expected=self.grammar_hash,
+                    status=status,
+                )
+                await self.replace(worker)
+                return
+            eliot.Message.log(
+                message_type="remote_worker_registered",
+                pid=status["pid"],
+                modules=status.get("modules", []),
+                grammar_hash=status["grammar_hash"],
+            )
+        else:
+            self.grammar_hash = status["grammar_hash"]
+        if worker.retrying and self.prefer_backup_modules:
+            self.prefer_backup_modules = False
+            self.backup_fallback = None
+            eliot.Message.log(
+                message_type="pool_recovered",
+                reason="a worker started from the plugins again",
+                pid=worker.process.pid,
+                module_names=self.module_names,
+            )
+        worker.grammar_hash = status["grammar_hash"]
+        for state in [self.state, *self.client_states]:
+            state.add_defaults(status.get("state_defaults", {}))
+        self.modes.add_reported(status.get("transitions", []))
+        self.learn(worker, None, status)
+        self.release(worker)
+        old, worker.replaces = worker.replaces, None
+        if old is not None and old in self.recycling:
+            # The spare is ready, so the worker it replaces can go.
+            self._leave(old)
+            if old in self.ready:
+                self.ready.remove(old)
+                self.nursery.start_soon(self._retire, old)
+
+
+@attr.s
+class PoolSizer:
+    """Choose how many workers the pool needs, from how often commands arrive and how long they take.
+
+    By Little's law, ``arrival_rate * service_time`` workers are busy on
+    average. The pool grows as soon as it needs to, but shrinks one worker at a
+    time, and only after needing fewer workers for ``shrink_after`` seconds.
+    """
+
+    min_workers: int = attr.ib()
+    max_workers: int = attr.ib()
+    interval: float = attr.ib(default=1.0)
+    smoothing: float = attr.ib(default=0.3)
+    # The fraction of the time each worker should be busy.
+    utilization: float = attr.ib(default=0.7)
+    shrink_after: float = attr.ib(default=30.0)
+    arrival_rate: float = attr.ib(default=0.0)
+    service_time: float = attr.ib(default=0.0)
+    _arrivals: int = attr.ib(default=0)
+    _low_since: Optional[float] = attr.ib(default=None)
+
+    def arrived(self) -> None:
+        """Count a command queued for a worker."""
+        self._arrivals += 1
+
+    def served(self, seconds: float) -> None:
+        """Record how long a command took."""
+        self.service_time += self.smoothing * (seconds - self.service_time)
+
+    def sample(self) -> None:
+        """Fold the commands that arrived in the last ``interval`` into the arrival rate."""
+        rate = self._arrivals / self.interval
+        self.arrival_rate += self.smoothing * (rate - self.arrival_rate)
+        self._arrivals = 0
+
+    def needed(self, waiting: int = 0) -> int:
+        """Get the number of workers for the current load, counting commands waiting for one."""
+        busy = math.ceil(self.arrival_rate * self.service_time / self.utilization)
+        return max(self.min_workers, min(self.max_workers, busy + waiting))
+
+    def target(self, size: int, waiting: int, now: float) -> int:
+        """Get the pool's next size, given its current ``size``."""
+        needed = self.needed(waiting)
+        if needed >= size:
+            self._low_since = None
+            return needed
+        if self._low_since is None:
+            self._low_since = now
+        if now - self._low_since < self.shrink_after:
+            return size
+        self._low_since = now
+        return size - 1
+
+
+async def adapt_pool_size(pool: Pool, sizer: PoolSizer) -> None:
+    """Resize the pool every ``sizer.interval`` seconds."""
+    while True:
+        await trio.sleep(sizer.interval)
+        sizer.sample()
+        target = sizer.target(pool.target, pool.waiting, trio.current_time())
+        if target != pool.target:
+            pool.resize(
+                target,
+                arrival_rate=sizer.arrival_rate,
+                service_time=sizer.service_time,
+                waiting=pool.waiting,
+            )
+
+
+async def retire_expired_workers(pool: Pool, interval: float) -> None:
+    """Replace idle workers once they expire, instead of when the next command comes."""
+    while True:
+        await trio.sleep(interval)
+        pool.retire_expired()
+
+
+# Seconds between logging the pool's stats.
+STATS_INTERVAL = 60.0
+
+
+async def log_pool_stats(pool: Pool, interval: float = STATS_INTERVAL) -> None:
+    """Log the pool's size and each worker's memory every ``interval`` seconds."""
+    while True:
+        await trio.sleep(interval)
+        eliot.Message.log(message_type="pool_stats", **pool.stats())
+
+
+def context_title(data: dict) -> Optional[str]:
+    """Get the window title the manager resolved for a command, if any."""
+    return (data.get("context") or {}).get("title")
+
+
+async def resolve_context() -> Optional[dict]:
+    """Describe the current window once, so workers don't each look it up."""
+    try:
+        return await context.current_context()
+    except Exception as e:
+        eliot.Message.log(message_type="context_unavailable", exception=str(e))
+        return None
+
+
+@attr.s
+class ContextLookup:
+    """The window of one utterance, looked up in the background.
+
+    Every transcript of the utterance shares the lookup, so the window is
+    resolved once, and the read loop never waits for it.
+    """
+
+    value: Optional[dict] = attr.ib(default=None)
+    _done: trio.Event = attr.ib(factory=trio.Event)
+
+    async def run(self) -> None:
+        try:
+            self.value = await resolve_context()
+        finally:
+            self._done.set()
+
+    async def get(self) -> Optional[dict]:
+        """Wait for the lookup, and get the window it found."""
+        await self._done.wait()
+        return self.value
+
+
+@attr.s
+class Speculation:
+    """A strict-mode partial transcript, parsed while the recognizer finalises it."""
+
+    data: dict = attr.ib()
+    state: state_module.StateStore = attr.ib()
+    worker: Worker = attr.ib()
+    lookup: ContextLookup = attr.ib()
+    command_id: int = attr.ib(factory=lambda: next(_command_ids))
+    status: Optional[dict] = attr.ib(default=None)
+    _done: trio.Event = attr.ib(factory=trio.Event)
+
+    def matches(self, data: dict, lookup: ContextLookup) -> bool:
+        """Check whether ``data`` is the command this speculation parsed, in the same utterance."""
+        return lookup is self.lookup and transcript_words(data) == transcript_words(
+            self.data
+        )
+
+    async def parse(self, pool: Pool) -> None:
+        """Have the worker parse the partial and hold it."""
+        try:
+            self.data["context"] = await self.lookup.get()
+            with eliot.start_action(action_type="speculate") as action:
+                try:
+                    await delegate_task(
+                        data=dict(self.data, partial=True),
+                        state=self.state,
+                        worker=self.worker,
+                        action=action,
+                        hold=True,
+                        command_id=self.command_id,
+                    )
+                except trio.BrokenResourceError:
+                    return
+                self.status = await pool.wait_for_status(self.worker)
+        finally:
+            self._done.set()
+
+    async def parsed(self) -> bool:
+        """Wait for the worker, and check whether it parsed the partial."""
+        await self._done.wait()
+        return self.status is not None and self.status["worker_status"] == "parsed"
+
+    async def finish(self, pool: Pool, turn: Optional[Turn] = None) -> Optional[dict]:
+        """Execute the held command in its ``turn``, or discard it without one."""
+        await self._done.wait()
+        return await _finish_command(
+            pool,
+            self.worker,
+            context_title(self.data),
+            self.command_id,
+            self.status,
+            turn,
+            self.state,
+        )
+
+
+@attr.s
+class Speculator:
+    """Keep at most one partial transcript parsed ahead on an idle worker."""
+
+    pool: Pool = attr.ib()
+    nursery: trio.Nursery = attr.ib()
+    current: Optional[Speculation] = attr.ib(default=None)
+
+    async def offer(
+        self,
+        data: dict,
+        state: state_module.StateStore,
+        idle: bool,
+        lookup: ContextLookup,
+    ) -> None:
+        """Parse the partial ``data`` ahead if a worker is free and nothing is waiting for one."""
+        if self.current is not None and self.current.matches(data, lookup):
+            return
+        self.abandon()
+        # Remote workers can't run a speculation that turns out to need this machine.
+        if not idle or not self.pool.available(remote=False):
+            return
+        # Prefer a worker warm for the window if the lookup has finished already.
+        title = context_title({"context": lookup.value})
+        worker = await self.pool.get_worker(title, remote=False)
+        self.current = Speculation(data, state, worker, lookup)
+        self.nursery.start_soon(self.current.parse, self.pool)
+
+    def claim(self, data: dict, lookup: ContextLookup) -> Optional[Speculation]:
+        """Take the speculation if it parsed the final ``data``, and drop it otherwise."""
+        if self.current is not None and self.current.matches(data, lookup):
+            speculation, self.current = self.current, None
+            eliot.Message.log(message_type="speculation_hit")
+            return speculation
+        self.abandon()
+        return None
+
+    def abandon(self) -> None:
+        """Discard the speculation, returning its worker to the pool."""
+        if self.current is not None:
+            self.nursery.start_soon(self.current.finish, self.pool)
+            self.current = None
+
 
 @log.log_async_call
-async def run_worker(data: dict, state: dict, pool: Pool):
-    """Get a process from the pool, send a job to it. Replace that worker when it quits."""
-    with eliot.start_action(action_type="run_with_work") as action:
-        worker = pool.get_process()
+async def run_worker(
+    data: dict,
+    state: state_module.StateStore,
+    pool: Pool,
+    worker: Optional[Worker] = None,
+    turn: Optional[Turn] = None,
+    speculation: Optional[Speculation] = None,
+):
+    """Get a worker from the pool, send a job to it. Replace that worker when it quits.
+
+    With a ``turn``, the worker parses the command right away but only runs it
+    once the commands before it have finished. With a ``speculation`` that
+    already parsed the command, run it on the speculation's worker instead.
+    """
+    title = context_title(data)
+    try:
+        with eliot.start_action(action_type="run_with_work") as action:
+            if speculation is not None:
+                if await speculation.parsed():
+                    return await speculation.finish(pool, turn)
+                # The partial didn't parse, so parse the final transcript.
+                await speculation.finish(pool)
+            return await _run_worker(data, state, pool, worker, turn, title, action)
+    finally:
+        if turn is not None:
+            # A command that never ran, because it failed to parse or its
+            # worker died, still keeps its place: the next one waits for the
+            # ones before it.
+            with trio.CancelScope(shield=True):
+                await turn.previous.wait()
+            turn.finished.set()
+
+
+async def _run_worker(data, state, pool, worker, turn, title, action, remote=True):
+    # Only held commands go to remote workers, so those that need this machine can move.
+    remote = remote and turn is not None
+    command_id = next(_command_ids)
+    while True:
+        if worker is None:
+            worker = await pool.get_worker(title, remote=remote)
+        try:
+            await delegate_task(
+                data=data,
+                state=state,
+                worker=worker,
+                action=action,
+                hold=turn is not None,
+                command_id=command_id,
+            )
+        except trio.BrokenResourceError:
+            # The worker exited while it was idle.
+            pool.end_hand_back(worker)
+            await pool.replace(worker)
+            worker = None
+        else:
+            break
+
+    if turn is None:
+        pool.executing[command_id] = (worker, None)
+    kept_local = False
+    try:
+        status = await pool.wait_for_status(worker)
+        kept_local = (
+            worker.remote
+            and status is not None
+            and status["worker_status"] == "parsed"
+            and not status.get("remote")
+        )
+        if kept_local:
+            # The command acts on this machine, such as by pressing keys. Later
+            # commands may hold every other local worker, so take the reserved
+            # one once it is this command's turn.
+            eliot.Message.log(message_type="command_kept_local", pid=worker.process.pid)
+            await _finish_command(pool, worker, title, command_id, status, None, state)
+            await turn.previous.wait()
+            local = await pool.get_worker(title, remote=False)
+    finally:
+        pool.end_hand_back(worker)
+    if kept_local:
+        return await _run_worker(
+            data, state, pool, local, turn, title, action, remote=False
+        )
+    return await _finish_command(pool, worker, title, command_id, status, turn, state)
 
-        await delegate_task(data=data, state=state, worker=worker, action=action)
-        await replay_child_messages(worker)
 
-        await worker.wait()
-        pool.add_new_process()
+async def _finish_command(pool, worker, title, command_id, status, turn, state=None):
+    """Execute or discard a parsed command, then return the worker to the pool."""
+    if status is not None and status["worker_status"] == "parsed":
+        if turn is not None:
+            await turn.previous.wait()
+        control = "discard" if turn is None or turn.cancelled() else "execute"
+        try:
+            await send_control(worker, control, command_id, state)
+        except trio.BrokenResourceError:
+            status = None
+        else:
+            pool.executing[command_id] = (worker, None if turn is None else turn.epoch)
+            status = await pool.wait_for_status(worker)
+    pool.executing.pop(command_id, None)
+
+    if status is not None:
+        pool.learn(worker, title, status, state)
+
+    if status is not None and not status["retiring"]:
+        pool.release(worker)
+        return status
+
+    await pool.replace(worker)
+    return status
 
 
 @log.log_async_call
 async def process_stream(
-    receiver, num_workers: int, should_log: bool, module_names: Optional[List[str]]
+    receiver,
+    num_workers: int,
+    should_log: bool,
+    module_names: Optional[List[str]],
+    policy: Optional[utils.RecyclePolicy] = None,
+    use_fork_server: bool = False,
+    production: bool = False,
+    context_ttl: Optional[float] = None,
+    max_in_flight: Optional[int] = None,
+    command_timeout: Optional[float] = None,
+    eager_settle: float = EAGER_SETTLE,
+    framing: str = "lines",
+    min_workers: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    max_worker_memory: Optional[float] = None,
+    recycle_after: Optional[int] = None,
+    listeners: Sequence[trio.abc.Listener] = (),
+    remote_listeners: Sequence[trio.abc.Listener] = (),
+    remote_token: Optional[str] = None,
 ):
-    """Handle all the commands coming in by delegating them to workers."""
+    """Handle all the commands coming in by delegating them to workers.
 
-    state = {"modes": {"strict": True}}
+    Read commands from ``receiver``, or, if it is None, from each client that
+    connects to one of the ``listeners``, until cancelled. Each client has its
+    own state, and its commands run in order regardless of other clients'.
 
-    pool = Pool(num_workers, should_log=should_log, module_names=module_names)
-    pool.start()
+    Workers that connect to the ``remote_listeners`` join the pool, but only
+    run commands whose functions were registered with ``remote``.
 
-    async for message_bytes in receiver:
-        message = message_bytes.decode()
+    The pool starts with ``num_workers`` workers, and grows and shrinks
+    between ``min_workers`` and ``max_workers`` with the load. A worker using
+    ``max_worker_memory`` MiB or more, or that ran ``recycle_after`` commands,
+    is replaced once a spare is ready.
 
-        with eliot.start_action(state=state):
-            try:
-                data = json.loads(message)
-            except json.JSONDecodeError:
-                handle_unexpected_worker_bytes(message_bytes)
-                continue
-            if "result" not in data.keys():
-                # Received a log, not a command.
-                print(message)
-                continue
-            # Handle state changes.
-            # XXX maybe this should be in the worker, but where to store state?
-            maybe_new_state = set_state(data, state)
-            if maybe_new_state is not None:
-                state = maybe_new_state
-                continue
+    Up to ``max_in_flight`` commands, and at most one per worker, are parsed at
+    the same time, but each command runs only after the one before it is done.
 
-            # This logic could be moved into worker/plugin to allow for more modes.
-            if not data["result"]["final"] and state["modes"]["strict"]:
-                continue
-            if data["result"]["final"] and not state["modes"]["strict"]:
+    In eager mode, each segment's partial transcripts replace each other while
+    they wait in the queue. Once one is unchanged for ``eager_settle`` seconds,
+    its new complete commands run, but not the last until more words follow it
+    or the final result arrives. In strict mode, an
+    idle worker parses the latest partial transcript ahead, and runs it as soon
+    as a final result with the same transcript arrives.
+    """
+
+    sizer = PoolSizer(
+        min_workers=num_workers if min_workers is None else min_workers,
+        max_workers=num_workers if max_workers is None else max_workers,
+    )
+    if max_in_flight is None or (
+        max_in_flight > sizer.max_workers and not remote_listeners
+    ):
+        # More commands than workers in flight could leave the next command to
+        # run waiting for a worker held by a later one.
+        max_in_flight = sizer.max_workers
+
+    async with trio.open_nursery() as nursery:
+        pool = Pool(
+            nursery,
+            num_workers,
+            should_log=should_log,
+            production=production,
+            context_ttl=context_ttl,
+            module_names=module_names,
+            policy=policy,
+            command_timeout=command_timeout,
+            framing=streaming.FRAMINGS[framing],
+            max_rss=None
+            if max_worker_memory is None
+            else int(max_worker_memory * 2 ** 20),
+            recycle_after=recycle_after,
+            remote_token=remote_token,
+        )
+        if use_fork_server:
+            pool.start_fork_server()
+        await pool.start()
+        if remote_listeners:
+            nursery.start_soon(
+                trio.serve_listeners, pool.add_remote_worker, remote_listeners
+            )
+        nursery.start_soon(log_pool_stats, pool)
+        if policy is not None and policy.max_seconds is not None:
+            nursery.start_soon(retire_expired_workers, pool, sizer.interval)
+        if sizer.min_workers != sizer.max_workers:
+            nursery.start_soon(adapt_pool_size, pool, sizer)
+        focus.start_tracker()
+
+        client = functools.partial(
+            handle_client,
+            pool=pool,
+            max_in_flight=max_in_flight,
+            eager_settle=eager_settle,
+            sizer=sizer,
+        )
+        if receiver is None:
+            async with trio.open_nursery() as servers:
+                for listener in listeners:
+                    servers.start_soon(
+                        trio.serve_listeners,
+                        functools.partial(serve_client, client, pool),
+                        [listener],
+                    )
+        else:
+            await client(receiver, pool.state)
+
+        nursery.cancel_scope.cancel()
+        if pool.fork_server is not None:
+            pool.fork_server.close()
+
+
+async def serve_client(client, pool: Pool, stream: trio.abc.Stream) -> None:
+    """Handle the commands from a client connected to the manager's socket."""
+    state = pool.new_state()
+    eliot.Message.log(message_type="client_connected")
+    try:
+        receiver = await streaming.detect_receiver(stream)
+        await client(receiver, state)
+    except (ValueError, trio.BrokenResourceError) as e:
+        eliot.Message.log(message_type="client_failed", exception=str(e))
+    finally:
+        pool.drop_state(state)
+        eliot.Message.log(message_type="client_disconnected")
+        await stream.aclose()
+
+
+async def handle_client(
+    receiver,
+    state: state_module.StateStore,
+    pool: Pool,
+    max_in_flight: int,
+    eager_settle: float,
+    sizer: Optional[PoolSizer] = None,
+) -> None:
+    """Run one producer's commands in order, with its own modes and cancellations."""
+    in_flight = trio.Semaphore(max_in_flight)
+    epoch = Epoch()
+    segments: Dict[Optional[int], Segment] = {}
+    lookups: Dict[Optional[int], ContextLookup] = {}
+    queue_send, queue_receive = trio.open_memory_channel(math.inf)
+
+    async def take_effect(transcript: str) -> None:
+        """Switch modes, or cancel the commands so far, for a phrase such as "stop"."""
+        transition = pool.modes.handle(transcript, state)
+        speculator.abandon()
+        if transition is not None and transition.control == "cancel":
+            epoch.advance()
+            eliot.Message.log(message_type="commands_cancelled")
+            await pool.cancel_running(epoch)
+
+    async def take_effect_when_stable(segment: Segment, phrase: str) -> None:
+        if await segment.wait_for_phrase(phrase, eager_settle):
+            await take_effect(phrase)
+
+    async with trio.open_nursery() as lanes:
+        lanes.start_soon(
+            dispatch_commands,
+            queue_receive,
+            pool,
+            in_flight,
+            Turn.start(epoch),
+            eager_settle,
+            sizer,
+        )
+        speculator = Speculator(pool, lanes)
+
+        # The priority lane: mode and control phrases take effect as soon as
+        # they are final, while other commands wait in the queue for a worker.
+        async with queue_send:
+            async for message_bytes in receiver:
+                message = message_bytes.decode()
+
+                with eliot.start_action(state_version=state.version):
+                    try:
+                        data = json.loads(message)
+                    except json.JSONDecodeError:
+                        handle_unexpected_worker_bytes(message_bytes)
+                        continue
+                    if "result" not in data.keys():
+                        # Received a log, not a command.
+                        print(message)
+                        continue
+                    # Switch modes or cancel here, without a worker round trip.
+                    # A partial "stop" may still become "stop recording", so only
+                    # an eager-mode partial that stays unchanged counts early.
+                    segment_id = data.get("segment")
+                    transcript = data["result"]["hypotheses"][0]["transcript"]
+                    transition = pool.modes.find(transcript, state)
+                    if transition is not None and not transition.is_command():
+                        phrase = transition.phrase
+                        if data["result"]["final"]:
+                            segment = segments.pop(segment_id, None)
+                            lookups.pop(segment_id, None)
+                            if segment is None or segment.act_on(phrase):
+                                await take_effect(phrase)
+                        elif not state.get("modes.strict"):
+                            segment = segments.setdefault(segment_id, Segment())
+                            segment.hear_phrase(phrase)
+                            lanes.start_soon(take_effect_when_stable, segment, phrase)
+                        continue
+                    if state.get("modes.sleeping"):
+                        continue
+
+                    # Look up the window once per utterance, without waiting for it.
+                    lookup = lookups.get(segment_id)
+                    if lookup is None:
+                        lookup = lookups[segment_id] = ContextLookup()
+                        lanes.start_soon(lookup.run)
+                    if data["result"]["final"]:
+                        del lookups[segment_id]
+
+                    # This logic could be moved into worker/plugin to allow for more modes.
+                    if not data["result"]["final"] and state.get("modes.strict"):
+                        idle = (
+                            in_flight.value == max_in_flight
+                            and not queue_send.statistics().current_buffer_used
+                        )
+                        await speculator.offer(data, state, idle, lookup)
+                        continue
+
+                    if not state.get("modes.strict"):
+                        if data["result"]["final"]:
+                            # Run what the segment's partials held back.
+                            segment = segments.pop(segment_id, None) or Segment()
+                        else:
+                            segment = segments.setdefault(segment_id, Segment())
+                        if segment.offer(data):
+                            if sizer is not None:
+                                sizer.arrived()
+                            await queue_send.send(
+                                (segment, state, epoch.number, None, lookup)
+                            )
+                        continue
+                    speculation = speculator.claim(data, lookup)
+                    if sizer is not None:
+                        sizer.arrived()
+                    await queue_send.send(
+                        (data, state, epoch.number, speculation, lookup)
+                    )
+            speculator.abandon()
+
+
+async def dispatch_commands(
+    queue: trio.abc.ReceiveChannel,
+    pool: Pool,
+    in_flight: trio.Semaphore,
+    turn: Turn,
+    settle: float = 0.0,
+    sizer: Optional[PoolSizer] = None,
+) -> None:
+    """Hand queued commands to workers, skipping the ones cancelled while queued.
+
+    For an eager-mode segment, wait until its newest partial has been unchanged
+    for ``settle`` seconds and send only the words that have not run yet.
+    """
+    async with trio.open_nursery() as jobs:
+        async for data, state, number, speculation, lookup in queue:
+            segment = None
+            if isinstance(data, Segment):
+                segment = data
+                if number != turn.epoch.number:
+                    eliot.Message.log(
+                        message_type="command_dropped", data=segment.pending
+                    )
+                    segment.drop()
+                    continue
+                data = await segment.take(settle)
+                if data is None:
+                    continue
+            data["context"] = await lookup.get()
+            await in_flight.acquire()
+            worker = None
+            if number == turn.epoch.number and speculation is None:
+                worker = await pool.get_worker(context_title(data))
+            if number != turn.epoch.number:
+                eliot.Message.log(message_type="command_dropped", data=data)
+                if worker is not None:
+                    pool.end_hand_back(worker)
+                    pool.release(worker)
+                if speculation is not None:
+                    jobs.start_soon(speculation.finish, pool)
+                in_flight.release()
+                if segment is not None:
+                    segment.finish(None)
                 continue
+            turn = turn.next(number)
+            jobs.start_soon(
+                _run_in_flight,
+                in_flight,
+                data,
+                state,
+                pool,
+                worker,
+                turn,
+                segment,
+                speculation,
+                sizer,
+            )
+
+
+async def _run_in_flight(
+    in_flight, data, state, pool, worker, turn, segment, speculation, sizer
+):
+    status = None
+    started = trio.current_time()
+    try:
+        status = await run_worker(
+            data=data,
+            state=state,
+            pool=pool,
+            worker=worker,
+            turn=turn,
+            speculation=speculation,
+        )
+    finally:
+        in_flight.release()
+        if sizer is not None:
+            sizer.served(trio.current_time() - started)
+        if segment is not None:
+            segment.finish(status)
+
 
-            await run_worker(data=data, state=state, pool=pool)
+async def open_unix_listener(path: str) -> trio.SocketListener:
+    """Listen on a Unix socket at ``path``, replacing a stale socket left there."""
+    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    sock = trio.socket.socket(trio.socket.AF_UNIX, trio.socket.SOCK_STREAM)
+    await sock.bind(path)
+    sock.listen()
+    return trio.SocketListener(sock)
 
 
 @log.log_async_call
-async def async_main(should_log, module_names: Optional[List[str]], num_workers: int):
-    """Read newline-separated inputs on stdin, and process them."""
+async def async_main(
+    should_log,
+    module_names: Optional[List[str]],
+    num_workers: int,
+    policy: Optional[utils.RecyclePolicy] = None,
+    use_fork_server: bool = False,
+    production: bool = False,
+    context_ttl: Optional[float] = None,
+    max_in_flight: Optional[int] = None,
+    command_timeout: Optional[float] = None,
+    eager_settle: float = EAGER_SETTLE,
+    framing: str = "lines",
+    min_workers: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    max_worker_memory: Optional[float] = None,
+    recycle_after: Optional[int] = None,
+    socket_path: Optional[str] = None,
+    tcp_port: Optional[int] = None,
+    remote_host: str = "127.0.0.1",
+    remote_port: Optional[int] = None,
+    remote_token: Optional[str] = None,
+):
+    """Read newline-separated inputs on stdin, and process them.
 
-    stream = trio._unix_pipes.PipeReceiveStream(os.dup(0))
-    receiver = streaming.TerminatedFrameReceiver(stream, b"\n")
+    With ``socket_path`` or ``tcp_port``, accept clients on a Unix socket or on
+    localhost instead, each sending json lines or length-prefixed json. With
+    ``remote_port``, accept workers on ``remote_host`` too, if they send the
+    ``remote_token``.
+    """
 
-    await process_stream(
-        receiver,
-        num_workers=num_workers,
-        should_log=should_log,
-        module_names=module_names,
-    )
+    receiver = None
+    listeners: List[trio.abc.Listener] = []
+    if socket_path is not None:
+        listeners.append(await open_unix_listener(socket_path))
+    if tcp_port is not None:
+        listeners += await trio.open_tcp_listeners(tcp_port, host="127.0.0.1")
+    remote_listeners: List[trio.abc.Listener] = []
+    if remote_port is not None:
+        remote_listeners += await trio.open_tcp_listeners(remote_port, host=remote_host)
+    if not listeners:
+        stream = trio._unix_pipes.PipeReceiveStream(os.dup(0))
+        receiver = streaming.TerminatedFrameReceiver(stream, b"\n")
+
+    try:
+        await process_stream(
+            receiver,
+            num_workers=num_workers,
+            should_log=should_log,
+            module_names=module_names,
+            policy=policy,
+            use_fork_server=use_fork_server,
+            production=production,
+            context_ttl=context_ttl,
+            max_in_flight=max_in_flight,
+            command_timeout=command_timeout,
+            eager_settle=eager_settle,
+            framing=framing,
+            min_workers=min_workers,
+            max_workers=max_workers,
+            max_worker_memory=max_worker_memory,
+            recycle_after=recycle_after,
+            listeners=listeners,
+            remote_listeners=remote_listeners,
+            remote_token=remote_token,
+        )
+    finally:
+        if socket_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(socket_path)
 
 
 @utils.public
 @log.log_call
-def main(should_log: bool, module_names: Optional[List[str]], num_workers: int):
+def main(
+    should_log: bool,
+    module_names: Optional[List[str]],
+    num_workers: int,
+    max_commands: Optional[int] = None,
+    max_seconds: Optional[float] = None,
+    exit_on_error: bool = True,
+    use_fork_server: bool = False,
+    production: bool = False,
+    context_ttl: Optional[float] = None,
+    max_in_flight: Optional[int] = None,
+    command_timeout: Optional[float] = None,
+    eager_settle: float = EAGER_SETTLE,
+    framing: str = "lines",
+    min_workers: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    max_worker_memory: Optional[float] = None,
+    recycle_after: Optional[int] = None,
+    socket_path: Optional[str] = None,
+    tcp_port: Optional[int] = None,
+    remote_host: str = "127.0.0.1",
+    remote_port: Optional[int] = None,
+    remote_token: Optional[str] = None,
+):
     """Start the event loop."""
-    trio.run(functools.partial(async_main, should_log, module_names, num_workers))
+    policy = utils.RecyclePolicy(
+        max_commands=max_commands, max_seconds=max_seconds, exit_on_error=exit_on_error
+    )
+    trio.run(
+        functools.partial(
+            async_main,
+            should_log,
+            module_names,
+            num_workers,
+            policy,
+            use_fork_server,
+            production,
+            context_ttl,
+            max_in_flight,
+            command_timeout,
+            eager_settle,
+            framing,
+            min_workers,
+            max_workers,
+            max_worker_memory,
+            recycle_after,
+            socket_path,
+            tcp_port,
+            remote_host,
+            remote_port,
+            remote_token,
+        )
+    )
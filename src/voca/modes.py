@@ -0,0 +1,145 @@
+"""Switch modes, such as sleeping or dictation, when the user says a phrase.
+
+The manager keeps a ``ModeMachine`` of transitions keyed by their phrase, so
+it can switch modes as soon as an utterance arrives, without asking a worker.
+A transition changes one key of the shared state (see ``voca.state``), or runs
+one of the manager's controls, such as cancelling the commands so far.
+
+Plugins add their own modes by giving their ``Wrapper`` a list of
+``Transition`` objects as ``modes``, along with the mode's default in ``state``.
+Workers report them to the manager when they are ready.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+import attr
+import eliot
+
+from voca import state as state_module
+from voca import utils
+
+
+def normalize(phrase: str) -> str:
+    return " ".join(phrase.split())
+
+
+@utils.public
+@attr.dataclass
+class Transition:
+    """Set ``key`` to ``value`` when the user says ``phrase``.
+
+    With ``toggle``, flip the key instead. With ``when``, only switch while the
+    other keys have those values. With ``control``, run the manager's control of
+    that name, such as ``cancel``. With neither a key nor a control, the phrase
+    goes to the workers as a command, so a plugin can take over a phrase such as
+    "stop" for its own rule.
+    """
+
+    phrase: str = attr.ib(converter=normalize)
+    key: Optional[str] = None
+    value: Any = True
+    toggle: bool = False
+    when: Dict[str, Any] = attr.ib(factory=dict)
+    control: Optional[str] = None
+
+    def applies(self, store: state_module.StateStore) -> bool:
+        return all(store.get(key) == value for key, value in self.when.items())
+
+    def is_command(self) -> bool:
+        """Check whether the phrase is left for the workers to run."""
+        return self.key is None and self.control is None
+
+    def apply(self, store: state_module.StateStore) -> None:
+        if self.key is None:
+            return
+        value = not store.get(self.key) if self.toggle else self.value
+        store.set(self.key, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return attr.asdict(self)
+
+
+# The modes the manager itself uses.
+DEFAULTS = [
+    Transition("mode", "modes.strict", toggle=True),
+    Transition("sleep", "modes.sleeping", True),
+    Transition("wake", "modes.sleeping", False),
+    Transition("stop", control="cancel"),
+    Transition("cancel", control="cancel"),
+]
+
+
+@utils.public
+@attr.s
+class ModeMachine:
+    """The transitions the manager knows, looked up by their phrase."""
+
+    transitions: Dict[str, List[Transition]] = attr.ib(factory=dict)
+
+    @classmethod
+    def with_defaults(cls) -> ModeMachine:
+        machine = cls()
+        machine.add_all(DEFAULTS)
+        return machine
+
+    def add(self, transition: Transition) -> None:
+        """Add a transition, unless the machine already has it."""
+        existing = self.transitions.setdefault(transition.phrase, [])
+        if transition not in existing:
+            existing.append(transition)
+
+    def add_all(self, transitions: Iterable[Transition]) -> None:
+        for transition in transitions:
+            self.add(transition)
+
+    def add_reported(self, reported: Iterable[Dict[str, Any]]) -> None:
+        """Add the transitions a worker reported in its ``ready`` status.
+
+        A plugin's transitions for a phrase replace the manager's own ones.
+        """
+        for fields in reported:
+            transition = Transition(**fields)
+            existing = self.transitions.get(transition.phrase, [])
+            self.transitions[transition.phrase] = [
+                other for other in existing if other not in DEFAULTS
+            ]
+            self.add(transition)
+
+    def find(
+        self, transcript: str, store: state_module.StateStore
+    ) -> Optional[Transition]:
+        """Get the transition for ``transcript`` that applies now, if any."""
+        for transition in self.transitions.get(normalize(transcript), ()):
+            if transition.applies(store):
+                return transition
+        return None
+
+    def handle(
+        self, transcript: str, store: state_module.StateStore
+    ) -> Optional[Transition]:
+        """Apply the transition for ``transcript``, if any, and return it."""
+        transition = self.find(transcript, store)
+        if transition is not None:
+            transition.apply(store)
+            eliot.Message.log(
+                message_type="mode_transition",
+                phrase=transition.phrase,
+                key=transition.key,
+                value=None if transition.key is None else store.get(transition.key),
+                control=transition.control,
+            )
+        return transition
+
+
+@utils.public
+def collect_transitions(wrappers: Iterable[utils.Wrapper]) -> List[Dict[str, Any]]:
+    """List the transitions the plugins declare, for the worker to report."""
+    return [
+        transition.to_dict() for wrapper in wrappers for transition in wrapper.modes
+    ]
@@ -5,19 +5,33 @@ Combine rules from multiple modules into a single Lark grammar.
 
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import json
+import logging
+import pathlib
+import pickle
 import re
 import textwrap
 import types
 import unicodedata
 
+from typing import Any
+from typing import Dict
 from typing import Tuple
 from typing import List
 from typing import Iterable
+from typing import Optional
+from typing import Set
 
 
+import attr
+import eliot
 import lark
+import lark.load_grammar
 
 
+from voca import config
 from voca import log
 from voca import utils
 
@@ -124,4 +138,383 @@ def combine_registries(registries):
     for registry in registries:
         combined.pattern_to_function.update(registry.pattern_to_function)
         combined.patterns.update(registry.patterns)
+        combined.remote_patterns.update(registry.remote_patterns)
     return combined
+
+
+@utils.public
+def hash_grammar(grammar: str) -> str:
+    """Hash a grammar string, to tell whether two grammars are the same."""
+    return hashlib.sha256(grammar.encode()).hexdigest()
+
+
+@utils.public
+@log.log_call
+def grammar_hash(wrapper_group: utils.WrapperGroup) -> str:
+    """Hash the grammar of all the wrappers in the group, regardless of context."""
+    registry = combine_registries(
+        wrapper.registry for wrapper in wrapper_group.wrappers
+    )
+    return hash_grammar(build_grammar(registry, build_rules(registry)))
+
+
+# Options shared by every parser. ``app.main`` turns off debug in production mode.
+PARSER_OPTIONS: Dict[str, Any] = {"debug": True, "maybe_placeholders": True}
+
+# Parser configurations, fastest first.
+LALR = {"parser": "lalr", "lexer": "contextual"}
+EARLEY_STANDARD = {"parser": "earley", "lexer": "standard"}
+EARLEY_DYNAMIC = {"parser": "earley", "lexer": "dynamic_complete"}
+
+
+@utils.public
+@attr.dataclass
+class ParserChoice:
+    """The parser configuration picked for a grammar, and why faster ones were rejected."""
+
+    options: Dict[str, Any]
+    reasons: List[str] = attr.ib(factory=list)
+
+
+@contextlib.contextmanager
+def _capture_lark_warnings():
+    """Collect the warnings lark logs while building a parser."""
+    warnings: List[str] = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            warnings.append(record.getMessage())
+
+    logger = logging.getLogger("lark")
+    original_handlers, original_level = logger.handlers, logger.level
+    logger.handlers = [Handler(logging.WARNING)]
+    logger.setLevel(logging.WARNING)
+    try:
+        yield warnings
+    finally:
+        logger.handlers = original_handlers
+        logger.setLevel(original_level)
+
+
+def _can_span_whitespace(regexp: str) -> bool:
+    """Conservatively guess whether a regular expression can match across words."""
+    parts = re.findall(r"\\.|\[\^|.", regexp)
+    return any(part in {" ", r"\s", r"\W", r"\D", ".", "[^"} for part in parts)
+
+
+def lexer_problems(parser: lark.Lark) -> List[str]:
+    """Find terminals that a standard or contextual lexer could tokenize differently.
+
+    The dynamic lexer tries every way of splitting the text into terminals, so
+    it doesn't matter whether a regular expression can also match a literal or
+    run across several words. The other lexers commit to one token at a time.
+    """
+    terminals = [
+        terminal
+        for terminal in parser.terminals
+        if terminal.name not in parser.ignore_tokens
+    ]
+    literals = [
+        terminal.pattern.value
+        for terminal in terminals
+        if isinstance(terminal.pattern, lark.lexer.PatternStr)
+    ]
+
+    problems = []
+    for terminal in terminals:
+        if isinstance(terminal.pattern, lark.lexer.PatternStr):
+            continue
+        regexp = terminal.pattern.to_regexp()
+        if _can_span_whitespace(regexp):
+            problems.append(f"/{regexp}/ can match across words")
+            continue
+        compiled = re.compile(regexp)
+        collisions = [literal for literal in literals if compiled.fullmatch(literal)]
+        if collisions:
+            problems.append(f"/{regexp}/ also matches {collisions[0]!r}")
+    return problems
+
+
+@utils.public
+@log.log_call
+def choose_parser(grammar: str) -> ParserChoice:
+    """Pick the fastest parser configuration that handles ``grammar`` like the dynamic Earley parser."""
+    reasons = []
+    terminals_from = None
+
+    try:
+        with _capture_lark_warnings() as warnings:
+            terminals_from = lark.Lark(grammar, **LALR, debug=True)
+    except lark.exceptions.GrammarError as e:
+        conflicts = [str(e).splitlines()[0]]
+    else:
+        conflicts = [warning for warning in warnings if "conflict" in warning]
+    reasons += [f"lalr: {conflict}" for conflict in conflicts]
+
+    if terminals_from is None:
+        terminals_from = lark.Lark(grammar, **EARLEY_STANDARD)
+    problems = lexer_problems(terminals_from)
+
+    if not conflicts and not problems:
+        return ParserChoice(LALR, reasons)
+    reasons += [f"lexer: {problem}" for problem in problems]
+    if not problems:
+        return ParserChoice(EARLEY_STANDARD, reasons)
+    return ParserChoice(EARLEY_DYNAMIC, reasons)
+
+
+def _default_cache_directory() -> pathlib.Path:
+    return config.get_config_dir() / "grammar_cache"
+
+
+def _load_grammar(grammar: str) -> lark.load_grammar.Grammar:
+    """Parse a grammar string into lark's grammar object."""
+    result = lark.load_grammar.load_grammar(grammar, "<string>", [], False)
+    # Newer versions of lark also return the files the grammar imported.
+    if isinstance(result, tuple):
+        return result[0]
+    return result
+
+
+@utils.public
+@attr.s
+class GrammarCache:
+    """Keep compiled grammars on disk so new workers don't compile them again.
+
+    Entries are keyed by a hash of the grammar text, the parser options, and
+    the lark version, so changing a plugin or upgrading lark makes a new entry.
+    Lark can save the whole LALR parser; for other parsers, the cache saves the
+    grammar after lark has parsed the grammar text.
+    """
+
+    directory: pathlib.Path = attr.ib(factory=_default_cache_directory)
+    max_entries: int = attr.ib(default=64)
+
+    def path(self, grammar: str, options: Dict[str, Any]) -> pathlib.Path:
+        """Get the cache file for a grammar compiled with ``options``."""
+        key = hash_grammar(
+            "\n".join([grammar, repr(sorted(options.items())), lark.__version__])
+        )
+        suffix = ".lalr" if options.get("parser") == "lalr" else ".grammar"
+        return (self.directory / key).with_suffix(suffix)
+
+    def choose_parser(self, grammar: str) -> ParserChoice:
+        """Get the parser choice for ``grammar``, analysing it only the first time."""
+        path = (
+            self.directory / hash_grammar("\n".join([grammar, lark.__version__]))
+        ).with_suffix(".choice")
+        try:
+            return ParserChoice(**json.loads(path.read_text()))
+        except (FileNotFoundError, ValueError, TypeError):
+            pass
+        choice = choose_parser(grammar)
+        self.save(path, lambda f: f.write(json.dumps(attr.asdict(choice)).encode()))
+        return choice
+
+    def build_parser(self, grammar: str, **options) -> lark.Lark:
+        """Build a parser, reusing the compiled grammar from disk when it's there."""
+        path = self.path(grammar, options)
+        try:
+            with open(path, "rb") as f:
+                if path.suffix == ".lalr":
+                    parser = lark.Lark.load(f)
+                else:
+                    parser = lark.Lark(pickle.load(f), **options)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            eliot.Message.log(
+                message_type="grammar_cache_invalid", path=str(path), exception=str(e)
+            )
+        else:
+            eliot.Message.log(message_type="grammar_cache_hit", path=str(path))
+            return parser
+
+        eliot.Message.log(message_type="grammar_cache_miss", path=str(path))
+        if path.suffix == ".lalr":
+            parser = lark.Lark(grammar, **options)
+            self.save(path, parser.save)
+        else:
+            loaded = _load_grammar(grammar)
+            self.save(path, lambda f: pickle.dump(loaded, f))
+            parser = lark.Lark(loaded, **options)
+        return parser
+
+    def save(self, path: pathlib.Path, write) -> None:
+        """Atomically write a cache entry, so concurrent workers never see half of one."""
+        config.write_atomically(path, write)
+        self.prune()
+
+    def prune(self) -> None:
+        """Remove the least recently written entries beyond ``max_entries``."""
+        entries = [path for path in self.directory.iterdir() if path.suffix != ".tmp"]
+        entries.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in entries[self.max_entries :]:
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+
+
+@utils.public
+@log.log_call(include_args=[], include_result=False)
+def build_parser(
+    grammar: str, grammar_cache: Optional[GrammarCache] = None
+) -> lark.Lark:
+    """Build the fastest parser that accepts a grammar built by ``build_grammar``."""
+    if grammar_cache is None:
+        grammar_cache = GrammarCache()
+    choice = grammar_cache.choose_parser(grammar)
+    eliot.Message.log(
+        message_type="parser_selected",
+        grammar_hash=hash_grammar(grammar),
+        options=choice.options,
+        reasons=choice.reasons,
+    )
+    return grammar_cache.build_parser(grammar, **choice.options, **PARSER_OPTIONS)
+
+
+_QUOTED_LITERAL = re.compile(r"""\s*(?:"([^"\\]*)"|'([^'\\]*)')(?![a-z])""")
+
+
+def _leading_literals(pattern: str) -> Tuple[Tuple[str, ...], bool]:
+    """Get the words of the quoted strings at the start of a pattern, and whether that's all of it."""
+    words: List[str] = []
+    position = 0
+    while position < len(pattern.rstrip()):
+        match = _QUOTED_LITERAL.match(pattern, position)
+        if match is None:
+            return tuple(words), False
+        words += (match.group(1) or match.group(2) or "").split()
+        position = match.end()
+    return tuple(words), True
+
+
+def literal_words(pattern: str) -> Optional[Tuple[str, ...]]:
+    """Get the words of a pattern made only of quoted strings, or None for other patterns."""
+    words, complete = _leading_literals(pattern)
+    if not complete or not words:
+        return None
+    return words
+
+
+@attr.s
+class _TrieNode:
+    children: Dict[str, _TrieNode] = attr.ib(factory=dict)
+    rule_name: Optional[str] = attr.ib(default=None)
+
+
+@utils.public
+@attr.s
+class LiteralTrie:
+    """Map the words of every literal-only rule to the rule's name."""
+
+    root: _TrieNode = attr.ib(factory=_TrieNode)
+    shared_first_words: Set[str] = attr.ib(factory=set)
+
+    def add(self, words: Tuple[str, ...], rule_name: str) -> None:
+        """Add a rule that matches exactly ``words``, keeping the first rule for duplicates."""
+        node = self.root
+        for word in words:
+            node = node.children.setdefault(word, _TrieNode())
+        if node.rule_name is None:
+            node.rule_name = rule_name
+
+    def matches(self, words: List[str], start: int) -> List[Tuple[int, str]]:
+        """Find the rules matching ``words`` from ``start``, as (end, rule name), longest first."""
+        found = []
+        node = self.root
+        for end in range(start, len(words)):
+            node = node.children.get(words[end])
+            if node is None:
+                break
+            if node.rule_name is not None:
+                found.append((end + 1, node.rule_name))
+        return found[::-1]
+
+    def segment(self, words: List[str]) -> Optional[List[str]]:
+        """Split all of ``words`` into literal rules, preferring longer phrases."""
+        # best[i] is the first rule of a segmentation of words[i:], and where it ends.
+        best: List[Optional[Tuple[int, str]]] = [None] * len(words) + [(len(words), "")]
+        for start in reversed(range(len(words))):
+            for end, rule_name in self.matches(words, start):
+                if best[end] is not None:
+                    best[start] = (end, rule_name)
+                    break
+        if not words or best[0] is None:
+            return None
+        rule_names = []
+        position = 0
+        while position < len(words):
+            position, rule_name = best[position]
+            rule_names.append(rule_name)
+        return rule_names
+
+    def prefix(self, words: List[str]) -> Tuple[List[str], int]:
+        """Greedily match literal rules from the start of ``words``, returning them and where they stop."""
+        rule_names = []
+        position = 0
+        while position < len(words):
+            if words[position] in self.shared_first_words:
+                # Another rule starts with this word, so let lark decide.
+                break
+            found = self.matches(words, position)
+            if not found:
+                break
+            position, rule_name = found[0]
+            rule_names.append(rule_name)
+        return rule_names, position
+
+
+@utils.public
+@log.log_call(include_result=False)
+def build_trie(rules: Iterable[utils.Rule]) -> LiteralTrie:
+    """Build a trie of the rules whose patterns are only quoted strings."""
+    trie = LiteralTrie()
+    for rule in rules:
+        words, complete = _leading_literals(rule.pattern)
+        if complete and words:
+            trie.add(words, rule.name)
+        elif words:
+            trie.shared_first_words.add(words[0])
+    return trie
+
+
+def _literal_tree(rule_names: List[str]) -> List[lark.Tree]:
+    return [lark.Tree(rule_name, []) for rule_name in rule_names]
+
+
+@utils.public
+@attr.s
+class TrieParser:
+    """Resolve literal commands with a trie, and use lark only for the rest.
+
+    An utterance made entirely of literal commands is resolved without lark.
+    Otherwise the leading literal commands come from the trie, stopping at any
+    word that also starts a non-literal rule, and lark parses the remainder; if
+    that fails, lark parses the whole utterance. When an
+    utterance can be read either as literal commands or through another rule,
+    the literal commands win.
+    """
+
+    parser: lark.Lark = attr.ib()
+    trie: LiteralTrie = attr.ib(factory=LiteralTrie)
+
+    def parse(self, text: str) -> lark.Tree:
+        """Parse ``text`` into a ``message_group`` tree like the lark parser would."""
+        words = text.split()
+        rule_names = self.trie.segment(words)
+        if rule_names is not None:
+            eliot.Message.log(message_type="trie_parse", rules=rule_names)
+            return lark.Tree("message_group", _literal_tree(rule_names))
+
+        rule_names, position = self.trie.prefix(words)
+        if rule_names:
+            try:
+                rest = self.parser.parse(" ".join(words[position:]))
+            except lark.exceptions.LarkError:
+                pass
+            else:
+                eliot.Message.log(message_type="trie_prefix_parse", rules=rule_names)
+                return lark.Tree(
+                    "message_group", _literal_tree(rule_names) + rest.children
+                )
+        return self.parser.parse(text)
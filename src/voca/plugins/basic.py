@@ -82,12 +82,19 @@ async def press(chord: str):
     await trio.run_sync_in_worker_thread(type_chord, chord)
 
 
+# Characters typed per call, so a long message can be cancelled part way through.
+WRITE_CHUNK_SIZE = 16
+
+
 @log.log_async_call
 async def write(message: str):
     """Type the ``message``."""
-    await trio.run_sync_in_worker_thread(
-        functools.partial(pyautogui.typewrite, message)
-    )
+    for start in range(0, len(message), WRITE_CHUNK_SIZE):
+        await trio.run_sync_in_worker_thread(
+            functools.partial(
+                pyautogui.typewrite, message[start : start + WRITE_CHUNK_SIZE]
+            )
+        )
 
 
 @registry.register('"alert" any_text')
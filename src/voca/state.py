@@ -0,0 +1,121 @@
+"""Share state, such as the current modes, between the manager and its workers.
+
+The manager keeps the state in a ``StateStore`` whose version goes up with
+every change. Each worker keeps a copy of the state, and each command carries
+only the keys that changed since the version the worker last saw.
+
+Keys are dotted strings such as ``modes.strict``. Plugins add their own keys by
+giving their ``Wrapper`` a ``state`` of defaults, read them with ``get``, and
+change them with ``set`` while a command runs.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Mapping
+
+import attr
+
+from voca import utils
+
+
+# The keys the manager itself uses.
+DEFAULTS = {"modes.strict": True, "modes.sleeping": False}
+
+
+@utils.public
+@attr.s
+class StateStore:
+    """The manager's state, versioned so workers can be sent only what changed."""
+
+    values: Dict[str, Any] = attr.ib(factory=lambda: dict(DEFAULTS))
+    version: int = attr.ib(default=0)
+    _changed_in: Dict[str, int] = attr.ib(factory=dict)
+
+    def __attrs_post_init__(self):
+        for key in self.values:
+            self._changed_in.setdefault(key, self.version)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.values.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        """Change a key, making a new version if its value is different."""
+        if key in self.values and self.values[key] == value:
+            return
+        self.version += 1
+        self.values[key] = value
+        self._changed_in[key] = self.version
+
+    def update(self, changes: Mapping[str, Any]) -> None:
+        for key, value in changes.items():
+            self.set(key, value)
+
+    def add_defaults(self, defaults: Mapping[str, Any]) -> None:
+        """Add keys that aren't set yet, such as the ones plugins declare."""
+        for key, value in defaults.items():
+            if key not in self.values:
+                self.set(key, value)
+
+    def delta(self, since: int) -> Dict[str, Any]:
+        """Get the keys that changed after version ``since``."""
+        return {
+            key: self.values[key]
+            for key, version in self._changed_in.items()
+            if version > since
+        }
+
+
+@utils.public
+@attr.s
+class WorkerState:
+    """A worker's copy of the manager's state."""
+
+    values: Dict[str, Any] = attr.ib(factory=dict)
+    version: int = attr.ib(default=-1)
+    changes: Dict[str, Any] = attr.ib(factory=dict)
+
+    def apply(self, version: int, delta: Mapping[str, Any]) -> Dict[str, Any]:
+        """Bring the copy up to ``version`` and return the values."""
+        self.values.update(delta)
+        self.version = version
+        return self.values
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.values.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        """Change a key, and report the change to the manager after the command."""
+        self.values[key] = value
+        self.changes[key] = value
+
+    def take_changes(self) -> Dict[str, Any]:
+        changes, self.changes = self.changes, {}
+        return changes
+
+
+# The state of the worker running in this process.
+current = WorkerState()
+
+
+@utils.public
+def get(key: str, default: Any = None) -> Any:
+    """Read a key of the state, from a plugin."""
+    return current.get(key, default)
+
+
+@utils.public
+def set(key: str, value: Any) -> None:
+    """Change a key of the state, from a plugin."""
+    current.set(key, value)
+
+
+@utils.public
+def collect_defaults(wrappers: Iterable[utils.Wrapper]) -> Dict[str, Any]:
+    """Merge the state keys the plugins declare."""
+    defaults: Dict[str, Any] = {}
+    for wrapper in wrappers:
+        defaults.update(wrapper.state)
+    return defaults
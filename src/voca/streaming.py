@@ -4,10 +4,20 @@
 from __future__ import annotations
 
 import itertools
+import json
+import marshal
 import os
+import struct
+import sys
+import threading
 
+from typing import BinaryIO
 from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Union
 
+import attr
 import trio
 
 from voca import utils
@@ -40,11 +50,13 @@ class TerminatedFrameReceiver:
         stream: trio.abc.ReceiveStream,
         terminator: bytes,
         max_frame_length: int = 2 ** 20,
+        initial: bytes = b"",
     ) -> None:
         self.stream = stream
         self.terminator = terminator
         self.max_frame_length = max_frame_length
-        self._buf = bytearray()
+        # Bytes already read from the stream, such as to detect its framing.
+        self._buf = bytearray(initial)
         self._next_find_idx = 0
 
     async def receive(self) -> bytearray:
@@ -73,6 +85,14 @@ class TerminatedFrameReceiver:
                 self._next_find_idx = 0
                 return frame
 
+    def has_frame(self) -> bool:
+        """Check whether a whole frame is already buffered, so ``receive`` won't wait."""
+        return self._buf.find(self.terminator, self._next_find_idx) >= 0
+
+    def buffered(self) -> bytes:
+        """Get the bytes read from the stream but not yet returned as frames."""
+        return bytes(self._buf)
+
     def __aiter__(self) -> TerminatedFrameReceiver:
         return self
 
@@ -83,6 +103,239 @@ class TerminatedFrameReceiver:
             raise StopAsyncIteration
 
 
+_LENGTH = struct.Struct(">I")
+
+
+@utils.public
+class LengthPrefixedFrameReceiver:
+    """Parse frames out of a Trio stream, where each frame starts with its length.
+
+    The length is a four-byte big-endian unsigned integer, so frames can contain
+    any bytes, including newlines, and the receiver never scans the payload.
+    """
+
+    def __init__(
+        self,
+        stream: trio.abc.ReceiveStream,
+        max_frame_length: int = 2 ** 20,
+        initial: bytes = b"",
+    ) -> None:
+        self.stream = stream
+        self.max_frame_length = max_frame_length
+        # Bytes already read from the stream, such as to detect its framing.
+        self._buf = bytearray(initial)
+
+    async def _fill(self, size: int) -> None:
+        while len(self._buf) < size:
+            more_data = await self.stream.receive_some(max(_RECEIVE_SIZE, size))
+            if more_data == b"":
+                if self._buf:
+                    raise ValueError("incomplete frame")
+                raise trio.EndOfChannel
+            self._buf += more_data
+
+    async def receive(self) -> bytearray:
+        await self._fill(_LENGTH.size)
+        (length,) = _LENGTH.unpack_from(self._buf)
+        if length > self.max_frame_length:
+            raise ValueError("frame too long")
+        await self._fill(_LENGTH.size + length)
+        frame = self._buf[_LENGTH.size : _LENGTH.size + length]
+        del self._buf[: _LENGTH.size + length]
+        return frame
+
+    def has_frame(self) -> bool:
+        """Check whether a whole frame is already buffered, so ``receive`` won't wait."""
+        if len(self._buf) < _LENGTH.size:
+            return False
+        (length,) = _LENGTH.unpack_from(self._buf)
+        return len(self._buf) >= _LENGTH.size + length
+
+    def buffered(self) -> bytes:
+        """Get the bytes read from the stream but not yet returned as frames."""
+        return bytes(self._buf)
+
+    def __aiter__(self) -> LengthPrefixedFrameReceiver:
+        return self
+
+    async def __anext__(self) -> bytearray:
+        try:
+            return await self.receive()
+        except trio.EndOfChannel:
+            raise StopAsyncIteration
+
+
+Receiver = Union[TerminatedFrameReceiver, LengthPrefixedFrameReceiver]
+
+
+@utils.public
+async def detect_receiver(
+    stream: trio.abc.ReceiveStream, max_frame_length: int = 2 ** 20
+) -> Receiver:
+    """Read a producer's first bytes to tell whether it sends json lines or length-prefixed frames.
+
+    A length prefix starts with a zero byte for any frame shorter than 16 MiB,
+    while a json line starts with ``{`` or whitespace.
+    """
+    first = await stream.receive_some(_RECEIVE_SIZE)
+    if first[:1] == b"\0":
+        return LengthPrefixedFrameReceiver(stream, max_frame_length, initial=first)
+    return TerminatedFrameReceiver(stream, b"\n", max_frame_length, initial=first)
+
+
+# The first byte of a length-prefixed frame says what its payload is.
+MESSAGE = b"m"
+LOG = b"l"
+
+# Marshal's format changes between Python versions, so both ends of a
+# length-prefixed stream must report the same interpreter.
+INTERPRETER = f"{sys.implementation.cache_tag}-marshal{marshal.version}"
+
+
+@utils.public
+class LineFraming:
+    """Newline-terminated json, which is easy to type and read."""
+
+    name = "lines"
+
+    def receiver(
+        self, stream: trio.abc.ReceiveStream, initial: bytes = b""
+    ) -> Receiver:
+        return TerminatedFrameReceiver(stream, b"\n", initial=initial)
+
+    def accepts(self, status: dict) -> bool:
+        """Check whether a worker with this ready ``status`` can switch to this framing."""
+        return self.name in status.get("framings", [self.name])
+
+    def encode(self, message: dict) -> bytes:
+        """Frame a message."""
+        return json.dumps(message).encode() + b"\n"
+
+    def encode_log(self, line: bytes) -> bytes:
+        """Frame a log message that is already serialized as json."""
+        return line + b"\n"
+
+    def decode(self, frame: bytes) -> dict:
+        """Decode a message or log frame, raising ValueError if it is malformed."""
+        return json.loads(frame.decode())
+
+    def log_line(self, frame: bytes) -> Optional[bytes]:
+        """Get the json of a log frame without decoding it, or None for a status."""
+        if b'"worker_status"' in frame and "worker_status" in self.decode(frame):
+            return None
+        return bytes(frame)
+
+
+@utils.public
+class LengthPrefixedFraming:
+    """Length-prefixed frames, with messages in the compact ``marshal`` format.
+
+    Encoding and decoding a message is several times cheaper than with json,
+    and no payload needs escaping. Log frames keep eliot's json. Marshal's
+    format is only stable within one Python version, so only a worker that
+    reports the manager's ``INTERPRETER`` switches to this framing.
+    """
+
+    name = "length"
+
+    def receiver(
+        self, stream: trio.abc.ReceiveStream, initial: bytes = b""
+    ) -> Receiver:
+        return LengthPrefixedFrameReceiver(stream, initial=initial)
+
+    def accepts(self, status: dict) -> bool:
+        """Check whether a worker with this ready ``status`` can switch to this framing."""
+        return (
+            self.name in status.get("framings", [])
+            and status.get("interpreter") == INTERPRETER
+        )
+
+    def _frame(self, kind: bytes, payload: bytes) -> bytes:
+        return _LENGTH.pack(len(payload) + 1) + kind + payload
+
+    def encode(self, message: dict) -> bytes:
+        """Frame a message."""
+        return self._frame(MESSAGE, marshal.dumps(message))
+
+    def encode_log(self, line: bytes) -> bytes:
+        """Frame a log message that is already serialized as json."""
+        return self._frame(LOG, line)
+
+    def decode(self, frame: bytes) -> dict:
+        """Decode a message or log frame, raising ValueError if it is malformed."""
+        kind, payload = frame[:1], bytes(frame[1:])
+        if kind == LOG:
+            return json.loads(payload.decode())
+        if kind != MESSAGE:
+            raise ValueError(f"unknown frame kind {kind!r}")
+        try:
+            message = marshal.loads(payload)
+        except (EOFError, TypeError) as e:
+            raise ValueError("malformed message frame") from e
+        if not isinstance(message, dict):
+            raise ValueError("message frame is not a dict")
+        return message
+
+    def log_line(self, frame: bytes) -> Optional[bytes]:
+        """Get the json of a log frame without decoding it, or None for a message."""
+        if frame[:1] != LOG:
+            return None
+        return bytes(frame[1:])
+
+
+Framing = Union[LineFraming, LengthPrefixedFraming]
+
+FRAMINGS: Dict[str, Framing] = {
+    framing.name: framing for framing in [LineFraming(), LengthPrefixedFraming()]
+}
+
+
+@utils.public
+def switch_framing(receiver: Receiver, framing: Framing) -> Receiver:
+    """Read the rest of ``receiver``'s stream with ``framing``, keeping the bytes it already read."""
+    return framing.receiver(receiver.stream, initial=receiver.buffered())
+
+
+@utils.public
+@attr.s
+class FrameWriter:
+    """Write frames to a blocking binary file, by default the process's stdout.
+
+    Log frames may come from other threads, so each frame is encoded and
+    written under a lock.
+    """
+
+    framing: Framing = attr.ib(factory=LineFraming)
+    file: Optional[BinaryIO] = attr.ib(default=None)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, repr=False)
+
+    def _file(self) -> BinaryIO:
+        return sys.stdout.buffer if self.file is None else self.file
+
+    def write_message(self, message: dict) -> None:
+        """Write a message and flush it to the reader right away."""
+        with self._lock:
+            file = self._file()
+            file.write(self.framing.encode(message))
+            file.flush()
+
+    def write_log(self, line: bytes) -> None:
+        """Write a log message that is already serialized as json."""
+        with self._lock:
+            self._file().write(self.framing.encode_log(line))
+
+    def switch_framing(self, framing: Framing, message: dict) -> None:
+        """Write ``message`` in the current framing and every later frame in ``framing``."""
+        with self._lock:
+            file = self._file()
+            file.write(self.framing.encode(message))
+            file.flush()
+            self.framing = framing
+
+    def flush(self) -> None:
+        self._file().flush()
+
+
 async def handle_stream(handle_message: Callable, stream: trio.abc.ReceiveStream):
     """Handle each line as a separate task."""
     receiver = TerminatedFrameReceiver(stream, b"\n")
@@ -16,6 +16,7 @@ from typing import Callable
 from typing import MutableMapping
 from typing import Mapping
 from typing import Awaitable
+from typing import Set
 
 from typing_extensions import Protocol
 
@@ -40,12 +41,20 @@ public = atpublic.public
 class Registry:
     pattern_to_function: MutableMapping[str, Callable] = attr.ib(factory=dict)
     patterns: MutableMapping = attr.ib(factory=dict)
+    # Patterns whose functions don't need this machine, so remote workers can run them.
+    remote_patterns: Set[str] = attr.ib(factory=set)
 
-    def register(self, pattern: str) -> Callable:
-        """Decorator registering a pattern to map to a function."""
+    def register(self, pattern: str, remote: bool = False) -> Callable:
+        """Decorator registering a pattern to map to a function.
+
+        With ``remote``, the function may run on a worker on another machine,
+        so it must not press keys or otherwise act on this one.
+        """
 
         def _register(function: Callable) -> Callable:
             self.pattern_to_function[pattern] = function
+            if remote:
+                self.remote_patterns.add(pattern)
             return function
 
         return _register
@@ -141,6 +150,36 @@ class Handler:
     rule_name_to_function: dict
 
 
+@public
+@attr.dataclass
+class RecyclePolicy:
+    """Decide when a persistent worker should exit so the manager replaces it."""
+
+    max_commands: Optional[int] = None
+    max_seconds: Optional[float] = None
+    exit_on_error: bool = True
+
+    def should_retire(self, commands_handled: int, age: float, failed: bool) -> bool:
+        """Check whether the worker has done enough work to be replaced."""
+        if failed and self.exit_on_error:
+            return True
+        if self.max_commands is not None and commands_handled >= self.max_commands:
+            return True
+        if self.max_seconds is not None and age >= self.max_seconds:
+            return True
+        return False
+
+    def to_cli_args(self) -> List[str]:
+        """Build the worker command line options for this policy."""
+        args = []
+        if self.max_commands is not None:
+            args += ["--max-commands", str(self.max_commands)]
+        if self.max_seconds is not None:
+            args += ["--max-seconds", str(self.max_seconds)]
+        args.append("--exit-on-error" if self.exit_on_error else "--keep-on-error")
+        return args
+
+
 @attr.dataclass
 class HandlerGroup:
     handlers: List[Handler]
@@ -176,6 +215,10 @@ class NeverContext:
 class Wrapper:
     registry: Registry
     context: Context = attr.ib(default=AlwaysContext)
+    # Defaults for the plugin's own keys in the shared state.
+    state: Dict[str, Any] = attr.ib(factory=dict)
+    # The plugin's ``modes.Transition`` objects, switching its keys of the state.
+    modes: List[Any] = attr.ib(factory=list)
 
 
 @public
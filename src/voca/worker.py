@@ -1,15 +1,26 @@
 """Definition of the worker process.
 
 Each worker is started by the manager. It loads the grammar from the specified
-modules matching in the current context, and it executes the received command
-before exiting.
+modules matching in the current context, and it executes the received commands
+until its ``utils.RecyclePolicy`` says it should exit.
 
 The worker sends its logs up to the manager over stdout rather than writing
 directly to the log file so the manager can make sure log lines are interleaved
-without overlapping in the output.
+without overlapping in the output. Once its plugins are loaded, the worker writes
+a ``ready`` status line with the hash of its grammar, and after each command it
+writes a ``done`` status line so the manager knows the command is finished and
+whether the worker is about to exit. When the manager asks it to hold a
+command, the worker also writes a ``parsed`` status line and waits for an
+``execute`` or ``discard`` control frame. A ``cancel`` control frame stops the
+command that is running. A ``framing`` control frame, which the manager sends
+before any command, switches both directions to another framing once the
+worker acknowledges it with a ``framing`` status line.
 """
 
+import collections
+import gc
 import importlib
+import math
 import functools
 import sys
 import os
@@ -17,14 +28,23 @@ import textwrap
 import json
 import types
 import shutil
+import socket
+import time
 import pathlib
 import importlib.util
 
 
+from typing import BinaryIO
+from typing import Callable
+from typing import Dict
+from typing import FrozenSet
 from typing import Iterable
 from typing import List
+from typing import Optional
+from typing import Sequence
 from typing import Tuple
 
+import attr
 import eliot
 import trio
 import toml
@@ -37,20 +57,383 @@ from voca import log
 from voca import parsing
 from voca import context
 from voca import config
+from voca import modes
+from voca import state
+
+
+HANDLER_CACHE_SIZE = 8
+
+
+@utils.public
+@attr.s
+class HandlerCache:
+    """Keep the most recently used handlers, keyed by the wrappers active in a context."""
+
+    max_size: int = attr.ib(default=HANDLER_CACHE_SIZE)
+    _handlers: collections.OrderedDict = attr.ib(factory=collections.OrderedDict)
+    _sizes: Dict[FrozenSet[int], int] = attr.ib(factory=dict)
+
+    def __contains__(self, key: FrozenSet[int]) -> bool:
+        return key in self._handlers
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def describe(self) -> List[dict]:
+        """List the cached handlers' keys and approximate sizes in bytes, once measured."""
+        return [
+            dict(key=sorted(key), bytes=self._sizes.get(key)) for key in self._handlers
+        ]
+
+    def put(self, key: FrozenSet[int], handler: utils.Handler) -> None:
+        """Cache a handler, evicting the least recently used beyond ``max_size``."""
+        self._handlers[key] = handler
+        self._handlers.move_to_end(key)
+        while len(self._handlers) > self.max_size:
+            evicted, _handler = self._handlers.popitem(last=False)
+            self._sizes.pop(evicted, None)
+
+    def unmeasured(self) -> bool:
+        return any(key not in self._sizes for key in list(self._handlers))
+
+    def measure(self) -> None:
+        """Size the handlers that haven't been sized yet.
+
+        Walking a parser takes a while, so this runs off the path of commands.
+        """
+        for key, handler in list(self._handlers.items()):
+            if key not in self._sizes:
+                size = deep_sizeof(handler)
+                if key in self._handlers:
+                    self._sizes[key] = size
+
+    def get(
+        self, key: FrozenSet[int], build: Callable[[], utils.Handler]
+    ) -> utils.Handler:
+        """Return the cached handler for ``key``, building it with ``build`` on a miss."""
+        try:
+            handler = self._handlers[key]
+        except KeyError:
+            eliot.Message.log(message_type="handler_cache_miss", key=sorted(key))
+            handler = build()
+            self.put(key, handler)
+        else:
+            eliot.Message.log(message_type="handler_cache_hit", key=sorted(key))
+            self._handlers.move_to_end(key)
+        return handler
+
+
+def deep_sizeof(obj) -> int:
+    """Approximate the memory used by an object and everything it refers to.
+
+    Modules, classes, and functions are shared by everything, so they don't count.
+    """
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, _SHARED_TYPES):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        pending.extend(gc.get_referents(item))
+    return size
+
+
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+
+@utils.public
+@attr.s
+class HandlerKeyHistory:
+    """Remember the handler keys recently used with each grammar, across sessions.
+
+    Workers precompile the handlers for these keys, so the first command after
+    a focus change doesn't pay for compiling a grammar.
+    """
+
+    path: pathlib.Path = attr.ib(
+        factory=lambda: config.get_config_dir() / "handler_keys.json"
+    )
+    max_keys: int = attr.ib(default=HANDLER_CACHE_SIZE)
+    max_grammars: int = attr.ib(default=16)
+    _keys: Optional[Dict[str, List[List[int]]]] = attr.ib(default=None)
+
+    def load(self) -> Dict[str, List[List[int]]]:
+        """Read the history file, treating a missing or broken one as empty."""
+        if self._keys is None:
+            try:
+                self._keys = json.loads(self.path.read_text())
+            except (FileNotFoundError, ValueError):
+                self._keys = {}
+        return self._keys
+
+    def recent(self, grammar_hash: str) -> List[FrozenSet[int]]:
+        """Get the keys used with a grammar, most recent first."""
+        return [frozenset(key) for key in self.load().get(grammar_hash, [])]
+
+    def record(self, grammar_hash: str, key: Iterable[int]) -> None:
+        """Note that a key was used, saving the history when its set of keys changes."""
+        keys = self.load()
+        key = sorted(key)
+        previous = keys.pop(grammar_hash, [])
+        updated = [key] + [seen for seen in previous if seen != key]
+        updated = updated[: self.max_keys]
+        keys[grammar_hash] = updated
+        for stale in list(keys)[: -self.max_grammars]:
+            del keys[stale]
+        if sorted(updated) != sorted(previous):
+            config.write_atomically(
+                self.path, lambda f: f.write(json.dumps(keys).encode())
+            )
+
+
+def precompile_handler(
+    wrapper_group: utils.WrapperGroup, key: FrozenSet[int]
+) -> Optional[utils.Handler]:
+    """Build the handler for a key, or None if the key doesn't fit the wrapper group."""
+    if any(i >= len(wrapper_group.wrappers) for i in key):
+        return None
+    filtered = utils.WrapperGroup([wrapper_group.wrappers[i] for i in sorted(key)])
+    return build_handler(filtered)
+
+
+@log.log_call(include_result=False)
+def precompile_handlers(
+    wrapper_group: utils.WrapperGroup,
+    handler_cache: HandlerCache,
+    keys: Iterable[FrozenSet[int]],
+) -> None:
+    """Build the handlers for ``keys`` that aren't cached yet."""
+    for key in keys:
+        if key in handler_cache:
+            continue
+        handler = precompile_handler(wrapper_group, key)
+        if handler is not None:
+            handler_cache.put(key, handler)
+    handler_cache.measure()
+
+
+async def precompile_in_background(
+    wrapper_group: utils.WrapperGroup,
+    handler_cache: HandlerCache,
+    keys: Iterable[FrozenSet[int]],
+) -> None:
+    """Build the handlers for ``keys`` in a thread, so commands aren't kept waiting."""
+    for key in keys:
+        if key in handler_cache:
+            continue
+        with eliot.start_action(action_type="precompile_handler", key=sorted(key)):
+            handler = await trio.run_sync_in_worker_thread(
+                precompile_handler, wrapper_group, key, cancellable=True
+            )
+        if handler is not None and key not in handler_cache:
+            handler_cache.put(key, handler)
+
+
+# Seconds between sizing the handlers that commands built.
+MEASURE_INTERVAL = 5.0
+
+
+async def measure_in_background(
+    handler_cache: HandlerCache, interval: float = MEASURE_INTERVAL
+) -> None:
+    """Size newly cached handlers in a thread, instead of when a command builds one."""
+    while True:
+        await trio.sleep(interval)
+        if handler_cache.unmeasured():
+            await trio.run_sync_in_worker_thread(
+                handler_cache.measure, cancellable=True
+            )
+
+
+@log.to_serializable.register(HandlerCache)
+def _(cache):
+    return {"type": "HandlerCache", "keys": [sorted(key) for key in cache._handlers]}
+
+
+@utils.public
+@attr.s
+class Controls:
+    """The manager's control frames, for the command the worker is handling."""
+
+    channel: trio.abc.ReceiveChannel = attr.ib()
+
+    async def receive(self, command_id: Optional[int]) -> dict:
+        """Wait for a control frame about ``command_id``, skipping stale ones."""
+        while True:
+            control = await self.channel.receive()
+            if control.get("command_id") == command_id:
+                return control
+            eliot.Message.log(message_type="stale_control", control=control)
+
+    async def cancel_on_request(
+        self, command_id: Optional[int], cancel_scope: trio.CancelScope
+    ) -> None:
+        """Cancel ``cancel_scope`` when the manager cancels the command."""
+        while True:
+            control = await self.receive(command_id)
+            if control["control"] == "cancel":
+                cancel_scope.cancel()
+                return
 
 
 @log.log_async_call
-async def handle_message(wrapper_group: utils.WrapperGroup, data: dict):
-    """Execute the command in ``data`` with the ``wrapper_group`` containing the grammar."""
+async def handle_message(
+    wrapper_group: utils.WrapperGroup,
+    data: dict,
+    handler_cache: HandlerCache,
+    controls: Optional[Controls] = None,
+) -> Tuple[Optional[FrozenSet[int]], Optional[int]]:
+    """Execute the command in ``data`` with the ``wrapper_group`` containing the grammar.
+
+    If the manager asked the worker to ``hold`` the command, report that it is
+    parsed and wait for the manager's ``execute`` control frame before running
+    it, so commands parsed in parallel still run in the order they were spoken.
+    A ``cancel`` control frame stops the command at its next checkpoint. If the
+    commands run before it changed the state, parse the command again in the
+    new state.
+
+    Of a ``partial`` transcript, only run the commands before the last one,
+    which may still grow: "scroll down" may become "scroll down three".
+
+    Return the key of the handler that parsed the command, or None if the
+    command is a ``partial`` transcript without a complete command yet, and
+    for a partial transcript, how many of its words ran.
+    """
+    parsed = None
+    try:
+        parsed = await parse_message(wrapper_group, data, handler_cache)
+    except lark.exceptions.LarkError:
+        # The commands before a held one may still change the state it
+        # parses in, so it waits for its turn before failing.
+        if not data.get("hold"):
+            raise
+    else:
+        if parsed.tree is None:
+            return None, 0
+
+    command_id = data.get("command_id")
+    if data.get("hold"):
+        report_status("parsed", remote=parsed is not None and parsed.runs_remotely())
+        control = await controls.receive(command_id)
+        changed = update_state(data, control)
+        if control["control"] != "execute":
+            eliot.Message.log(message_type="command_discarded", control=control)
+            return None if parsed is None else parsed.key, 0
+        if changed or parsed is None:
+            parsed = await parse_message(wrapper_group, data, handler_cache)
+            if parsed.tree is None:
+                return None, 0
+
+    with trio.CancelScope() as cancel_scope:
+        async with trio.open_nursery() as nursery:
+            if controls is not None:
+                nursery.start_soon(controls.cancel_on_request, command_id, cancel_scope)
+            await run_commands(parsed.handler, parsed.commands)
+            nursery.cancel_scope.cancel()
+    if cancel_scope.cancelled_caught:
+        eliot.Message.log(message_type="command_cancelled")
+
+    return parsed.key, parsed.ran_words
+
+
+@attr.s
+class ParsedMessage:
+    """A transcript parsed by the handler for its context and state."""
+
+    key: FrozenSet[int] = attr.ib()
+    handler: utils.Handler = attr.ib()
+    # None if the message is a ``partial`` transcript without a complete command yet.
+    tree: Optional[lark.Tree] = attr.ib()
+    # For a partial transcript, how many of its words the tree spans.
+    ran_words: Optional[int] = attr.ib(default=None)
+
+    @property
+    def commands(self) -> List[lark.Tree]:
+        return parsing.extract_commands(self.tree)
+
+    def runs_remotely(self) -> bool:
+        return runs_remotely(self.handler, self.commands)
+
+
+async def parse_message(
+    wrapper_group: utils.WrapperGroup, data: dict, handler_cache: HandlerCache
+) -> ParsedMessage:
+    """Parse the command in ``data`` with the handler for its context and state."""
     message = data["result"]["hypotheses"][0]["transcript"]
+    ran_words = None
 
     with eliot.start_action(action_type="parse_command") as action:
 
-        handler = await make_specific_handler(wrapper_group, data)
-        tree = handler.parser.parse(message)
+        key, handler = await resolve_handler(wrapper_group, data, handler_cache)
+        try:
+            tree = handler.parser.parse(message)
+            if data.get("partial"):
+                tree, ran_words = complete_prefix(handler.parser, message.split(), tree)
+        except lark.exceptions.LarkError:
+            if not data.get("partial"):
+                raise
+            tree = None
+        if tree is None:
+            # The speaker hasn't finished the command yet.
+            action.log(message_type="incomplete_command", message=message)
+    return ParsedMessage(key, handler, tree, ran_words)
+
+
+def update_state(data: dict, control: dict) -> bool:
+    """Apply the state that came with a ``control`` frame to the command's ``data``.
+
+    Return whether any value changed since the command was parsed.
+    """
+    delta = control.get("state_delta", {})
+    changed = any(
+        key not in state.current.values or state.current.values[key] != value
+        for key, value in delta.items()
+    )
+    data["state"] = state.current.apply(
+        control.get("state_version", state.current.version), delta
+    )
+    return changed
 
-    commands = parsing.extract_commands(tree)
 
+def complete_prefix(
+    parser: lark.Lark, words: List[str], tree: lark.Tree
+) -> Tuple[Optional[lark.Tree], int]:
+    """Split off the last command of a partial transcript's parse ``tree``.
+
+    Return the tree of the commands before it, or None if there are none,
+    and how many ``words`` they span.
+    """
+    if len(tree.children) < 2:
+        return None, 0
+    last = tree.children[-1:]
+    for start in range(len(words) - 1, 0, -1):
+        try:
+            if parser.parse(" ".join(words[start:])).children != last:
+                continue
+            return parser.parse(" ".join(words[:start])), start
+        except lark.exceptions.LarkError:
+            continue
+    return None, 0
+
+
+def runs_remotely(handler: utils.Handler, commands: List[lark.Tree]) -> bool:
+    """Check whether every parsed command was registered with ``remote``."""
+    registry = handler.registry
+    remote_functions = {
+        id(registry.pattern_to_function[pattern])
+        for pattern in registry.remote_patterns
+    }
+    return all(
+        id(handler.rule_name_to_function[command.data]) in remote_functions
+        for command in commands
+    )
+
+
+async def run_commands(handler: utils.Handler, commands: List[lark.Tree]) -> None:
+    """Call the function for each parsed command, in order."""
     for command in commands:
         rule_name, args = command.data, command.children
         function = handler.rule_name_to_function[rule_name]
@@ -94,10 +477,17 @@ def save_backup_module(
 
 @log.log_call
 def get_module(
-    import_path: str, backup_dir: pathlib.Path, use_backup_modules: bool
+    import_path: str,
+    backup_dir: pathlib.Path,
+    use_backup_modules: bool,
+    prefer_backup_modules: bool = False,
 ) -> types.ModuleType:
-    """Import module and cache it in backup_dir, returning backup on failure."""
+    """Import module, returning its backup on failure, or first with ``prefer_backup_modules``."""
 
+    if prefer_backup_modules:
+        module = get_backup_module(import_path, backup_dir)
+        if module is not None:
+            return module
     try:
         with eliot.start_action(
             action_type="import_module",
@@ -110,47 +500,74 @@ def get_module(
         if not use_backup_modules:
             raise
         module = get_backup_module(import_path, backup_dir)
-    else:
-        save_backup_module(module, import_path, backup_dir)
     return module
 
 
+def get_backup_dir() -> pathlib.Path:
+    return pathlib.Path(config.get_config_dir()) / "backup_modules"
+
+
 @log.log_call
 def collect_modules(
-    import_paths: Iterable[str], use_backup_modules: bool
+    import_paths: Iterable[str],
+    use_backup_modules: bool,
+    prefer_backup_modules: bool = False,
 ) -> List[types.ModuleType]:
     """Collect modules from import paths, optionally defaulting to backup modules on failure."""
 
-    backup_dir = pathlib.Path(config.get_config_dir()) / "backup_modules"
+    backup_dir = get_backup_dir()
 
     modules = []
     for import_path in import_paths:
-        module = get_module(import_path, backup_dir, use_backup_modules)
+        module = get_module(
+            import_path, backup_dir, use_backup_modules, prefer_backup_modules
+        )
         if module is not None:
             modules.append(module)
     return modules
 
 
+@log.log_call
+def save_backup_modules(modules: Iterable[types.ModuleType]) -> None:
+    """Back up the modules a worker started with, once their grammars have been built.
+
+    Saving them only then keeps a module that imports but breaks the worker
+    from replacing the last backup that worked.
+    """
+    backup_dir = get_backup_dir()
+    for module in modules:
+        if backup_dir.resolve() not in pathlib.Path(module.__file__).resolve().parents:
+            save_backup_module(module, module.__name__, backup_dir)
+
+
 def combine_registries(registries: utils.Registry) -> utils.Registry:
     """Combine multiple registries into a single one."""
     combined = utils.Registry()
     for registry in registries:
         combined.pattern_to_function.update(registry.pattern_to_function)
         combined.patterns.update(registry.patterns)
+        combined.remote_patterns.update(registry.remote_patterns)
     return combined
 
 
-async def make_specific_handler(wrapper_group: utils.WrapperGroup, data: dict):
-    """Build the command handler for the specific context."""
-    filtered = await context.filter_wrappers(wrapper_group, data)
+def handler_key(
+    wrapper_group: utils.WrapperGroup, filtered: utils.WrapperGroup
+) -> FrozenSet[int]:
+    """Identify a set of allowed wrappers by their positions in the wrapper group."""
+    positions = {id(wrapper): i for i, wrapper in enumerate(wrapper_group.wrappers)}
+    return frozenset(positions[id(wrapper)] for wrapper in filtered.wrappers)
+
+
+def build_handler(filtered: utils.WrapperGroup) -> utils.Handler:
+    """Compile the grammar of the allowed wrappers into a command handler."""
     registry = combine_registries([wrapper.registry for wrapper in filtered.wrappers])
 
     rules = parsing.build_rules(registry)
     grammar = parsing.build_grammar(registry, rules)
     rule_name_to_function = {rule.name: rule.function for rule in rules}
 
-    parser = lark.Lark(
-        grammar, debug=True, lexer="dynamic_complete", maybe_placeholders=True
+    parser = parsing.TrieParser(
+        parser=parsing.build_parser(grammar), trie=parsing.build_trie(rules)
     )
 
     return utils.Handler(
@@ -158,36 +575,267 @@ async def make_specific_handler(wrapper_group: utils.WrapperGroup, data: dict):
     )
 
 
-@log.log_async_call
-async def async_main(wrapper_group: utils.WrapperGroup):
-    """Process input commands as newline-separated json on stdin."""
-    stream = trio._unix_pipes.PipeReceiveStream(os.dup(0))
-    receiver = streaming.TerminatedFrameReceiver(stream, b"\n")
+async def resolve_handler(
+    wrapper_group: utils.WrapperGroup, data: dict, handler_cache: HandlerCache
+) -> Tuple[FrozenSet[int], utils.Handler]:
+    """Get the key and command handler for the context, reusing a cached handler if possible."""
+    filtered = await context.filter_wrappers(wrapper_group, data)
+    key = handler_key(wrapper_group, filtered)
+    return key, handler_cache.get(key, functools.partial(build_handler, filtered))
+
+
+async def make_specific_handler(
+    wrapper_group: utils.WrapperGroup, data: dict, handler_cache: HandlerCache
+) -> utils.Handler:
+    """Get the command handler for the specific context, reusing a cached one if possible."""
+    _key, handler = await resolve_handler(wrapper_group, data, handler_cache)
+    return handler
+
+
+def _choose_parser_for(registries: Iterable[utils.Registry]) -> parsing.ParserChoice:
+    registry = combine_registries(registries)
+    grammar = parsing.build_grammar(registry, parsing.build_rules(registry))
+    return parsing.choose_parser(grammar)
+
+
+@utils.public
+@log.log_call
+def parser_report(import_paths: Tuple[str], use_backup_modules: bool) -> List[dict]:
+    """Report which parser each module's grammar, and the combined grammar, would use."""
+    sys.path.insert(0, str(config.get_config_dir()))
+    modules = collect_modules(import_paths, use_backup_modules)
+    modules = [utils.transform_module(module) for module in modules]
+
+    report = []
+    for module in modules:
+        choice = _choose_parser_for([module.wrapper.registry])
+        report.append(dict(grammar=module.__name__, **attr.asdict(choice)))
+    choice = _choose_parser_for(module.wrapper.registry for module in modules)
+    report.append(dict(grammar="combined", **attr.asdict(choice)))
+    return report
+
+
+# The worker's status and log frames for the manager.
+output = streaming.FrameWriter()
 
-    async for message_bytes in receiver:
-        data = json.loads(message_bytes.decode())
 
+# The file descriptor the manager's commands arrive on.
+input_fd = 0
+
+# Seconds to wait for a manager that doesn't read a remote worker's frames.
+SEND_TIMEOUT = 60.0
+
+
+@utils.public
+def open_output(framing: streaming.Framing, file: Optional[BinaryIO] = None) -> None:
+    """Write frames for the manager to stdout, or ``file``, with ``framing``.
+
+    Anything else printed to stdout would corrupt the frames, so it goes to
+    stderr instead.
+    """
+    sys.stdout.flush()
+    output.framing = framing
+    # A worker forked from the fork server opens its own stdout again.
+    output.file = sys.__stdout__.buffer if file is None else file
+    sys.stdout = sys.stderr
+
+
+def connect(
+    address: str, token: Optional[str] = None, timeout: float = 10.0
+) -> BinaryIO:
+    """Connect to a manager at ``HOST:PORT`` to read commands from, retrying until it listens.
+
+    Send the manager's ``token`` first, as a json line like every frame after it.
+    Return the file to write frames for the manager to.
+    """
+    global input_fd
+    host, _colon, port = address.rpartition(":")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = socket.create_connection((host, int(port)))
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+        else:
+            break
+    connection.sendall(streaming.LineFraming().encode({"token": token}))
+    # With a timeout, writes still work once trio makes the socket non-blocking.
+    connection.settimeout(SEND_TIMEOUT)
+    input_fd = connection.fileno()
+    return connection.makefile("wb")
+
+
+def report_status(status: str, **fields) -> None:
+    """Write a status frame for the manager, flushing any pending log frames first."""
+    output.write_message(dict(worker_status=status, pid=os.getpid(), **fields))
+
+
+@log.log_async_call
+async def async_main(
+    wrapper_group: utils.WrapperGroup,
+    policy: utils.RecyclePolicy,
+    grammar_hash: Optional[str] = None,
+    handler_cache: Optional[HandlerCache] = None,
+    import_paths: Sequence[str] = (),
+):
+    """Process input commands framed like the output, on stdin or the manager's connection."""
+    stream = trio._unix_pipes.PipeReceiveStream(os.dup(input_fd))
+    receiver = output.framing.receiver(stream)
+
+    if grammar_hash is None:
+        grammar_hash = parsing.grammar_hash(wrapper_group)
+    if handler_cache is None:
+        handler_cache = HandlerCache()
+    report_status(
+        "ready",
+        grammar_hash=grammar_hash,
+        warm=handler_cache.describe(),
+        framing=output.framing.name,
+        framings=list(streaming.FRAMINGS),
+        interpreter=streaming.INTERPRETER,
+        state_defaults=state.collect_defaults(wrapper_group.wrappers),
+        modules=list(import_paths),
+        transitions=modes.collect_transitions(wrapper_group.wrappers),
+    )
+
+    commands_send, commands_receive = trio.open_memory_channel(math.inf)
+    controls_send, controls_receive = trio.open_memory_channel(math.inf)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(route_frames, receiver, commands_send, controls_send)
+        nursery.start_soon(
+            precompile_in_background,
+            wrapper_group,
+            handler_cache,
+            HandlerKeyHistory().recent(grammar_hash),
+        )
+        nursery.start_soon(measure_in_background, handler_cache)
+        await handle_messages(
+            commands_receive,
+            Controls(controls_receive),
+            wrapper_group,
+            policy,
+            handler_cache,
+        )
+        nursery.cancel_scope.cancel()
+
+
+async def route_frames(
+    receiver: streaming.Receiver,
+    commands: trio.abc.SendChannel,
+    controls: trio.abc.SendChannel,
+) -> None:
+    """Separate the manager's control frames from its commands.
+
+    Switch framings when the manager asks, which it does before any command.
+    """
+    async with commands, controls:
+        while True:
+            try:
+                frame = await receiver.receive()
+            except trio.EndOfChannel:
+                return
+            data = output.framing.decode(frame)
+            if data.get("control") == "framing":
+                receiver = use_framing(receiver, data["framing"])
+            elif "control" in data:
+                await controls.send(data)
+            else:
+                await commands.send(data)
+
+
+def use_framing(receiver: streaming.Receiver, name: str) -> streaming.Receiver:
+    """Acknowledge the manager's framing in the old one, then use the new one both ways."""
+    framing = streaming.FRAMINGS[name]
+    output.switch_framing(
+        framing, dict(worker_status="framing", pid=os.getpid(), framing=name)
+    )
+    return streaming.switch_framing(receiver, framing)
+
+
+async def handle_messages(
+    commands: trio.abc.ReceiveChannel,
+    controls: Controls,
+    wrapper_group: utils.WrapperGroup,
+    policy: utils.RecyclePolicy,
+    handler_cache: HandlerCache,
+):
+    """Execute commands until stdin closes or the policy says to retire."""
+    started_at = trio.current_time()
+    commands_handled = 0
+
+    async for data in commands:
+        failed = False
+        incomplete = False
+        key = ran_words = None
+        data["state"] = state.current.apply(
+            data.get("state_version", state.current.version),
+            data.get("state_delta", {}),
+        )
         try:
             with eliot.Action.continue_task(
                 task_id=data.get("eliot_task_id", "@")
             ) as action:
-                await handle_message(wrapper_group=wrapper_group, data=data)
+                key, ran_words = await handle_message(
+                    wrapper_group=wrapper_group,
+                    data=data,
+                    handler_cache=handler_cache,
+                    controls=controls,
+                )
+            incomplete = key is None
         except Exception as e:
             action.finish(e)
-            raise
-
-        sys.exit(0)
+            failed = True
+            if policy.exit_on_error:
+                report_status("done", failed=True, retiring=True)
+                raise
+
+        commands_handled += 1
+        age = trio.current_time() - started_at
+        retiring = policy.should_retire(commands_handled, age, failed)
+        report_status(
+            "done",
+            failed=failed,
+            incomplete=incomplete,
+            ran_words=ran_words,
+            retiring=retiring,
+            handler_key=None if key is None else sorted(key),
+            warm=handler_cache.describe(),
+            state_changes=state.current.take_changes(),
+        )
+        if retiring:
+            sys.exit(0)
 
 
 @utils.public
 @log.log_call
-def main(import_paths: Tuple[str], use_backup_modules: bool):
+def main(
+    import_paths: Tuple[str],
+    use_backup_modules: bool,
+    max_commands: Optional[int] = None,
+    max_seconds: Optional[float] = None,
+    exit_on_error: bool = True,
+    prefer_backup_modules: bool = False,
+):
     """Get the wrapper group and start the event loop."""
 
     sys.path.insert(0, str(config.get_config_dir()))
-    modules = collect_modules(import_paths, use_backup_modules)
-    modules = [utils.transform_module(module) for module in modules]
+    imported = collect_modules(import_paths, use_backup_modules, prefer_backup_modules)
+    modules = [utils.transform_module(module) for module in imported]
 
     wrapper_group = parsing.combine_modules(modules)
+    save_backup_modules(imported)
+    policy = utils.RecyclePolicy(
+        max_commands=max_commands, max_seconds=max_seconds, exit_on_error=exit_on_error
+    )
 
-    trio.run(functools.partial(async_main, wrapper_group=wrapper_group))
+    trio.run(
+        functools.partial(
+            async_main,
+            wrapper_group=wrapper_group,
+            policy=policy,
+            import_paths=import_paths,
+        )
+    )
@@ -1,6 +1,8 @@
 import contextlib
+import json
 import subprocess
 import sys
+import textwrap
 import time
 
 import trio
@@ -47,3 +49,18 @@ def make_command(utterance, final=True):
         "result": {"hypotheses": [{"transcript": utterance}], "final": final},
         "id": "eec37b79-f55e-4bf8-9afe-01f278902599",
     }
+
+
+def command_lines(utterances, final=True):
+    """Frame a command for each utterance as the manager's stdin expects."""
+    rows = [make_command(utterance, final=final) for utterance in utterances]
+    return ("\n".join(json.dumps(row) for row in rows) + "\n").encode()
+
+
+def write_user_module(tmp_path, source, name="my_module"):
+    """Write a plugin to ``tmp_path/user_modules``, to import as ``user_modules.<name>``."""
+    user_modules_path = tmp_path / "user_modules"
+    user_modules_path.mkdir(exist_ok=True)
+    module_path = user_modules_path / f"{name}.py"
+    module_path.write_text(textwrap.dedent(source))
+    return module_path
@@ -1,14 +1,69 @@
 import functools
 import os
+import time
 
 import pytest
 import trio
 
 
 from voca import context
+from voca import focus
+from voca import utils
 
 
 async def test_get_current_window_title(turtle_window):
 
     title = await context.get_current_window_title()
     assert title == "Python Turtle Graphics"
+
+
+async def test_filter_wrappers_fetches_title_once(monkeypatch):
+    calls = []
+
+    async def get_current_window_title():
+        calls.append(None)
+        await trio.sleep(0)
+        return "Python Turtle Graphics"
+
+    monkeypatch.setattr(context, "get_current_window_title", get_current_window_title)
+    turtle = utils.Wrapper(utils.Registry(), context.WindowContext("Turtle"))
+    terminal = utils.Wrapper(utils.Registry(), context.WindowContext("terminator"))
+    always = utils.Wrapper(utils.Registry(), context.AlwaysContext())
+    group = utils.WrapperGroup([turtle, terminal, turtle, always])
+
+    filtered = await context.filter_wrappers(group, {})
+
+    assert filtered.wrappers == [turtle, turtle, always]
+    assert len(calls) == 1
+
+
+def test_focus_tracker(turtle_window):
+    tracker = focus.FocusTracker.start()
+    try:
+        assert tracker.current.title == "Python Turtle Graphics"
+    finally:
+        tracker.stop()
+
+
+def test_focus_tracker_follows_title_changes(turtle_window):
+    import Xlib.display
+
+    tracker = focus.FocusTracker.start()
+    display = Xlib.display.Display()
+    try:
+        window = display.create_resource_object("window", tracker._window.id)
+        for title in ["First title", "Second title"]:
+            window.change_property(
+                display.intern_atom("_NET_WM_NAME"),
+                display.intern_atom("UTF8_STRING"),
+                8,
+                title.encode(),
+            )
+            display.flush()
+            deadline = time.monotonic() + 5
+            while tracker.current.title != title and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert tracker.current.title == title
+    finally:
+        display.close()
+        tracker.stop()
@@ -0,0 +1,413 @@
+import io
+import json
+import math
+import os
+import types
+
+import pytest
+import trio
+import trio.testing
+
+from voca import log
+from voca import manager
+from voca import modes
+from voca import state
+from voca import streaming
+from voca import utils
+
+
+def make_worker(pid):
+    return manager.Worker(types.SimpleNamespace(pid=pid), receiver=None)
+
+
+async def test_pool_prefers_worker_warm_for_the_window():
+    pool = manager.Pool(nursery=None, history=None)
+    editor, terminal = make_worker(1), make_worker(2)
+    pool.learn(editor, "editor", {"handler_key": [0, 1], "warm": [{"key": [0, 1]}]})
+    pool.learn(terminal, "terminal", {"handler_key": [0, 2], "warm": [{"key": [0, 2]}]})
+    pool.release(editor)
+    pool.release(terminal)
+
+    assert await pool.get_worker("terminal") is terminal
+    assert await pool.get_worker("editor") is editor
+
+
+async def test_pool_reserves_a_local_worker_only_while_a_hand_back_is_pending():
+    pool = manager.Pool(nursery=None, history=None)
+    local, other = make_worker(1), make_worker(2)
+    remote = make_worker(3)
+    remote.remote = True
+    pool.remote_workers.append(remote)
+    for worker in [remote, local, other]:
+        pool.release(worker)
+
+    assert pool.available() == [remote, local, other]
+    assert await pool.get_worker() is remote
+    assert pool.available() == [local]
+    assert pool.available(remote=False) == [local, other]
+    pool.end_hand_back(remote)
+    assert pool.available() == [local, other]
+
+
+async def test_pool_dispatches_only_to_ready_workers():
+    framing = streaming.LineFraming()
+    send_stream, receive_stream = trio.testing.memory_stream_one_way_pair()
+    cold = manager.Worker(
+        types.SimpleNamespace(pid=1), framing.receiver(receive_stream), framing
+    )
+    pool = manager.Pool(nursery=None, history=None, framing=framing)
+    pool.warming.append(cold)
+    taken = []
+
+    async def take():
+        taken.append(await pool.get_worker())
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(take)
+        nursery.start_soon(pool.wait_until_ready, cold)
+        await trio.testing.wait_all_tasks_blocked()
+        assert taken == []
+        assert pool.waiting == 1
+        await send_stream.send_all(
+            framing.encode({"worker_status": "ready", "pid": 1, "grammar_hash": "a"})
+        )
+
+    assert taken == [cold]
+    assert cold.grammar_hash == "a"
+    assert pool.warming == []
+
+
+@pytest.mark.parametrize(
+    "interpreter, framing",
+    [(streaming.INTERPRETER, "length"), ("other-python", "lines")],
+    ids=["same-python", "other-python"],
+)
+async def test_pool_switches_ready_workers_to_its_framing(interpreter, framing):
+    lines = streaming.LineFraming()
+    length = streaming.LengthPrefixedFraming()
+    to_worker, from_manager = trio.testing.memory_stream_one_way_pair()
+    to_manager, from_worker = trio.testing.memory_stream_one_way_pair()
+    worker = manager.Worker(
+        types.SimpleNamespace(pid=1, stdin=to_worker), lines.receiver(from_worker)
+    )
+    pool = manager.Pool(nursery=None, history=None, framing=length)
+    pool.warming.append(worker)
+    ready = {"worker_status": "ready", "pid": 1, "grammar_hash": "a"}
+    ready.update(framings=["length", "lines"], interpreter=interpreter)
+
+    async def acknowledge():
+        frame = await lines.receiver(from_manager).receive()
+        assert lines.decode(frame) == {"control": "framing", "framing": "length"}
+        # The worker writes in the new framing right after its acknowledgement.
+        await to_manager.send_all(
+            lines.encode({"worker_status": "framing", "pid": 1})
+            + length.encode_log(b'{"message_type": "hello"}')
+        )
+
+    async with trio.open_nursery() as nursery:
+        if framing == "length":
+            nursery.start_soon(acknowledge)
+        await to_manager.send_all(lines.encode(ready))
+        await pool.wait_until_ready(worker)
+
+    assert pool.ready == [worker]
+    assert worker.framing.name == framing
+    if framing == "length":
+        frame = await worker.receiver.receive()
+        assert worker.framing.log_line(frame) == b'{"message_type": "hello"}'
+
+
+@pytest.mark.parametrize("name", sorted(streaming.FRAMINGS))
+async def test_replay_copies_worker_log_lines(monkeypatch, name):
+    framing = streaming.FRAMINGS[name]
+    log_file = io.StringIO()
+    monkeypatch.setattr(log, "_raw_destinations", [log_file])
+    send_stream, receive_stream = trio.testing.memory_stream_one_way_pair()
+    worker = manager.Worker(None, framing.receiver(receive_stream), framing)
+    lines = [b'{"message_type": "a", "x": 1}', b'{"message_type":"b"}']
+
+    await send_stream.send_all(
+        b"".join(framing.encode_log(line) for line in lines)
+        + framing.encode_log(b"not json")
+        + framing.encode({"worker_status": "done", "pid": 1})
+    )
+    status = await manager.replay_child_messages(worker)
+
+    assert status == {"worker_status": "done", "pid": 1}
+    assert log_file.getvalue().splitlines() == [line.decode() for line in lines]
+
+
+async def test_pool_retires_a_recycled_worker_only_for_its_own_spare():
+    framing = streaming.LineFraming()
+    pool = manager.Pool(nursery=None, history=None, size=2, target=2)
+    old = make_worker(1)
+    pool.recycling.append(old)
+
+    async def become_ready(worker):
+        send_stream, receive_stream = trio.testing.memory_stream_one_way_pair()
+        worker.receiver = framing.receiver(receive_stream)
+        await send_stream.send_all(
+            framing.encode(
+                {
+                    "worker_status": "ready",
+                    "pid": worker.process.pid,
+                    "grammar_hash": "a",
+                }
+            )
+        )
+        pool.warming.append(worker)
+        await pool.wait_until_ready(worker)
+
+    remote = make_worker(2)
+    remote.remote = True
+    await become_ready(remote)
+    assert pool.recycling == [old] and not old.retired
+
+    spare = make_worker(3)
+    spare.replaces = old
+    await become_ready(spare)
+    assert pool.recycling == [] and old.retired
+    assert spare.replaces is None
+
+
+def test_state_store_sends_only_changes():
+    store = state.StateStore()
+    worker_state = state.WorkerState()
+
+    values = worker_state.apply(store.version, store.delta(-1))
+    seen = store.version
+    store.set("modes.strict", False)
+    store.set("modes.sleeping", False)
+    store.add_defaults({"dictation.language": "en", "modes.strict": True})
+
+    assert values == state.DEFAULTS
+    assert store.delta(seen) == {"modes.strict": False, "dictation.language": "en"}
+    assert worker_state.apply(store.version, store.delta(seen)) == {
+        "modes.strict": False,
+        "modes.sleeping": False,
+        "dictation.language": "en",
+    }
+    assert store.delta(store.version) == {}
+
+
+def test_mode_machine_switches_plugin_modes():
+    store = state.StateStore()
+    machine = modes.ModeMachine.with_defaults()
+    machine.add_reported(
+        [
+            modes.Transition("start  dictation", "modes.dictation").to_dict(),
+            modes.Transition(
+                "stop dictation",
+                "modes.dictation",
+                False,
+                when={"modes.dictation": True},
+            ).to_dict(),
+        ]
+    )
+
+    assert not machine.handle("stop dictation", store)
+    assert machine.handle("start dictation", store)
+    assert store.get("modes.dictation") is True
+    assert machine.handle("mode", store)
+    assert store.get("modes.strict") is False
+    assert machine.handle(" stop   dictation ", store)
+    assert store.get("modes.dictation") is False
+    assert not machine.handle("say alpha", store)
+
+
+def test_pool_sizer_grows_at_once_and_shrinks_slowly():
+    sizer = manager.PoolSizer(
+        min_workers=1, max_workers=4, smoothing=1.0, utilization=1.0, shrink_after=10.0
+    )
+    for _ in range(2):
+        sizer.arrived()
+    sizer.served(1.0)
+    sizer.sample()
+
+    assert sizer.target(size=1, waiting=0, now=0.0) == 2
+    assert sizer.target(size=2, waiting=3, now=0.0) == 4
+
+    sizer.sample()
+    assert sizer.target(size=4, waiting=0, now=1.0) == 4
+    assert sizer.target(size=4, waiting=0, now=5.0) == 4
+    assert sizer.target(size=4, waiting=0, now=11.0) == 3
+    assert sizer.target(size=3, waiting=0, now=12.0) == 3
+
+
+def test_crash_tracker_backs_off_on_startup_crashes():
+    crashes = manager.CrashTracker(base_delay=1.0, max_delay=3.0, degrade_after=3)
+
+    delays = [crashes.record(1, lifetime=0.5, ready=False) for _ in range(3)]
+
+    assert delays == [1.0, 2.0, 3.0]
+    assert crashes.should_degrade()
+    assert crashes.record(0, lifetime=0.5, ready=True) == 0.0
+    assert not crashes.should_degrade()
+
+
+async def test_timed_out_workers_are_not_startup_crashes():
+    async def wait():
+        return -9
+
+    pool = manager.Pool(nursery=None, history=None, command_timeout=0.01, size=3)
+    for pid in range(3):
+        _send_stream, receive_stream = trio.testing.memory_stream_one_way_pair()
+        process = types.SimpleNamespace(pid=pid, kill=lambda: None, wait=wait)
+        hung = manager.Worker(process, pool.framing.receiver(receive_stream))
+        hung.started_at, hung.grammar_hash = trio.current_time(), "a"
+
+        assert await pool.wait_for_status(hung) is None
+        await pool.replace(hung)
+
+    assert pool.crashes.crashes == 0
+    assert not pool.prefer_backup_modules
+
+
+async def test_pool_retires_expired_workers_before_their_next_command():
+    started = []
+    nursery = types.SimpleNamespace(start_soon=lambda *args: started.append(args))
+    pool = manager.Pool(
+        nursery=nursery,
+        policy=utils.RecyclePolicy(max_seconds=10),
+        history=None,
+        size=2,
+        target=2,
+    )
+    old, young = make_worker(1), make_worker(2)
+    old.started_at = trio.current_time() - 20
+    young.started_at = trio.current_time()
+    pool.release(old)
+    pool.release(young)
+
+    assert await pool.get_worker() is young
+    assert old.retired
+    assert [args[0] for args in started] == [pool._retire, pool.add_new_process]
+
+
+def transcript(text, final=False):
+    return {"result": {"hypotheses": [{"transcript": text}], "final": final}}
+
+
+async def test_segment_runs_the_held_back_command_once_more_words_follow():
+    segment = manager.Segment()
+    done = {"worker_status": "done", "failed": False, "incomplete": False}
+
+    segment.offer(transcript("scroll down scroll down"))
+    command = await segment.take()
+    segment.finish({**done, "ran_words": 2})
+    segment.offer(transcript("scroll down scroll down"))
+    unchanged = await segment.take()
+    segment.offer(transcript("scroll down scroll down three", final=True))
+    final = await segment.take()
+
+    assert command["result"]["hypotheses"][0]["transcript"] == "scroll down scroll down"
+    assert command["partial"]
+    assert unchanged is None
+    assert final["result"]["hypotheses"][0]["transcript"] == "scroll down three"
+    assert not final["partial"]
+
+
+async def test_fallback_is_due_once_a_module_file_changes(monkeypatch, tmp_path):
+    monkeypatch.setenv("VOCA_CONFIG_DIR", str(tmp_path))
+    module_path = tmp_path / "user_modules" / "my_module.py"
+    module_path.parent.mkdir()
+    module_path.write_text("broken(")
+    fallback = manager.Fallback(["user_modules.my_module"], delay=math.inf)
+
+    before = fallback.due()
+    module_path.write_text("fixed = True")
+    os.utime(module_path, (0, fallback.mtimes["user_modules.my_module"] + 1))
+    after = fallback.due()
+    fallback.postpone()
+
+    assert manager.find_module_file("user_modules.my_module") == module_path
+    assert (before, after, fallback.due()) == (False, True, False)
+
+
+@pytest.mark.parametrize("hello", [b'{"token": "guess"}\n', b"\0\0\0\x02m{"])
+async def test_pool_refuses_remote_workers_without_its_token(hello, autojump_clock):
+    pool = manager.Pool(nursery=None, history=None, remote_token="secret")
+    client, server = trio.testing.memory_stream_pair()
+
+    await client.send_all(hello)
+    await pool.add_remote_worker(server)
+
+    assert pool.remote_workers == [] and pool.warming == []
+    assert await client.receive_some(1) == b""
+
+
+async def test_client_looks_up_the_window_once_per_utterance(monkeypatch):
+    lookups, read = [], []
+    released = trio.Event()
+
+    async def resolve_context():
+        lookups.append("editor")
+        await released.wait()
+        return {"title": "editor"}
+
+    async def receive():
+        for text in ["say", "say alpha", "say alpha say"]:
+            read.append(text)
+            yield json.dumps(transcript(text)).encode()
+
+    monkeypatch.setattr(manager, "resolve_context", resolve_context)
+    pool = manager.Pool(nursery=None, history=None)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(manager.handle_client, receive(), pool.state, pool, 2, 0.0)
+        await trio.testing.wait_all_tasks_blocked()
+        # Every partial was read while the lookup was still running.
+        assert read == ["say", "say alpha", "say alpha say"]
+        assert lookups == ["editor"]
+        released.set()
+
+
+def test_plugin_can_take_over_a_control_phrase():
+    store = state.StateStore()
+    machine = modes.ModeMachine.with_defaults()
+
+    assert machine.find("stop", store).control == "cancel"
+    machine.add_reported([modes.Transition("stop").to_dict()])
+
+    assert machine.find("stop", store).is_command()
+    assert machine.find("cancel", store).control == "cancel"
+
+
+async def run_client(monkeypatch, pool, messages):
+    cancelled = []
+
+    async def cancel_running(epoch):
+        cancelled.append(epoch.number)
+
+    async def resolve_context():
+        return {}
+
+    async def receive():
+        for data in messages:
+            yield json.dumps(data).encode()
+
+    monkeypatch.setattr(manager, "resolve_context", resolve_context)
+    monkeypatch.setattr(pool, "cancel_running", cancel_running)
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(manager.handle_client, receive(), pool.state, pool, 2, 0.0)
+        await trio.testing.wait_all_tasks_blocked()
+        nursery.cancel_scope.cancel()
+    return cancelled
+
+
+async def test_partial_stop_does_not_cancel_before_the_final(monkeypatch):
+    pool = manager.Pool(nursery=None, history=None)
+    messages = [transcript("stop"), transcript("stop recording", final=True)]
+
+    assert await run_client(monkeypatch, pool, messages) == []
+    assert await run_client(monkeypatch, pool, [transcript("stop", final=True)]) == [1]
+
+
+async def test_eager_mode_phrase_switches_once(monkeypatch):
+    pool = manager.Pool(nursery=None, history=None)
+    pool.state.set("modes.strict", False)
+    messages = [transcript("mode"), transcript("mode", final=True)]
+
+    await run_client(monkeypatch, pool, messages)
+
+    assert pool.state.get("modes.strict") is True
@@ -0,0 +1,97 @@
+import lark
+import pytest
+
+from voca import parsing
+from voca import utils
+
+
+def make_trie_parser(*patterns):
+    registry = utils.Registry()
+    for pattern in patterns:
+        registry.register(pattern)(lambda _: None)
+    rules = parsing.build_rules(registry)
+    grammar = parsing.build_grammar(registry, rules)
+    parser = lark.Lark(grammar, **parsing.EARLEY_DYNAMIC, maybe_placeholders=True)
+    return parsing.TrieParser(parser=parser, trie=parsing.build_trie(rules)), parser
+
+
+@pytest.mark.parametrize(
+    "pattern, words",
+    [
+        ('"monitor"', ("monitor",)),
+        ("\"scroll down\" 'fast'", ("scroll", "down", "fast")),
+        ('"alpha" NUMBER', None),
+        ('"alpha"i', None),
+        ('"a" | "b"', None),
+    ],
+)
+def test_literal_words(pattern, words):
+    assert parsing.literal_words(pattern) == words
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "monitor",
+        "scroll down monitor scroll",
+        "monitor alpha 3",
+        "alpha 3 monitor",
+        "scroll alpha 4 scroll down",
+    ],
+)
+def test_trie_parser_matches_lark(text):
+    trie_parser, parser = make_trie_parser(
+        '"monitor"', '"scroll"', '"scroll down"', '"alpha" NUMBER'
+    )
+
+    assert trie_parser.parse(text) == parser.parse(text)
+
+
+def test_trie_parser_defers_to_rules_sharing_a_first_word():
+    trie_parser, parser = make_trie_parser('"alpha"', '"alpha" NUMBER')
+
+    assert trie_parser.parse("alpha alpha 3") == parser.parse("alpha alpha 3")
+
+
+def test_trie_parser_raises_like_lark():
+    trie_parser, _parser = make_trie_parser('"monitor"')
+
+    with pytest.raises(lark.exceptions.LarkError):
+        trie_parser.parse("bravo")
+
+
+def test_grammar_cache_reuses_compiled_grammar(tmp_path):
+    registry = utils.Registry()
+    registry.register('"alpha" NUMBER')(lambda _: None)
+    rules = parsing.build_rules(registry)
+    grammar = parsing.build_grammar(registry, rules)
+    cache = parsing.GrammarCache(tmp_path)
+
+    first = parsing.build_parser(grammar, cache)
+    entries = sorted(tmp_path.iterdir())
+    second = parsing.build_parser(grammar, cache)
+
+    assert first.parse("alpha 3") == second.parse("alpha 3")
+    assert sorted(tmp_path.iterdir()) == entries
+
+
+def test_choose_parser_prefers_lalr_for_literal_grammars():
+    registry = utils.Registry()
+    registry.register('"alpha" NUMBER')(lambda _: None)
+    grammar = parsing.build_grammar(registry, parsing.build_rules(registry))
+
+    choice = parsing.choose_parser(grammar)
+
+    assert choice.options == parsing.LALR
+    assert choice.reasons == []
+
+
+def test_choose_parser_falls_back_for_free_text():
+    registry = utils.Registry()
+    registry.register('"say" /\\w.+/')(lambda _: None)
+    grammar = parsing.build_grammar(registry, parsing.build_rules(registry))
+
+    choice = parsing.choose_parser(grammar)
+
+    assert choice.options != parsing.LALR
+    assert choice.reasons
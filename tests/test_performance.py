@@ -8,7 +8,24 @@ import time
 from tests import helpers
 
 
-def test_manager_time():
+def ready_times(log_dir):
+    """Get the times the manager found its workers ready, from its log."""
+    times = []
+    for path in log_dir.glob("*.voca-log.jsonl"):
+        for line in path.read_text().splitlines():
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if (
+                message.get("action_type") == "voca.manager.Pool.wait_until_ready"
+                and message.get("action_status") == "succeeded"
+            ):
+                times.append(message["timestamp"])
+    return sorted(times)
+
+
+def test_manager_time(tmp_path):
     pid = os.getpid()
     sig = "SIGUSR1"
     num_utterances = 10
@@ -17,34 +34,32 @@ def test_manager_time():
     received_at = []
 
     def handler(_signum, _frame):
-        received_at.append(time.perf_counter())
+        received_at.append(time.time())
 
     signal.signal(signal.SIGUSR1, handler)
 
     rows = [helpers.make_command(utterance, final=True) for utterance in utterances]
     lines = ("\n".join(json.dumps(row) for row in rows) + "\n").encode()
+    # Send the commands right away: the manager holds them until a worker is ready.
     proc = subprocess.Popen(
         [sys.executable, "-m", "voca", "manage", "-i" "voca.plugins.basic"],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        env={**os.environ, "VOCA_PATCH_CASTER": "1"},
+        env={**os.environ, "VOCA_PATCH_CASTER": "1", "VOCA_CONFIG_DIR": str(tmp_path)},
     )
 
-    # Wait for startup.
-    time.sleep(10)
-
-    start = time.perf_counter()
-
     try:
-        proc.communicate(input=lines, timeout=10)
+        proc.communicate(input=lines, timeout=30)
     except subprocess.TimeoutExpired:
         pass
 
     time.sleep(10)
     proc.terminate()
+    proc.wait()
 
-    durations = [when - start for when in received_at]
+    ready = ready_times(tmp_path / "logs")
+    durations = [when - ready[0] for when in received_at]
 
     assert len(durations) == num_utterances
     assert durations == sorted(durations)
@@ -0,0 +1,53 @@
+import pytest
+import trio
+import trio.testing
+
+from voca import streaming
+
+
+@pytest.mark.parametrize("name", sorted(streaming.FRAMINGS))
+async def test_framing_round_trip(name):
+    framing = streaming.FRAMINGS[name]
+    send_stream, receive_stream = trio.testing.memory_stream_one_way_pair()
+    receiver = framing.receiver(receive_stream)
+    messages = [
+        {"result": {"hypotheses": [{"transcript": "say\nalpha"}], "final": True}},
+        {"control": "execute", "command_id": 3},
+    ]
+
+    # Split the frames at an awkward place.
+    data = b"".join(framing.encode(message) for message in messages)
+    data += framing.encode_log(b'{"message_type": "hello"}')
+    await send_stream.send_all(data[:3])
+    await send_stream.send_all(data[3:])
+    await send_stream.aclose()
+
+    received = [framing.decode(frame) async for frame in receiver]
+
+    assert received == messages + [{"message_type": "hello"}]
+
+
+async def test_length_prefixed_receiver_rejects_long_frames():
+    send_stream, receive_stream = trio.testing.memory_stream_one_way_pair()
+    receiver = streaming.LengthPrefixedFrameReceiver(receive_stream, max_frame_length=4)
+
+    await send_stream.send_all(streaming.LengthPrefixedFraming().encode({"a": 1}))
+
+    with pytest.raises(ValueError):
+        await receiver.receive()
+
+
+@pytest.mark.parametrize(
+    "encode",
+    [lambda line: line + b"\n", lambda line: streaming._LENGTH.pack(len(line)) + line],
+    ids=["lines", "length"],
+)
+async def test_detect_receiver(encode):
+    send_stream, receive_stream = trio.testing.memory_stream_one_way_pair()
+    lines = [b'{"result": {"final": true}}', b'{"result": {"final": false}}']
+
+    await send_stream.send_all(b"".join(encode(line) for line in lines))
+    await send_stream.aclose()
+    receiver = await streaming.detect_receiver(receive_stream)
+
+    assert [bytes(frame) async for frame in receiver] == lines
@@ -1,10 +1,14 @@
 import contextlib
 import os
 import json
+import socket
+import struct
 import secrets
 import subprocess
 import string
+import sys
 import textwrap
+import time
 
 from click.testing import CliRunner
 import pytest
@@ -40,8 +44,17 @@ def test_strict():
 
 @pytest.mark.usefixtures("virtual_display")
 def test_eager():
-    """Eager mode, not strict mode, executes non-final commands."""
-    utterances = ["say alpha", "say bravo", "mode", "say charlie", "say delta"]
+    """Eager mode, not strict mode, executes non-final commands.
+
+    The last command of a partial transcript waits for the words after it.
+    """
+    utterances = [
+        "say alpha",
+        "say bravo",
+        "mode",
+        "say charlie say delta",
+        "say charlie say delta say echo",
+    ]
 
     rows = [make_command(utterance, final=False) for utterance in utterances]
     lines = ("\n".join(json.dumps(row) for row in rows) + "\n").encode()
@@ -165,3 +178,749 @@ def test_config_module(tmp_path):
     # Then
     expected = ["KEY_X", "KEY_Y"]
     assert typed == expected
+
+
+def test_persistent_worker(tmp_path):
+    """A worker handles several commands before its recycle policy retires it."""
+
+    # Given
+    helpers.write_user_module(
+        tmp_path,
+        """\
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"nothing"')
+        async def _nothing(_):
+            pass
+        """,
+    )
+
+    # When
+    utterances = ["nothing"] * 3
+    lines = helpers.command_lines(utterances)
+
+    output = helpers.run(
+        ["worker", "-i", "user_modules.my_module", "--max-commands", "2"], input=lines
+    )
+
+    # Then
+    statuses = [
+        json.loads(line)
+        for line in output.decode().splitlines()
+        if line.startswith('{"worker_status"')
+    ]
+    assert [status["worker_status"] for status in statuses] == ["ready", "done", "done"]
+    assert [status["retiring"] for status in statuses[1:]] == [False, True]
+    assert len({status["pid"] for status in statuses}) == 1
+
+
+def test_fork_server(tmp_path):
+    """Workers forked from the fork server run commands and are replaced."""
+
+    # Given
+    output_path = tmp_path / "pids.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        import os
+
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"record"')
+        async def _record(_):
+            with open({str(output_path)!r}, "a") as f:
+                print(os.getpid(), file=f)
+        """,
+    )
+
+    # When
+    utterances = ["record"] * 3
+    lines = helpers.command_lines(utterances)
+
+    output = helpers.run(
+        [
+            "manage",
+            "-i",
+            "user_modules.my_module",
+            "--fork-server",
+            "--num-workers",
+            "1",
+            "--max-commands",
+            "1",
+        ],
+        input=lines,
+    )
+
+    # Then
+    pids = output_path.read_text().split()
+    assert len(set(pids)) == 3
+    # The fork server's log frames go to the manager's log, not its stdout.
+    assert output == b""
+
+
+def test_recycled_worker_is_replaced_from_a_spare(tmp_path):
+    """A worker past its command limit keeps serving until its spare is ready."""
+
+    # Given
+    output_path = tmp_path / "pids.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        import os
+
+        import trio
+
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"record"')
+        async def _record(_):
+            with open({str(output_path)!r}, "a") as f:
+                print(os.getpid(), file=f)
+            # Leave the spare time to start.
+            await trio.sleep(1)
+        """,
+    )
+
+    # When
+    lines = helpers.command_lines(["record"] * 4)
+
+    helpers.run(
+        [
+            "manage",
+            "-i",
+            "user_modules.my_module",
+            "--num-workers",
+            "1",
+            "--recycle-after",
+            "1",
+        ],
+        input=lines,
+    )
+
+    # Then
+    pids = output_path.read_text().split()
+    assert len(pids) == 4
+    assert len(set(pids)) > 1
+
+
+def test_crashing_workers_fall_back_to_backup_modules(tmp_path):
+    """Workers that keep dying on startup are restarted from the last modules that worked."""
+
+    # Given
+    output_path = tmp_path / "output.txt"
+    module_path = helpers.write_user_module(
+        tmp_path,
+        f"""\
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"record"')
+        async def _record(_):
+            with open({str(output_path)!r}, "a") as f:
+                print("recorded", file=f)
+        """,
+    )
+    line = helpers.command_lines(["record"])
+    args = ["manage", "-i", "user_modules.my_module", "--no-fork-server"]
+    args += ["--num-workers", "1"]
+    helpers.run(args, input=line)
+
+    # When
+    module_path.write_text("import os\nos._exit(3)\n")
+    helpers.run(args, input=line)
+
+    # Then
+    assert output_path.read_text().split() == ["recorded", "recorded"]
+
+
+def test_pool_recovers_once_the_broken_module_is_fixed(tmp_path):
+    """Workers go back to the plugins from the backups once the plugin file changes."""
+
+    # Given
+    output_path = tmp_path / "output.txt"
+    source = f"""\
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"record"')
+        async def _record(_):
+            with open({str(output_path)!r}, "a") as f:
+                print({{word!r}}, file=f)
+        """
+    module_path = helpers.write_user_module(tmp_path, source.format(word="recorded"))
+    args = ["--no-log", "manage", "-i", "user_modules.my_module", "--no-fork-server"]
+    args += ["--num-workers", "1", "--max-commands", "1"]
+    helpers.run(args, input=helpers.command_lines(["record"]))
+    module_path.write_text("import os\nos._exit(3)\n")
+
+    # When
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "voca"] + args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+    )
+    send(proc, ["record"])
+    wait_for(proc, lambda: output_path.read_text().split() != ["recorded"], timeout=60)
+    helpers.write_user_module(tmp_path, source.format(word="fixed"))
+    send(proc, ["record", "record"])
+    proc.stdin.close()
+    proc.wait(timeout=60)
+
+    # Then
+    output = output_path.read_text().split()
+    assert output[:2] == ["recorded", "recorded"]
+    assert output[-1] == "fixed"
+
+
+def test_pipelined_commands_run_in_order(tmp_path):
+    """Commands parsed in parallel still run in the order they were spoken."""
+
+    # Given
+    output_path = tmp_path / "order.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        import trio
+
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"slow"')
+        async def _slow(_):
+            await trio.sleep(0.5)
+            with open({str(output_path)!r}, "a") as f:
+                print("slow", file=f)
+
+
+        @registry.register('"fast"')
+        async def _fast(_):
+            with open({str(output_path)!r}, "a") as f:
+                print("fast", file=f)
+        """,
+    )
+
+    # When
+    utterances = ["slow", "fast", "slow", "fast"]
+    lines = helpers.command_lines(utterances)
+
+    helpers.run(
+        ["manage", "-i", "user_modules.my_module", "--num-workers", "2"], input=lines
+    )
+
+    # Then
+    assert output_path.read_text().split() == utterances
+
+
+def test_failed_command_keeps_its_place_in_order(tmp_path):
+    """A command that fails to parse still waits for the commands before it."""
+
+    # Given
+    output_path = tmp_path / "order.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        import trio
+
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"slow"')
+        async def _slow(_):
+            await trio.sleep(1)
+            with open({str(output_path)!r}, "a") as f:
+                print("slow", file=f)
+
+
+        @registry.register('"fast"')
+        async def _fast(_):
+            with open({str(output_path)!r}, "a") as f:
+                print("fast", file=f)
+        """,
+    )
+
+    # When
+    lines = helpers.command_lines(["slow", "unknown words", "fast"])
+
+    # Without logging its exception, the failed parse is back long before "slow" ends.
+    helpers.run(
+        ["--no-log", "manage", "-i", "user_modules.my_module", "--num-workers", "3"],
+        input=lines,
+    )
+
+    # Then
+    assert output_path.read_text().split() == ["slow", "fast"]
+
+
+def send(proc, utterances):
+    proc.stdin.write(helpers.command_lines(utterances))
+    proc.stdin.flush()
+
+
+def wait_for(proc, condition, timeout=30):
+    """Poll ``condition`` while the manager is still running."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert proc.poll() is None, "the manager exited"
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.05)
+
+
+def test_control_commands_skip_the_queue(tmp_path):
+    """Cancel, sleep, and wake take effect while a worker is busy.
+
+    Cancelling stops the running command as well as the queued ones.
+    """
+
+    # Given
+    output_path = tmp_path / "order.txt"
+    started_path = tmp_path / "started"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        import trio
+
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"record" NAME')
+        async def _record(args):
+            open({str(started_path)!r}, "w").close()
+            await trio.sleep(1)
+            with open({str(output_path)!r}, "a") as f:
+                print(args[0], file=f)
+        """,
+    )
+
+    # When
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "voca", "manage", "-i", "user_modules.my_module"]
+        + ["--num-workers", "1"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+    )
+    send(proc, ["record alpha"])
+    # Send the rest while the worker is running the first command.
+    wait_for(proc, started_path.exists)
+    send(
+        proc,
+        ["record bravo", "cancel", "sleep", "record charlie", "wake", "record delta"],
+    )
+    proc.stdin.close()
+    proc.wait(timeout=60)
+
+    # Then
+    assert output_path.read_text().split() == ["delta"]
+
+
+def test_command_timeout_replaces_hung_worker(tmp_path):
+    """A worker stuck in a command is killed, and later commands still run."""
+
+    # Given
+    output_path = tmp_path / "order.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        import time
+
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"hang"')
+        async def _hang(_):
+            time.sleep(60)
+
+
+        @registry.register('"record"')
+        async def _record(_):
+            with open({str(output_path)!r}, "a") as f:
+                print("record", file=f)
+        """,
+    )
+
+    # When
+    lines = helpers.command_lines(["hang", "record"])
+    helpers.run(
+        ["manage", "-i", "user_modules.my_module", "--num-workers", "1"]
+        + ["--command-timeout", "2"],
+        input=lines,
+        timeout=30,
+    )
+
+    # Then
+    assert output_path.read_text().split() == ["record"]
+
+
+def test_eager_runs_only_new_words(tmp_path):
+    """Eager mode runs each word of a refined partial transcript once."""
+
+    # Given
+    output_path = tmp_path / "order.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"note" NAME')
+        async def _note(args):
+            with open({str(output_path)!r}, "a") as f:
+                print(args[0], file=f)
+        """,
+    )
+
+    # When
+    partials = [
+        "note",
+        "note alpha",
+        "note alpha",
+        "note alpha note",
+        "note alpha note bravo",
+    ]
+    lines = helpers.command_lines(["mode"])
+    lines += helpers.command_lines(partials, final=False)
+    lines += helpers.command_lines(["note alpha note bravo"])
+
+    helpers.run(["manage", "-i", "user_modules.my_module"], input=lines)
+
+    # Then
+    assert output_path.read_text().split() == ["alpha", "bravo"]
+
+
+def test_eager_holds_back_a_command_that_may_grow(tmp_path):
+    """A partial's last command runs only once the words after it are known."""
+
+    # Given
+    output_path = tmp_path / "order.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"scroll" "down"')
+        async def _down(_):
+            with open({str(output_path)!r}, "a") as f:
+                print("down", file=f)
+
+
+        @registry.register('"scroll" "down" NAME')
+        async def _down_by(args):
+            with open({str(output_path)!r}, "a") as f:
+                print(args[0], file=f)
+        """,
+    )
+
+    # When
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "voca", "--no-log", "manage"]
+        + ["-i", "user_modules.my_module"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+    )
+    send(proc, ["mode"])
+    # Wait out the settle time between the partials, as a slow speaker would.
+    for partial in ["scroll down", "scroll down three"]:
+        proc.stdin.write(helpers.command_lines([partial], final=False))
+        proc.stdin.flush()
+        time.sleep(1)
+        assert proc.poll() is None, "the manager exited"
+    send(proc, ["scroll down three"])
+    proc.stdin.close()
+    proc.wait(timeout=60)
+
+    # Then
+    assert output_path.read_text().split() == ["three"]
+
+
+def test_strict_runs_final_after_speculative_parse(tmp_path):
+    """Partials parsed ahead in strict mode run only when the final matches."""
+
+    # Given
+    output_path = tmp_path / "order.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"note" NAME')
+        async def _note(args):
+            with open({str(output_path)!r}, "a") as f:
+                print(args[0], file=f)
+        """,
+    )
+
+    # When
+    lines = helpers.command_lines(["note", "note alpha"], final=False)
+    lines += helpers.command_lines(["note alpha"])
+    lines += helpers.command_lines(["note bra"], final=False)
+    lines += helpers.command_lines(["note bravo"])
+
+    helpers.run(["manage", "-i", "user_modules.my_module"], input=lines)
+
+    # Then
+    assert output_path.read_text().split() == ["alpha", "bravo"]
+
+
+def test_plugin_state_reaches_other_workers(tmp_path):
+    """A plugin's state change activates another plugin, even on another worker."""
+
+    # Given
+    output_path = tmp_path / "order.txt"
+    helpers.write_user_module(
+        tmp_path,
+        """\
+        from voca import state
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry, state={"notes.mode": "off"})
+
+
+        @registry.register('"notes on"')
+        async def _notes_on(_):
+            state.set("notes.mode", "on")
+        """,
+        name="switch",
+    )
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        from voca import context
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(
+            registry, context=context.StateContext("notes.mode", "on")
+        )
+
+
+        @registry.register('"note" NAME')
+        async def _note(args):
+            with open({str(output_path)!r}, "a") as f:
+                print(args[0], file=f)
+        """,
+        name="notes",
+    )
+
+    # When
+    lines = helpers.command_lines(["notes on", "note alpha"])
+    helpers.run(
+        ["--no-log", "manage", "-i", "user_modules.switch", "-i", "user_modules.notes"]
+        + ["--num-workers", "2"],
+        input=lines,
+    )
+
+    # Then
+    assert output_path.read_text().split() == ["alpha"]
+
+
+def test_socket_clients_have_their_own_modes(tmp_path):
+    """Clients on the manager's socket share its workers but not their modes."""
+
+    # Given
+    output_path = tmp_path / "output.txt"
+    socket_path = tmp_path / "voca.sock"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"record" NAME')
+        async def _record(args):
+            with open({str(output_path)!r}, "a") as f:
+                print(args[0], file=f)
+        """,
+    )
+
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "voca", "manage", "-i", "user_modules.my_module"]
+        + ["--num-workers", "2", "--socket", str(socket_path)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        while not socket_path.exists():
+            time.sleep(0.05)
+
+        # When
+        sleeper = socket.socket(socket.AF_UNIX)
+        sleeper.connect(str(socket_path))
+        speaker = socket.socket(socket.AF_UNIX)
+        speaker.connect(str(socket_path))
+        with sleeper, speaker:
+            frames = [
+                json.dumps(make_command(utterance)).encode()
+                for utterance in ["sleep", "record bravo"]
+            ]
+            sleeper.sendall(
+                b"".join(struct.pack(">I", len(frame)) + frame for frame in frames)
+            )
+            # The other client speaks after this one fell asleep.
+            time.sleep(0.5)
+            speaker.sendall(json.dumps(make_command("record alpha")).encode() + b"\n")
+            deadline = time.monotonic() + 30
+            while not output_path.exists() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            time.sleep(1)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    # Then
+    assert output_path.read_text().split() == ["alpha"]
+
+
+def test_remote_workers_run_only_remote_commands(tmp_path):
+    """Workers joining over TCP run the remote functions and hand back the rest.
+
+    Only workers that send the manager's token join.
+    """
+
+    # Given
+    output_path = tmp_path / "output.txt"
+    helpers.write_user_module(
+        tmp_path,
+        f"""\
+        import os
+        import time
+
+        from voca import utils
+
+
+        registry = utils.Registry()
+        wrapper = utils.Wrapper(registry)
+
+
+        @registry.register('"compute" NAME', remote=True)
+        async def _compute(args):
+            time.sleep(0.2)
+            with open({str(output_path)!r}, "a") as f:
+                print("compute", os.getpid(), file=f)
+
+
+        @registry.register('"press" NAME')
+        async def _press(args):
+            with open({str(output_path)!r}, "a") as f:
+                print("press", os.getpid(), file=f)
+        """,
+    )
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    module = ["-i", "user_modules.my_module"]
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "voca", "manage", *module, "--num-workers", "1"]
+        + ["--max-in-flight", "3", "--remote-port", str(port)]
+        + ["--remote-token", "secret"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+    )
+    remotes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "voca", "worker", *module]
+            + ["--connect", f"127.0.0.1:{port}", "--token", token],
+            stdout=subprocess.DEVNULL,
+        )
+        for token in ["secret", "secret", "guess"]
+    ]
+    remote_pids = {str(remote.pid) for remote in remotes[:2]}
+    refused_pid = str(remotes[2].pid)
+    try:
+
+        # When
+        deadline = time.monotonic() + 60
+        ran = []
+        while time.monotonic() < deadline:
+            send(proc, ["compute alpha", "press bravo", "compute charlie"])
+            time.sleep(1)
+            if not output_path.exists():
+                continue
+            ran = [line.split() for line in output_path.read_text().splitlines()]
+            if any(pid in remote_pids for _, pid in ran):
+                break
+    finally:
+        proc.stdin.close()
+        for process in [proc, *remotes]:
+            try:
+                process.wait(timeout=20)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    # Then
+    assert any(kind == "compute" and pid in remote_pids for kind, pid in ran)
+    assert not any(kind == "press" and pid in remote_pids for kind, pid in ran)
+    assert not any(pid == refused_pid for _, pid in ran)
+
+
+def test_remote_host_off_localhost_needs_a_token():
+    """The manager won't accept workers from other machines without a token."""
+
+    result = subprocess.run(
+        [sys.executable, "-m", "voca", "manage", "--remote-port", "0"]
+        + ["--remote-host", "0.0.0.0"],
+        stdin=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env={**os.environ, "VOCA_REMOTE_TOKEN": ""},
+    )
+
+    assert result.returncode != 0
+    assert b"--remote-token" in result.stderr
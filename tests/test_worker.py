@@ -0,0 +1,158 @@
+import io
+
+import pytest
+import trio
+import trio.testing
+
+from voca import state
+from voca import streaming
+from voca import utils
+from voca import worker
+
+
+def make_wrapper_group(*patterns):
+    wrappers = []
+    for pattern in patterns:
+        registry = utils.Registry()
+        registry.register(pattern)(lambda _: None)
+        wrappers.append(utils.Wrapper(registry, context=utils.NeverContext()))
+    return utils.WrapperGroup(wrappers)
+
+
+def test_handler_cache_evicts_least_recently_used():
+    cache = worker.HandlerCache(max_size=2)
+    built = []
+
+    def build(name):
+        built.append(name)
+        return name
+
+    cache.get(frozenset({0}), lambda: build("a"))
+    cache.get(frozenset({1}), lambda: build("b"))
+    cache.get(frozenset({0}), lambda: build("a again"))
+    cache.get(frozenset({2}), lambda: build("c"))
+
+    assert built == ["a", "b", "c"]
+    assert frozenset({0}) in cache
+    assert frozenset({1}) not in cache
+
+
+async def test_make_specific_handler_reuses_parser():
+    wrapper_group = make_wrapper_group('"alpha"', '"bravo"')
+    wrapper_group.wrappers[0].context = utils.AlwaysContext()
+    cache = worker.HandlerCache()
+
+    first = await worker.make_specific_handler(wrapper_group, {}, cache)
+    second = await worker.make_specific_handler(wrapper_group, {}, cache)
+
+    assert first is second
+    assert len(cache) == 1
+    assert first.parser.parse("alpha")
+    with pytest.raises(Exception):
+        first.parser.parse("bravo")
+
+
+def test_handler_key_history_keeps_recent_keys(tmp_path):
+    path = tmp_path / "handler_keys.json"
+    history = worker.HandlerKeyHistory(path, max_keys=2)
+    history.record("grammar", {0, 1})
+    history.record("grammar", {0, 2})
+    history.record("grammar", {0, 3})
+
+    reloaded = worker.HandlerKeyHistory(path)
+
+    assert reloaded.recent("grammar") == [frozenset({0, 3}), frozenset({0, 2})]
+    assert reloaded.recent("other grammar") == []
+
+
+def test_precompile_handlers_fills_cache():
+    wrapper_group = make_wrapper_group('"alpha"', '"bravo"', '"charlie"')
+    cache = worker.HandlerCache()
+
+    worker.precompile_handlers(
+        wrapper_group, cache, [frozenset({0, 2}), frozenset({5})]
+    )
+
+    assert frozenset({0, 2}) in cache
+    assert len(cache) == 1
+    [entry] = cache.describe()
+    assert entry["key"] == [0, 2] and entry["bytes"] > 0
+
+
+def test_handler_cache_sizes_handlers_only_when_measured():
+    wrapper_group = make_wrapper_group('"alpha"', '"bravo"')
+    cache = worker.HandlerCache()
+
+    cache.get(frozenset({0}), lambda: worker.precompile_handler(wrapper_group, {0}))
+
+    assert cache.describe() == [{"key": [0], "bytes": None}]
+    assert cache.unmeasured()
+    cache.measure()
+    [entry] = cache.describe()
+    assert entry["bytes"] > 0
+    assert not cache.unmeasured()
+
+
+@pytest.mark.parametrize(
+    "transcript, ran",
+    [
+        ("scroll down", None),
+        ("scroll down three", None),
+        ("scroll down three scroll down", "scroll down three"),
+        ("scroll down scroll down three", "scroll down"),
+    ],
+)
+def test_complete_prefix_holds_back_the_last_command(transcript, ran):
+    wrapper_group = make_wrapper_group('"scroll" "down"', '"scroll" "down" NAME')
+    parser = worker.build_handler(wrapper_group).parser
+    words = transcript.split()
+
+    prefix, ran_words = worker.complete_prefix(parser, words, parser.parse(transcript))
+
+    if ran is None:
+        assert prefix is None and ran_words == 0
+    else:
+        assert " ".join(words[:ran_words]) == ran
+        assert prefix == parser.parse(ran)
+
+
+def test_update_state_reports_only_real_changes(monkeypatch):
+    monkeypatch.setattr(state, "current", state.WorkerState())
+    state.current.apply(1, {"notes.mode": "off", "modes.strict": False})
+    data = {}
+
+    def execute(version, delta):
+        control = {"control": "execute", "state_version": version, "state_delta": delta}
+        return worker.update_state(data, control)
+
+    unchanged = execute(2, {})
+    same = execute(3, {"notes.mode": "off"})
+    changed = execute(4, {"notes.mode": "on"})
+
+    assert (unchanged, same, changed) == (False, False, True)
+    assert data["state"]["notes.mode"] == "on"
+    assert state.current.version == 4
+
+
+async def test_worker_switches_framing_when_the_manager_asks(monkeypatch):
+    lines = streaming.LineFraming()
+    length = streaming.LengthPrefixedFraming()
+    written = io.BytesIO()
+    monkeypatch.setattr(worker, "output", streaming.FrameWriter(lines, written))
+    send_stream, receive_stream = trio.testing.memory_stream_one_way_pair()
+    commands_send, commands_receive = trio.open_memory_channel(10)
+    controls_send, controls_receive = trio.open_memory_channel(10)
+    command = {"result": {"hypotheses": [{"transcript": "say alpha"}], "final": True}}
+
+    await send_stream.send_all(
+        lines.encode({"control": "framing", "framing": "length"})
+        + length.encode(command)
+    )
+    await send_stream.aclose()
+    await worker.route_frames(
+        lines.receiver(receive_stream), commands_send, controls_send
+    )
+
+    assert [data async for data in commands_receive] == [command]
+    assert worker.output.framing.name == "length"
+    assert lines.decode(written.getvalue())["worker_status"] == "framing"